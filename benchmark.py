@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+from constants import *
+from term_dictionary import TermDictionary
+from posting_codec import PostingsFile, decode_header, decode_doc_region, decode_posting_list, to_posting_tuples
+from word_processing import tokenize, nltk_tokenize, get_lemma, tag_map, stop_words
+
+import sys
+import getopt
+import pickle
+import timeit
+import time
+import csv
+import difflib
+import nltk
+
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [-n number-of-terms]")
+    print("       " + sys.argv[0] + " -c csv-file [-n number-of-documents] [-l]")
+
+
+def benchmark_codec(dict_file, postings_file, num_of_terms):
+    """
+    Compare the binary posting format against pickle on the most frequent terms of an index.
+
+    For each of the num_of_terms terms with the highest df, the posting list is read from the
+    index, and pickled again in memory as the list of tuples that pickle-based indexes stored.
+    We then report the size of both, and the time taken to decode them. The size and decoding
+    time of the doc region alone (what free text queries read) are reported as well.
+
+    Args:
+        dict_file (str): the dictionary filename
+        postings_file (str): the postings filename
+        num_of_terms (int): the number of terms to benchmark
+    """
+    dictionary = TermDictionary(dict_file)
+    terms = sorted(dictionary.terms(), key=lambda entry: entry[1][0], reverse=True)[:num_of_terms]
+
+    posting_file = PostingsFile(postings_file)
+    print("{:<20} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "term", "df", "pickle B", "binary B", "docs B", "pickle ms", "binary ms", "arrays ms", "docs ms"))
+
+    totals = [0] * 7
+    for term, (df, pointer) in terms:
+        record = bytes(posting_file.record(pointer))
+        offset, doc_length, _ = decode_header(record)
+        doc_region = record[offset:offset + doc_length]
+        pickled = pickle.dumps(to_posting_tuples(*decode_posting_list(record)))
+
+        repeat = max(1, 20000 // df)
+        results = [
+            len(pickled),
+            len(record),
+            offset + doc_length,
+            timeit.timeit(lambda: pickle.loads(pickled), number=repeat) / repeat * 1000,
+            timeit.timeit(lambda: to_posting_tuples(*decode_posting_list(record)), number=repeat) / repeat * 1000,
+            timeit.timeit(lambda: decode_posting_list(record), number=repeat) / repeat * 1000,
+            timeit.timeit(lambda: decode_doc_region(doc_region), number=repeat) / repeat * 1000,
+        ]
+        totals = [total + result for total, result in zip(totals, results)]
+        print("{:<20} {:>8} {:>10} {:>10} {:>10} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format(term, df, *results))
+
+    print("{:<20} {:>8} {:>10} {:>10} {:>10} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format("TOTAL", "", *totals))
+    posting_file.close()
+
+
+def benchmark_tokenizer(csv_file, num_of_docs):
+    """
+    Compare the single pass tokenizer (word_processing.tokenize()) against word_tokenize() and
+    sanitise_word() on the documents of a corpus.
+
+    Both tokenize the title and content of the first num_of_docs documents. We report the documents
+    where their tokens differ (with the first few differences), and the tokens per second of both.
+
+    Args:
+        csv_file (str): the csv file of the documents
+        num_of_docs (int): the number of documents to tokenize, or None for all of them
+    Returns:
+        int: the number of texts tokenized differently
+    """
+    texts = read_texts(csv_file, num_of_docs)
+
+    start = time.perf_counter()
+    nltk_tokens = [nltk_tokenize(text) for text in texts]
+    nltk_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast_tokens = [tokenize(text) for text in texts]
+    fast_time = time.perf_counter() - start
+
+    num_of_tokens = sum(len(tokens) for tokens in nltk_tokens)
+    num_of_differences = 0
+    for text_number, (expected, actual) in enumerate(zip(nltk_tokens, fast_tokens)):
+        if expected != actual:
+            num_of_differences += 1
+            if num_of_differences <= 10:
+                differences = [line for line in difflib.ndiff(expected, actual) if line[0] in '+-']
+                print("document {} ({}): {}".format(text_number // 2 + 1, ("title", "content")[text_number % 2], " ".join(differences[:10])))
+
+    print("{} texts, {} tokens, {} texts tokenized differently".format(len(texts), num_of_tokens, num_of_differences))
+    print("{:<20} {:>12}".format("tokenizer", "tokens/s"))
+    print("{:<20} {:>12.0f}".format("word_tokenize", num_of_tokens / nltk_time))
+    print("{:<20} {:>12.0f}".format("single pass", num_of_tokens / fast_time))
+    return num_of_differences
+
+
+
+def read_texts(csv_file, num_of_docs):
+    """
+    Read the title and content of the first num_of_docs documents of a corpus.
+
+    Args:
+        csv_file (str): the csv file of the documents
+        num_of_docs (int): the number of documents to read, or None for all of them
+    Returns:
+        list(str): the title and content of every document
+    """
+    csv.field_size_limit(2 ** 31 - 1)
+    with open(csv_file, newline='', encoding='UTF-8') as infile:
+        reader = csv.reader(infile)
+        next(reader, None)
+        texts = []
+        for row in reader:
+            texts.extend((row[1], row[2]))
+            if num_of_docs is not None and len(texts) >= 2 * num_of_docs:
+                break
+    return texts
+
+
+def benchmark_lemmatizer(csv_file, num_of_docs):
+    """
+    Compare the ways of lemmatizing the documents of a corpus, without the normalisation memo:
+    POS tagging every text on its own (as indexing used to), POS tagging all the texts in a single
+    batch (word_processing.get_wordnet_tags()), and lemmatizing without the tagger (USE_POS_TAGGER = False),
+    where every distinct token is only lemmatized once.
+
+    We report the tokens per second of each, and the fraction of tokens that get a different lemma
+    without the tagger.
+
+    Args:
+        csv_file (str): the csv file of the documents
+        num_of_docs (int): the number of documents to lemmatize, or None for all of them
+    """
+    token_lists = [[token for token in tokenize(text) if token not in stop_words] for text in read_texts(csv_file, num_of_docs)]
+    num_of_tokens = sum(len(token_list) for token_list in token_lists)
+
+    start = time.perf_counter()
+    for token_list in token_lists:
+        [get_lemma(token.lower(), tag_map[tag[0]]) for token, tag in nltk.pos_tag(token_list)]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tagged_lemmas = [[get_lemma(token.lower(), tag_map[tag[0]]) for token, tag in tagged] for tagged in nltk.pos_tag_sents(token_lists)]
+    batch_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lemma_table = {token: get_lemma(token, None) for token in set(token.lower() for token_list in token_lists for token in token_list)}
+    untagged_lemmas = [[lemma_table[token.lower()] for token in token_list] for token_list in token_lists]
+    untagged_time = time.perf_counter() - start
+
+    num_of_differences = sum(expected != actual for expected_list, actual_list in zip(tagged_lemmas, untagged_lemmas)
+                             for expected, actual in zip(expected_list, actual_list))
+    print("{} texts, {} tokens, {} distinct tokens, {:.2%} of the tokens lemmatized differently without the tagger".format(
+        len(token_lists), num_of_tokens, len(lemma_table), num_of_differences / num_of_tokens if num_of_tokens else 0))
+    print("{:<20} {:>12}".format("lemmatizer", "tokens/s"))
+    print("{:<20} {:>12.0f}".format("tagged per text", num_of_tokens / single_time))
+    print("{:<20} {:>12.0f}".format("tagged in batch", num_of_tokens / batch_time))
+    print("{:<20} {:>12.0f}".format("without tagger", num_of_tokens / untagged_time))
+
+if __name__ == "__main__":
+    dictionary_file = postings_file = csv_file = None
+    num_of_terms = 20
+    num_of_docs = None
+    compare_lemmatizers = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:n:c:l')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-n':
+            num_of_terms = num_of_docs = int(a)
+        elif o == '-c': # compare the tokenizers on a corpus instead
+            csv_file = a
+        elif o == '-l': # compare the lemmatizers on the corpus, rather than the tokenizers
+            compare_lemmatizers = True
+        else:
+            assert False, "unhandled option"
+
+    if csv_file != None and compare_lemmatizers:
+        benchmark_lemmatizer(csv_file, num_of_docs)
+        sys.exit(0)
+
+    if csv_file != None:
+        # Any difference is a bug of the single pass tokenizer, so that the comparison can be used as a check
+        sys.exit(1 if benchmark_tokenizer(csv_file, num_of_docs) else 0)
+
+    if dictionary_file == None or postings_file == None:
+        usage()
+        sys.exit(2)
+
+    benchmark_codec(dictionary_file, postings_file, num_of_terms)
@@ -0,0 +1,15 @@
+def parse_size(size):
+    """
+    Parse a human readable size, such as 512M, into a number of bytes.
+
+    Args:
+        size (str): the size, optionally suffixed with K, M or G
+
+    Returns:
+        int: the number of bytes
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
@@ -2,27 +2,57 @@
 
 # Indexing
 REMOVE_STOPWORDS = True
+USE_FAST_TOKENIZER = True   # tokenize with word_processing.tokenize() instead of word_tokenize() and sanitise_word()
 
 # Query processing
 USE_STEMMER = True
 USE_LEMMATIZER = True
+USE_POS_TAGGER = True      # lemmatize with the POS tag of every token, otherwise from the token alone (requires re-indexing)
 USE_PRF = False
 
 # Result ranking
 PHRASAL_WEIGHT = 1.7    # the higher it is, the more weight phrasal results has
 PRIORITY_WEIGHT = 1.1   # the higher it is, the more weight initial results has
 FILTER_STRENGTH = 0.6   # the smaller it is, the more forgiving is the filter (thus more results)
+TOP_K = None            # number of results returned per query (None for all), can be set with search.py -k
 
 ### INDEX ###
 DOCUMENT_LENGTH_KEYWORD = "LENGTH"
 IMPT_KEYWORD = "IMPORTANT"
-SPIMI_BLOCK_SIZE = 1000
+POSTING_FORMAT_KEYWORD = "FORMAT"
+POSTING_FORMAT_VERSION = 3      # version of the binary posting format, see posting_codec.py
+DOC_VALUES_KEYWORD = "DOCVALUES"    # court and date_posted of every document, see doc_values.py
+DOC_IDS_KEYWORD = "DOCIDS"          # doc id of every document ordinal, documents are numbered 0..N-1 in the index
+SPECIAL_KEYWORDS = [DOCUMENT_LENGTH_KEYWORD, IMPT_KEYWORD, POSTING_FORMAT_KEYWORD, DOC_VALUES_KEYWORD, DOC_IDS_KEYWORD]   # dictionary entries that are not terms
+TITLE_ZONE_PREFIX = "title:"    # title terms are indexed as separate terms with this prefix, which content terms never contain
+BIWORD_PREFIX = "biword:"      # pairs of consecutive words are indexed as "biword:first second" terms, see index.py -b
+BIWORD_MIN_DF = None            # pairs of consecutive words in at least this many documents are indexed as biwords (None to disable), can be set with index.py -b
+TERM_BLOCK_SIZE = 16            # number of front coded terms per block in the dictionary file
+TERM_CACHE_SIZE = 10000         # number of looked up terms (and misses) kept by an open dictionary, least recently used first
+SKIP_MIN_POSTINGS = 4096        # posting lists with at least this many postings get a skip table, see posting_codec.py
+SPIMI_BLOCK_MEMORY = 512 * 1024 * 1024   # estimated bytes of postings held in memory before a block is written
+SANITISE_CHUNK_SIZE = 16    # number of documents sanitised (and POS tagged) together, and sent to a worker at a time with -j
 POSTING_DIR = "temp_postings_result_dir/"
+SEGMENT_MANIFEST_SUFFIX = ".segments"   # the segments of an incrementally updated index are listed in <dictionary-file>.segments
+MAX_SEGMENTS = 8                        # adjacent segments are merged when an index has more segments than this
+
+### WORD PROCESSING ###
+NORMALISATION_MEMO_SUFFIX = ".memo"                 # lemmatized and stemmed tokens, saved by index.py and search.py in <dictionary-file>.memo for the next runs
+NORMALISATION_MEMO_SIZE = 500000                    # maximum number of normalised tokens in the memo
+
+### SEARCH ###
+POSTING_CACHE_MEMORY = 64 * 1024 * 1024  # estimated bytes of decoded posting lists cached across queries, can be set with search.py --cache-mem
+RESULT_CACHE_SUFFIX = ".cache"          # the results of past queries are cached on disk in the <dictionary-file>.cache directory
+RESULT_CACHE_SIZE = 16 * 1024 * 1024    # bytes of cached results kept on disk, can be set with search.py --result-cache (0 to disable)
 
 ### QUERY KEYWORD ###
 AND_KEYWORD = "AND"
 DOUBLE_QUOTE_KEYWORD = "\""
 QUERY_KEYWORDS = [AND_KEYWORD, DOUBLE_QUOTE_KEYWORD]
+COURT_FILTER = "court"      # court:"SG Court of Appeal"
+DATE_FILTER = "date"        # date:2015..2020, date:2015-06-01..2016, date:2018
+TITLE_FILTER = "title"      # title:"contract breach", every word must be in the title
+DATE_RANGE_KEYWORD = ".."
 
 ### QUERY EXPANSION ###
 EXPAND_NUM_OF_SYNONYMS = 3
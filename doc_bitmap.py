@@ -0,0 +1,172 @@
+import numpy as np
+
+CHUNK_BITS = 16                         # a chunk holds the doc ordinals sharing their high bits
+CHUNK_SIZE = 1 << CHUNK_BITS
+BITMAP_BYTES = CHUNK_SIZE // 8
+ARRAY_CONTAINER_MAX = 4096              # chunks with more documents are stored as bitmaps, which then take fewer bytes
+
+# Number of bits set in every byte
+POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.int64)
+
+
+class DocBitmap:
+    """A compressed set of doc ordinals, in the style of Roaring bitmaps.
+
+    The ordinals are split into chunks of CHUNK_SIZE by their high bits, and every chunk stores the low
+    bits of its documents in the smallest of two containers: a sorted uint16 array when it has at most
+    ARRAY_CONTAINER_MAX documents, or a packed bitmap of CHUNK_SIZE bits (uint8) otherwise. As documents
+    are densely numbered, the documents of a frequent term or of a broad clause fill a few bitmaps, and
+    intersecting or uniting them is a handful of vectorised byte operations, whatever their number.
+    """
+
+    def __init__(self, chunks=None):
+        """
+        Args:
+            chunks (dict): the container of every chunk, by high bits, see from_array()
+        """
+        self.chunks = chunks if chunks is not None else {}
+
+    @staticmethod
+    def from_array(doc_ids):
+        """
+        Args:
+            doc_ids (numpy.ndarray): sorted, unique doc ordinals
+        Returns:
+            DocBitmap: the set of the doc ordinals
+        """
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        chunks = {}
+        if len(doc_ids) > 0:
+            boundaries = np.flatnonzero(np.diff(doc_ids >> CHUNK_BITS)) + 1
+            for part in np.split(doc_ids, boundaries):
+                chunks[int(part[0]) >> CHUNK_BITS] = make_container((part & (CHUNK_SIZE - 1)).astype(np.uint16))
+        return DocBitmap(chunks)
+
+    def to_array(self):
+        """
+        Returns:
+            numpy.ndarray: the sorted doc ordinals of the set
+        """
+        parts = [(high << CHUNK_BITS) + get_lows(self.chunks[high]).astype(np.int64) for high in sorted(self.chunks)]
+        return np.concatenate(parts) if parts else np.array([], dtype=np.int64)
+
+    def contains(self, doc_ids):
+        """Check which doc ordinals are in the set, for all of them at once
+
+        Args:
+            doc_ids (numpy.ndarray): doc ordinals
+        Returns:
+            numpy.ndarray: a boolean for every doc ordinal
+        """
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        result = np.zeros(len(doc_ids), dtype=bool)
+        highs = doc_ids >> CHUNK_BITS
+        for high, container in self.chunks.items():
+            in_chunk = np.flatnonzero(highs == high)
+            result[in_chunk] = container_contains(container, (doc_ids[in_chunk] & (CHUNK_SIZE - 1)).astype(np.uint16))
+        return result
+
+    def __len__(self):
+        return sum(get_cardinality(container) for container in self.chunks.values())
+
+    def __and__(self, other):
+        chunks = {}
+        for high in self.chunks.keys() & other.chunks.keys():
+            container = container_and(self.chunks[high], other.chunks[high])
+            if get_cardinality(container) > 0:
+                chunks[high] = container
+        return DocBitmap(chunks)
+
+    def __or__(self, other):
+        chunks = dict(self.chunks)
+        for high, container in other.chunks.items():
+            chunks[high] = container_or(chunks[high], container) if high in chunks else container
+        return DocBitmap(chunks)
+
+    def __sub__(self, other):
+        """AND-NOT: the documents of this set that are not in other"""
+        chunks = {}
+        for high, container in self.chunks.items():
+            if high in other.chunks:
+                container = container_and_not(container, other.chunks[high])
+            if get_cardinality(container) > 0:
+                chunks[high] = container
+        return DocBitmap(chunks)
+
+
+def is_bitmap(container):
+    return container.dtype == np.uint8
+
+
+def make_container(lows):
+    """
+    Store the low bits of the documents of a chunk in the smallest container.
+
+    Args:
+        lows (numpy.ndarray): the sorted low bits, as uint16
+    Returns:
+        numpy.ndarray: a uint16 array container, or a uint8 bitmap container
+    """
+    if len(lows) <= ARRAY_CONTAINER_MAX:
+        return lows
+    bits = np.zeros(CHUNK_SIZE, dtype=bool)
+    bits[lows] = True
+    return np.packbits(bits, bitorder='little')
+
+
+def shrink_container(bitmap):
+    """Turn a bitmap container that lost documents back into an array container if it is small enough"""
+    if get_cardinality(bitmap) > ARRAY_CONTAINER_MAX:
+        return bitmap
+    return get_lows(bitmap)
+
+
+def get_lows(container):
+    if not is_bitmap(container):
+        return container
+    return np.flatnonzero(np.unpackbits(container, bitorder='little')).astype(np.uint16)
+
+
+def get_cardinality(container):
+    if not is_bitmap(container):
+        return len(container)
+    return int(POPCOUNT[container].sum())
+
+
+def container_contains(container, lows):
+    if not is_bitmap(container):
+        positions = np.minimum(np.searchsorted(container, lows), max(len(container) - 1, 0))
+        return container[positions] == lows if len(container) > 0 else np.zeros(len(lows), dtype=bool)
+    return ((container[lows >> 3] >> (lows & 7).astype(np.uint8)) & 1).astype(bool)
+
+
+def container_and(container1, container2):
+    if is_bitmap(container1) and is_bitmap(container2):
+        return shrink_container(container1 & container2)
+    if is_bitmap(container1):
+        container1, container2 = container2, container1
+    # container1 is an array, so the result is small
+    return container1[container_contains(container2, container1)]
+
+
+def container_or(container1, container2):
+    if is_bitmap(container1) and is_bitmap(container2):
+        return container1 | container2
+    if not is_bitmap(container1) and not is_bitmap(container2):
+        return make_container(np.union1d(container1, container2))
+    if is_bitmap(container1):
+        container1, container2 = container2, container1
+    # Set the bits of the array container1 in a copy of the bitmap container2
+    bits = np.unpackbits(container2, bitorder='little').astype(bool)
+    bits[container1] = True
+    return np.packbits(bits, bitorder='little')
+
+
+def container_and_not(container1, container2):
+    if not is_bitmap(container1):
+        return container1[~container_contains(container2, container1)]
+    if is_bitmap(container2):
+        return shrink_container(container1 & ~container2)
+    bits = np.unpackbits(container1, bitorder='little').astype(bool)
+    bits[container2] = False
+    return shrink_container(np.packbits(bits, bitorder='little'))
@@ -0,0 +1,96 @@
+import numpy as np
+import re
+
+
+def parse_date(date_posted):
+    """
+    Convert the date_posted of a document into an integer, e.g. '2002-07-12 00:00:00' -> 20020712,
+    so that dates can be compared as numbers.
+
+    Args:
+        date_posted (str): the date, starting with YYYY-MM-DD
+    Returns:
+        int: the date as YYYYMMDD, or 0 if it cannot be parsed
+    """
+    match = re.match(r'\s*(\d{4})-(\d{1,2})-(\d{1,2})', date_posted or '')
+    if match is None:
+        return 0
+    year, month, day = match.groups()
+    return int(year) * 10000 + int(month) * 100 + int(day)
+
+
+class DocValues:
+    """The court and date_posted of every document, stored column by column.
+
+    The doc ids (the ordinals of the documents in the index) are kept in a sorted array, and the i-th
+    entry of every other column belongs to the i-th doc id. Courts are few and repeated, so every court
+    name is stored once, and documents only store the number of their court (court_codes). Dates are stored as YYYYMMDD integers (see parse_date()).
+    Filtering the whole collection is then a couple of vectorised comparisons.
+    """
+
+    def __init__(self, doc_ids, courts, dates):
+        """
+        Args:
+            doc_ids (list(int)): the doc ids, in any order
+            courts (list(str)): the court of every document
+            dates (list(int)): the date of every document, as YYYYMMDD
+        """
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        self.courts, court_codes = np.unique(np.asarray(courts, dtype=object).astype(str), return_inverse=True)
+        self.courts = self.courts.tolist()
+
+        order = np.argsort(doc_ids, kind='stable')
+        self.doc_ids = doc_ids[order]
+        self.court_codes = court_codes.reshape(-1)[order].astype(np.uint16)
+        self.dates = np.asarray(dates, dtype=np.int32)[order]
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def select(self, courts=None, date_range=None):
+        """Get the doc ids of the documents matching every given condition
+
+        Args:
+            courts (list(str)): the documents must be from one of these courts (case insensitive), or None
+            date_range ((int, int)): the documents must be posted between these dates (inclusive, YYYYMMDD), or None
+        Returns:
+            numpy.ndarray: the sorted doc ids of the matching documents
+        """
+        mask = np.ones(len(self.doc_ids), dtype=bool)
+        if courts is not None:
+            wanted = {court.lower() for court in courts}
+            codes = [code for code, court in enumerate(self.courts) if court.lower() in wanted]
+            mask &= np.isin(self.court_codes, codes)
+        if date_range is not None:
+            mask &= (self.dates >= date_range[0]) & (self.dates <= date_range[1])
+        return self.doc_ids[mask]
+
+
+def merge_doc_values(doc_values_list, ordinal_maps=None):
+    """
+    Merge the doc values of several blocks or segments. When a document appears more than once,
+    the one from the latest doc values wins.
+
+    Args:
+        doc_values_list (list(DocValues)): the doc values to merge, oldest first
+        ordinal_maps (list(numpy.ndarray)): for every doc values, the new ordinal of every document,
+                                            or -1 to drop it (see segments.merge_live_documents()), or None
+    Returns:
+        DocValues: the merged doc values
+    """
+    doc_ids, courts, dates = [], [], []
+    for number, doc_values in enumerate(doc_values_list):
+        new_doc_ids = doc_values.doc_ids if ordinal_maps is None else ordinal_maps[number][doc_values.doc_ids]
+        live = new_doc_ids >= 0
+        doc_ids.append(new_doc_ids[live])
+        courts.append(np.asarray(doc_values.courts, dtype=object)[doc_values.court_codes[live]])
+        dates.append(doc_values.dates[live])
+
+    if not doc_ids:
+        return DocValues([], [], [])
+    doc_ids, courts, dates = np.concatenate(doc_ids), np.concatenate(courts), np.concatenate(dates)
+
+    # Keep the last occurrence of every document
+    _, last = np.unique(doc_ids[::-1], return_index=True)
+    keep = len(doc_ids) - 1 - last
+    return DocValues(doc_ids[keep], courts[keep], dates[keep])
@@ -1,14 +1,16 @@
 from constants import *
 from collections import Counter
-from index_helper import get_word_list
+from index_helper import get_doc_arrays
 from scoring import rank_document_ids
 from query_util import get_query_term_vector
 
+import numpy as np
 import math
 import pickle
 
 
-def free_text_search(query_list, dictionary, posting_file, tagged_prio_list, do_ranking=True):
+def free_text_search(query_list, dictionary, posting_file, tagged_prio_list, do_ranking=True, doc_filter=None, top_k=None,
+                     fetched_postings=None):
     """
     Rank the list of document based on the query given.
 
@@ -24,6 +26,10 @@ def free_text_search(query_list, dictionary, posting_file, tagged_prio_list, do_
         posting_file (str): address to the posting file list
         tagged_prio_list (set): set of valid doc_id from phrasal queries in the given query text
         do_ranking (bool): Whether ranking should be performed, or an unsorted list is sufficient
+        doc_filter (numpy.ndarray): if given, only these doc ids are retrieved (the filters of the query)
+        top_k (int): if given, only the top_k best doc_id's are returned when ranking
+        fetched_postings (dict): the (doc ids, term frequencies) of the terms already fetched, already
+                                 filtered with doc_filter (see query_plan.py), or None
     Returns:
         if do_ranking:
             list(int): The list of doc_id's sorted by score
@@ -34,47 +40,93 @@ def free_text_search(query_list, dictionary, posting_file, tagged_prio_list, do_
     query_keys = list(query_counter.keys())
     query_term_vector = get_query_term_vector(query_keys, query_counter, dictionary)
 
-    # dictionary["LENGTH"] is the normalize denominator for a particular document_id which precomputed in index stage
-    ranking_list = []
+    # positions are never needed here, so only the doc ids and term frequencies are read
     potential_document_id = set()
-    document_term_dict = {}
-
-    # initialize the dictionary
+    term_postings = []
     for term in query_keys:
-        document_term_dict[term] = {}
+        if fetched_postings is not None and term in fetched_postings:
+            doc_ids, tfs = fetched_postings[term]
+        else:
+            doc_ids, tfs = get_doc_arrays(term, dictionary, posting_file, doc_filter)
+        potential_document_id.update(doc_ids.tolist())
+        term_postings.append((doc_ids, tfs))
 
-    # calculate tf_score for each term (if it exists in the dictionary)
-    for term in query_keys:
-        tf_score = 0
-        posting_list = get_word_list(term, dictionary, posting_file)
+    # Without ranking
+    if not do_ranking:
+        return list(potential_document_id)
 
-        for (doc_id, term_freq, _) in posting_list:
-            tf_score = 1 + math.log(term_freq, 10)  # tf
-            document_term_dict[term][doc_id] = tf_score / dictionary[DOCUMENT_LENGTH_KEYWORD][doc_id]  # normalize score
-            potential_document_id.add(doc_id)
+    # With ranking, the scores of all the documents are accumulated in an array indexed by the
+    # ordinal of the document, one whole posting list at a time:
+    # score += query weight * (1 + log10(tf)) / LENGTH (the length is precomputed in index stage)
+    doc_id_table, length_table = get_length_table(dictionary[DOCUMENT_LENGTH_KEYWORD])
+    scores = np.zeros(len(length_table))
+    for (doc_ids, tfs), query_weight in zip(term_postings, query_term_vector):
+        ordinals = to_ordinals(doc_id_table, doc_ids)
+        scores[ordinals] += get_tf_weights(tfs) / length_table[ordinals] * query_weight
 
-    # With ranking
-    if (do_ranking):
-        # Calculate score for each document
-        for doc_id in potential_document_id:
-            score = []
+    # Final score for each document
+    candidates = list(potential_document_id)
+    candidate_scores = scores[to_ordinals(doc_id_table, np.array(candidates, dtype=np.int64))].tolist()
+    ranking_list = list(zip(candidates, candidate_scores))
 
-            # Iterate for each term score
-            for i in range(len(query_keys)):
-                term = query_keys[i]
+    ranking_list = rank_document_ids(ranking_list, tagged_prio_list, top_k)
+    return [x for x, y in ranking_list]
 
-                if (term not in document_term_dict or doc_id not in document_term_dict[term]):
-                    score.append(0)
-                else:
-                    score.append(document_term_dict[term][doc_id] * query_term_vector[i])
 
-            # Final score for document
-            score = sum(score)
-            ranking_list.append((doc_id, score))
+def get_tf_weights(tfs):
+    """
+    Compute the tf weight, 1 + log10(tf), of every term frequency.
 
-        ranking_list = rank_document_ids(ranking_list, tagged_prio_list)
-        return [x for x, y in ranking_list]
+    Term frequencies take few distinct values, so the logarithm is only computed once per value,
+    with math.log like the rest of the scoring.
 
-    # Without ranking
-    else:
-        return list(potential_document_id)
+    Args:
+        tfs (numpy.ndarray): the term frequencies
+    Returns:
+        numpy.ndarray: the tf weights
+    """
+    unique_tfs, inverse = np.unique(tfs, return_inverse=True)
+    return np.array([1 + math.log(tf, 10) for tf in unique_tfs.tolist()])[inverse.reshape(-1)]
+
+
+# The length table of the last LENGTH dictionary, for indexes written before document ordinals
+length_table_cache = {}
+
+
+def get_length_table(lengths):
+    """
+    Get the document lengths of an index as an array indexed by document ordinal.
+
+    LENGTH is already such an array, as postings are keyed by ordinal. Indexes written before
+    ordinals keyed LENGTH by doc id, so their documents are given an ordinal here: the rank of
+    their doc id among the sorted doc ids.
+
+    Args:
+        lengths (numpy.ndarray or dict): the LENGTH entry of the dictionary
+    Returns:
+        (numpy.ndarray, numpy.ndarray): the sorted doc ids (None if the postings use ordinals),
+                                        and the length of every ordinal
+    """
+    if isinstance(lengths, np.ndarray):
+        return None, lengths
+
+    if length_table_cache.get('lengths') is not lengths:
+        doc_ids = np.fromiter(lengths.keys(), dtype=np.int64, count=len(lengths))
+        values = np.fromiter(lengths.values(), dtype=np.float64, count=len(lengths))
+        order = np.argsort(doc_ids)
+        length_table_cache['lengths'] = lengths
+        length_table_cache['table'] = (doc_ids[order], values[order])
+    return length_table_cache['table']
+
+
+def to_ordinals(doc_id_table, doc_ids):
+    """
+    Get the ordinal of some documents (see get_length_table()).
+
+    Args:
+        doc_id_table (numpy.ndarray): the sorted doc ids, or None if the postings use ordinals
+        doc_ids (numpy.ndarray): the doc ids, as read from the posting lists
+    Returns:
+        numpy.ndarray: the ordinals
+    """
+    return doc_ids if doc_id_table is None else np.searchsorted(doc_id_table, doc_ids)
@@ -1,10 +1,17 @@
 #!/usr/bin/python3
 from constants import *
 from collections import Counter
-from spimi import invert, merge_files
-from word_processing import sanitise
+from spimi import BlockBuilder, merge_blocks
+from cli_util import parse_size
+from word_processing import sanitise_texts, memo
+from segments import load_manifest, save_manifest, new_segment, add_segment, delete_documents, apply_merge_policy, compact_index, remove_segments, remove_segment_files, get_biwords
+from index_helper import get_biword
+from query_util import QueryType, extract_filters, categorise_query, stem_clauses
 from tqdm import tqdm
+from itertools import islice
+from multiprocessing import Pool
 
+import numpy as np
 import re
 import nltk
 import sys
@@ -12,20 +19,168 @@ import getopt
 import os
 import csv
 import shutil
-import math
 
 def usage():
-    print("usage: " + sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file")
+    print("usage: " + sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file [-j number-of-workers] [--block-mem size]"
+          + " [-a] [-x file-of-deleted-doc-ids] [-c] [-b biword-min-df] [--biword-log file-of-queries]")
+
+
+def write_block(block, block_number, reason):
+    """
+    Write a block of documents into its temporary dictionary and posting files.
+
+    Args:
+        block (BlockBuilder): the block
+        block_number (int): the number of the block
+        reason (str): why the block is being written, for reporting
+    """
+    print('Writing block number {}: {} documents, ~{:.1f} MB ({})'.format(
+        block_number + 1, block.num_of_docs, block.nbytes / 1024 ** 2, reason))
+    block.write(POSTING_DIR + 'temp_dictionary_' + str(block_number) + '.txt', POSTING_DIR + 'temp_posting_' + str(block_number) + '.txt')
+
+
+def sanitise_rows(rows):
+    """
+    Sanitise the content of a batch of csv rows. The titles and contents of all the rows are
+    sanitised together, so that they are POS tagged in a single batch.
+
+    This is kept at module level so that it can be sent to the worker processes.
+
+    Args:
+        rows (list(list)): the csv rows, (doc_id, title, content, date_posted, court)
+
+    Returns:
+        list((int, list, list, str, str)): for every row, the doc id, the list of tokens of the content
+                                           and of the title, the court and the date_posted
+    """
+    token_lists = sanitise_texts([text for _, title, content, _, _ in rows for text in (content, title)])
+    return [(int(doc_id), token_lists[2 * i], token_lists[2 * i + 1], court, date_posted)
+            for i, (doc_id, _, _, date_posted, court) in enumerate(rows)]
+
+
+def start_worker(memo_terms):
+    """
+    Initialise a worker process with the terms of the normalisation memo, so that it records the terms it adds to it.
+
+    Args:
+        memo_terms (dict): the terms of the memo of the main process
+    """
+    memo.terms = memo_terms
+    memo.pop_new_terms()
+
+
+def sanitise_rows_in_worker(rows):
+    """
+    Sanitise a batch of csv rows in a worker process (see sanitise_rows()).
+
+    Args:
+        rows (list(list)): the csv rows, (doc_id, title, content, date_posted, court)
+
+    Returns:
+        (list, int, int, dict): the fields of every document, the hits and misses of the normalisation memo,
+                                and the terms added to the memo
+    """
+    hits, misses = memo.hits, memo.misses
+    documents = sanitise_rows(rows)
+    return documents, memo.hits - hits, memo.misses - misses, memo.pop_new_terms()
+
+
+def sanitise_documents(rows, num_workers):
+    """
+    Sanitise a stream of csv rows, yielding the fields of every document (see sanitise_rows())
+    in the same order as the rows. The rows are sanitised SANITISE_CHUNK_SIZE at a time.
+
+    With more than one worker, the rows are read in batches and sanitised by a pool of processes.
+    The next batch is already submitted while the current one is being consumed, so that the workers
+    are kept busy, while only two batches of rows are ever held in memory. The terms the workers add
+    to their normalisation memo, and their hits and misses, are sent back to the memo of this process.
+
+    Args:
+        rows (iterator): iterator over the csv rows (without the header)
+        num_workers (int): number of worker processes to use
+
+    Yields:
+        (int, list, list, str, str): the doc id, the list of tokens of the content and of the title,
+                                     the court and the date_posted
+    """
+    if num_workers <= 1:
+        for chunk in iter(lambda: list(islice(rows, SANITISE_CHUNK_SIZE)), []):
+            yield from sanitise_rows(chunk)
+        return
+
+    batch_size = num_workers * SANITISE_CHUNK_SIZE * 4
+    with Pool(num_workers, initializer=start_worker, initargs=(memo.terms,)) as pool:
+        pending = None
+        while True:
+            batch = list(islice(rows, batch_size))
+            chunks = [batch[i:i + SANITISE_CHUNK_SIZE] for i in range(0, len(batch), SANITISE_CHUNK_SIZE)]
+            submitted = pool.map_async(sanitise_rows_in_worker, chunks, 1) if batch else None
+            if pending is not None:
+                for documents, hits, misses, new_terms in pending.get():
+                    memo.hits += hits
+                    memo.misses += misses
+                    for key, term in new_terms.items():
+                        memo.add(key, term)
+                    yield from documents
+            if submitted is None:
+                break
+            pending = submitted
+
+
+def read_biword_log(log_file):
+    """
+    Get the biwords of the phrases of a query log, so that they are indexed whatever their frequency.
+
+    The phrases are sanitised like the queries of search.py, and every pair of consecutive words of a phrase
+    is a biword, so that longer phrases can also be answered from the biword index (see phrasal_query.py).
+
+    Args:
+        log_file (str): the file of queries, one per line
+
+    Returns:
+        set(str): the biwords
+    """
+    with open(log_file, 'r', encoding='utf8') as infile:
+        queries = [line for line in infile.read().splitlines() if line.strip()]
+
+    biwords = set()
+    for query in queries:
+        query_text, _ = extract_filters(query)
+        for and_clause in stem_clauses(categorise_query(query_text) or []):
+            for clause, clause_type in and_clause:
+                if clause_type == QueryType.PHRASAL:
+                    words = nltk.word_tokenize(clause)
+                    biwords.update(get_biword(words[i], words[i + 1]) for i in range(len(words) - 1))
+    return biwords
+
 
 # main function
-def build_index(input_directory, out_dict, out_postings):
+def build_index(input_directory, out_dict, out_postings, num_workers=1, block_memory_budget=SPIMI_BLOCK_MEMORY,
+                biword_min_df=BIWORD_MIN_DF, biwords=None):
     """
     Build index from the csv file, then output the dictionary file and postings file.
 
+    A block is written whenever the estimated memory of its documents reaches block_memory_budget.
+
+    Documents are numbered 0..N-1 in the order of the csv, and the index only uses these dense ordinals:
+    postings, LENGTH and IMPORTANT are keyed by ordinal, and the doc ids of the csv are only kept in
+    a table (DOC_IDS_KEYWORD) used to translate the search results back. A doc id appearing more than once
+    in the csv is only indexed from its first row, the others are skipped (and counted), so that df and the
+    posting lists only count every document once.
+
+    Pairs of consecutive words are indexed as biwords (see index_helper.get_biword()) if they are in biwords,
+    or if they appear in at least biword_min_df documents. As the df of a pair is only known once the
+    blocks are merged, every pair is indexed in the blocks when biword_min_df is given, and the infrequent
+    ones are dropped by the merge.
+
     Args:
         input_directory (str): input csv filename
         out_dict (str): output dictionary filename
         out_postings (str): output postings filename
+        num_workers (int): number of processes used to sanitise the documents
+        block_memory_budget (int): memory budget of a SPIMI block, in bytes
+        biword_min_df (int): the df from which pairs of consecutive words are indexed, or None
+        biwords (set(str)): biwords that are indexed whatever their df, e.g. from a query log (see read_biword_log())
     """
     stemmer = nltk.stem.PorterStemmer()
     lemmatizer = nltk.stem.WordNetLemmatizer()
@@ -57,100 +212,170 @@ def build_index(input_directory, out_dict, out_postings):
     with open(input_directory, newline='', encoding='UTF-8') as f:
         reader = csv.reader(f)
 
-        # this is the tokens that will be passed through to the invert() function
-        multiple_doc_list = []
+        # The postings of the current block are accumulated here, one document at a time
+        with_biwords = biword_min_df is not None or bool(biwords)
+        new_block = lambda: BlockBuilder(with_biwords, biwords if biword_min_df is None else None)
+        block = new_block()
 
         num_of_blocks = 0
-        files_in_block = 0
+        block_sizes = []
 
-        for idx, row in tqdm(enumerate(reader)):
-            # Skip first row
-            if idx == 0:
-                continue
+        # doc id -> ordinal, a doc id appearing twice in the csv keeps its first row
+        ordinals = {}
+        num_of_duplicates = 0
 
-            # # End if limit is reached, for testing purposes
-            # if idx == limit:
-            #     break
+        # Skip first row
+        next(reader, None)
 
-            doc_id, title, content, date_posted, court = row
+        # # End if limit is reached, for testing purposes
+        # reader = islice(reader, limit)
 
-            token_list = sanitise(content)
-            multiple_doc_list.append((int(doc_id), token_list))
-            files_in_block += 1
+        # The documents come back in the csv order, so the blocks are the same whatever the number of workers
+        for doc_id, token_list, title_list, court, date_posted in tqdm(sanitise_documents(reader, num_workers)):
+            if doc_id in ordinals:
+                num_of_duplicates += 1
+                continue
+            ordinal = ordinals[doc_id] = len(ordinals)
+            block.add_document(ordinal, token_list, title_list, court, date_posted)
 
-            # If the number of files scanned has reach block size, then invert first
-            if files_in_block == SPIMI_BLOCK_SIZE:
-                print('Inverting block number ' + str(num_of_blocks + 1))
-                multiple_doc_list.sort()
-                invert(multiple_doc_list, POSTING_DIR + 'temp_dictionary_0_' + str(num_of_blocks) + '.txt', POSTING_DIR + 'temp_posting_0_' + str(num_of_blocks) + '.txt')
+            # If the estimated memory of the block has reached the budget, then write it first
+            if block.nbytes >= block_memory_budget:
+                write_block(block, num_of_blocks, 'memory budget reached')
+                block_sizes.append((block.num_of_docs, block.nbytes))
                 num_of_blocks += 1
-                files_in_block = 0
-                multiple_doc_list = []
-
-    # Invert the remaining block
-    if (files_in_block != 0):
-        print('Inverting block number ' + str(num_of_blocks + 1))
-        multiple_doc_list.sort()
-        invert(multiple_doc_list, POSTING_DIR + 'temp_dictionary_0_' + str(num_of_blocks) + '.txt', POSTING_DIR + 'temp_posting_0_' + str(num_of_blocks) + '.txt')
+                block = new_block()
+
+    # Write the remaining block
+    if block.num_of_docs != 0:
+        write_block(block, num_of_blocks, 'end of input')
+        block_sizes.append((block.num_of_docs, block.nbytes))
         num_of_blocks += 1
-        multiple_doc_list = []
-
-
-    # MERGING STAGE, binary merging (iterate until height of binary tree)
-    for i in range(math.ceil(math.log(num_of_blocks, 2))):
-        # Generation: #i
-        k = 0
-        for j in range(0, num_of_blocks, 2):
-            if j + 1 < num_of_blocks:
-                # do the merging process
-                # Merging block: j and j+1
-                merge_files(POSTING_DIR + 'temp_dictionary_' + str(i) + '_' + str(j) + '.txt', POSTING_DIR + 'temp_posting_'+str(i) + '_' + str(j) + '.txt',
-                            POSTING_DIR + 'temp_dictionary_' + str(i) + '_' + str(j+1) + '.txt', POSTING_DIR + 'temp_posting_'+str(i) + '_' + str(j+1) + '.txt',
-                            POSTING_DIR + 'temp_dictionary_' + str(i+1) + '_' + str(k) + '.txt', POSTING_DIR + 'temp_posting_'+str(i+1) + '_' + str(k) + '.txt')
-            else:
-                # when the number is odd (left only the last data), copy the final block instead
-                # Copying block: j
-                shutil.move(POSTING_DIR + 'temp_dictionary_' + str(i) + '_' + str(j) + '.txt', POSTING_DIR + 'temp_dictionary_' + str(i+1) + '_' + str(k) + '.txt')
-                shutil.move(POSTING_DIR + 'temp_posting_' + str(i) + '_' + str(j) + '.txt', POSTING_DIR + 'temp_posting_' + str(i+1) + '_' + str(k) + '.txt')
-            k += 1
-        num_of_blocks = k
+        block = None
 
-    try:
-        # rename the merged posting and dictionary files, for clarity
-        shutil.move(POSTING_DIR + 'temp_posting_' + str(i+1) + '_' + str(k-1) + '.txt', out_postings)
-        shutil.move(POSTING_DIR + 'temp_dictionary_' + str(i+1) + '_' + str(k-1) + '.txt', out_dict)
-    except Exception as ex:
-        # this is to prevent when we only want to index 1 file
-        shutil.move(POSTING_DIR + 'temp_posting_0_0.txt', out_dict)
-        shutil.move(POSTING_DIR + 'temp_dictionary_0_0.txt', out_postings)
+    if num_of_duplicates:
+        print('Skipped {} rows whose doc id was already indexed from an earlier row'.format(num_of_duplicates))
+    if block_sizes:
+        print('Wrote {} blocks, {} to {} documents, ~{:.1f} MB at most (budget {:.1f} MB)'.format(
+            num_of_blocks, min(docs for docs, _ in block_sizes), max(docs for docs, _ in block_sizes),
+            max(memory for _, memory in block_sizes) / 1024 ** 2, block_memory_budget / 1024 ** 2))
+    print('Normalisation memo: {:.1%} hit rate ({} hits, {} misses), {} terms'.format(
+        memo.get_hit_rate(), memo.hits, memo.misses, len(memo.terms)))
+
+    # Only the biwords that are frequent enough, or asked for, are kept
+    keep_term = None
+    if biword_min_df is not None:
+        keep_term = lambda term, df: not term.startswith(BIWORD_PREFIX) or df >= biword_min_df or term in (biwords or ())
+
+    # MERGING STAGE, a single k-way merge of all the blocks
+    print('Merging ' + str(num_of_blocks) + ' blocks')
+    merge_blocks([POSTING_DIR + 'temp_dictionary_' + str(i) + '.txt' for i in range(num_of_blocks)],
+                 [POSTING_DIR + 'temp_posting_' + str(i) + '.txt' for i in range(num_of_blocks)],
+                 out_dict, out_postings, np.fromiter(ordinals.keys(), dtype=np.int64, count=len(ordinals)), keep_term)
+
+
+def update_index(input_directory, out_dict, out_postings, deleted_doc_ids, num_workers=1, block_memory_budget=SPIMI_BLOCK_MEMORY):
+    """
+    Incrementally update an existing index, without rebuilding it.
+
+    The documents in the csv file are indexed into a new segment, replacing any older version of them,
+    and the deleted documents are tombstoned (see segments.py). Segments are then merged according to
+    the merge policy.
+
+    The new segment indexes every biword of the existing segments, whatever its df in the new documents,
+    so that the posting list of a biword is complete in every segment it could appear in.
+
+    Args:
+        input_directory (str): input csv filename of the documents to add or update, or None
+        out_dict (str): dictionary filename of the index
+        out_postings (str): postings filename of the index
+        deleted_doc_ids (list(int)): doc ids of the documents to delete
+        num_workers (int): number of processes used to sanitise the documents
+        block_memory_budget (int): memory budget of a SPIMI block, in bytes
+    """
+    manifest = load_manifest(out_dict, out_postings)
+    delete_documents(manifest, deleted_doc_ids)
+
+    if input_directory is not None:
+        segment = new_segment(manifest, out_dict, out_postings)
+        build_index(input_directory, segment['dictionary'], segment['postings'], num_workers, block_memory_budget,
+                    biword_min_df=None, biwords=get_biwords(manifest))
+        add_segment(manifest, segment)
+
+    merged_segments = apply_merge_policy(manifest)
+    save_manifest(out_dict, manifest)
+    remove_segment_files(merged_segments, manifest)
+    print('Index has {} segments and {} tombstones'.format(len(manifest['segments']), len(manifest['tombstones'])))
 
 
 # Main function starts here
-input_directory = output_file_dictionary = output_file_postings = None
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-i': # input directory
-        input_directory = a
-    elif o == '-d': # dictionary file
-        output_file_dictionary = a
-    elif o == '-p': # postings file
-        output_file_postings = a
-    else:
-        assert False, "unhandled option"
+if __name__ == "__main__":
+    input_directory = output_file_dictionary = output_file_postings = None
+    num_workers = 1
+    block_memory_budget = SPIMI_BLOCK_MEMORY
+    is_incremental = do_compaction = False
+    deleted_doc_ids = []
+    biword_min_df = BIWORD_MIN_DF
+    biword_log = None
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:j:ax:cb:', ['block-mem=', 'biword-log='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-i': # input directory
+            input_directory = a
+        elif o == '-d': # dictionary file
+            output_file_dictionary = a
+        elif o == '-p': # postings file
+            output_file_postings = a
+        elif o == '-j': # number of worker processes
+            num_workers = int(a)
+        elif o == '--block-mem': # memory budget of a SPIMI block, e.g. 512M
+            block_memory_budget = parse_size(a)
+        elif o == '-a': # add or update the documents, instead of rebuilding the index
+            is_incremental = True
+        elif o == '-x': # file of doc ids to delete, one per line
+            is_incremental = True
+            with open(a) as infile:
+                deleted_doc_ids = [int(line) for line in infile if line.strip()]
+        elif o == '-c': # merge all the segments of the index
+            do_compaction = True
+        elif o == '-b': # index the pairs of consecutive words in at least this many documents as biwords
+            biword_min_df = int(a)
+        elif o == '--biword-log': # index the pairs of consecutive words of the phrases of these queries as biwords
+            biword_log = a
+        else:
+            assert False, "unhandled option"
+
+    if output_file_postings == None or output_file_dictionary == None:
+        usage()
+        sys.exit(2)
+    if input_directory == None and not (deleted_doc_ids or do_compaction):
+        usage()
+        sys.exit(2)
+
+    nltk.download('wordnet')
+    nltk.download('punkt')
+    nltk.download('averaged_perceptron_tagger')
+
+    # The normalisation memo of the index, see word_processing.NormalisationMemo
+    memo_file = output_file_dictionary + NORMALISATION_MEMO_SUFFIX
+    memo.load(memo_file)
 
-if input_directory == None or output_file_postings == None or output_file_dictionary == None:
-    usage()
-    sys.exit(2)
+    if is_incremental:
+        print("start updating the index...")
+        update_index(input_directory, output_file_dictionary, output_file_postings, deleted_doc_ids, num_workers, block_memory_budget)
+    elif input_directory != None:
+        print("start indexing...")
+        remove_segments(output_file_dictionary, output_file_postings)
+        biwords = read_biword_log(biword_log) if biword_log is not None else None
+        build_index(input_directory, output_file_dictionary, output_file_postings, num_workers, block_memory_budget,
+                    biword_min_df, biwords)
 
-nltk.download('wordnet')
-nltk.download('punkt')
-nltk.download('averaged_perceptron_tagger')
+    if do_compaction:
+        print("merging all the segments...")
+        compact_index(output_file_dictionary, output_file_postings)
 
-print("start indexing...")
-build_index(input_directory, output_file_dictionary, output_file_postings)
+    memo.save(memo_file)
@@ -1,4 +1,17 @@
-import pickle
+from constants import POSTING_FORMAT_KEYWORD, POSTING_FORMAT_VERSION, DOC_IDS_KEYWORD, POSTING_CACHE_MEMORY, BIWORD_PREFIX
+from posting_codec import to_posting_tuples, get_skip_interval
+from posting_cache import PostingCache
+
+import numpy as np
+
+# Rough CPython sizes (in bytes) of a decoded posting list, to estimate how much of the cache it takes
+POSTING_TUPLE_BYTES = 150       # (doc id, tf, position list) tuple, the two ints and the empty list
+POSITION_BYTES = 36             # an int in a position list
+
+# Decoded posting lists, shared by every query of a search. The key of an entry is (posting file, kind, term),
+# and every posting file is only used with one dictionary.
+posting_cache = PostingCache(POSTING_CACHE_MEMORY)
+
 
 def index_text(token_list):
     """
@@ -24,14 +37,57 @@ def index_text(token_list):
     return freq_pos_dict
 
 
+def get_biword(first_word, second_word):
+    """
+    Get the term of two consecutive words in the biword index.
+
+    Args:
+        first_word (str): the first word
+        second_word (str): the word right after it
+
+    Returns:
+        str: the biword term
+    """
+    return BIWORD_PREFIX + first_word + " " + second_word
+
+
+def index_biwords(token_list, biwords=None):
+    """
+    Convert a stream of tokens into a dictionary of { biword: (frequency, position list) }, like index_text(),
+    for every pair of consecutive tokens. The position of a biword is the position of its first word.
+
+    Args:
+        token_list (list): list of tokens
+        biwords (set): if given, only these biwords are indexed
+
+    Returns:
+        freq_pos_dict: dictionary of biword, (phrase frequency, position list) pairs
+    """
+    freq_pos_dict = {}
+    for index in range(len(token_list) - 1):
+        biword = get_biword(token_list[index], token_list[index + 1])
+        if biwords is not None and biword not in biwords:
+            continue
+        if biword not in freq_pos_dict:
+            freq_pos_dict[biword] = (1, [index,])
+        else:
+            count, position_list = freq_pos_dict[biword]
+            position_list.append(index)
+            freq_pos_dict[biword] = (count + 1, position_list)
+    return freq_pos_dict
+
+
 def get_word_list(term, dictionary, posting_file):
     """
     Returns the posting list for a given term in the posting_file.
 
+    Posting lists are decoded once, then served from posting_cache until they are evicted,
+    so the list returned must not be modified.
+
     Args:
         term (str): the term to find the posting list of
         dictionary (dict): The dictionary containing pointers for the terms in the posting_file
-        posting_file (python file object): use this format -> open(filename, 'rb')
+        posting_file (PostingsFile): use this format -> PostingsFile(filename)
 
     Returns:
         list: [(doc Id, term frequency, position list), ...]
@@ -40,6 +96,176 @@ def get_word_list(term, dictionary, posting_file):
         return []
 
     pointer = dictionary[term][1]
-    posting_file.seek(pointer)
-    posting_list = pickle.load(posting_file)
-    return posting_list
+    if is_pickle_index(dictionary):
+        load = lambda: posting_file.load_pickle(pointer)
+    else:
+        load = lambda: to_posting_tuples(*posting_file.read_posting_list(pointer))
+    return posting_cache.get((posting_file, 'postings', term), load, get_word_list_size)
+
+
+def get_word_list_size(word_list):
+    """
+    Estimate the memory taken by a decoded posting list.
+
+    Args:
+        word_list (list): [(doc Id, term frequency, position list), ...]
+    Returns:
+        int: the estimated number of bytes
+    """
+    return len(word_list) * POSTING_TUPLE_BYTES + sum(posting[1] for posting in word_list) * POSITION_BYTES
+
+
+def get_position_arrays(term, dictionary, posting_file):
+    """
+    Same as get_word_list(), but returns the posting list as arrays, for vectorised code (see phrasal_query.py).
+    The arrays are cached in posting_cache, and must not be modified.
+
+    Args:
+        term (str): the term to find the posting list of
+        dictionary (dict): The dictionary containing pointers for the terms in the posting_file
+        posting_file (PostingsFile): use this format -> PostingsFile(filename)
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray, numpy.ndarray): the doc ids, term frequencies, and the positions
+                                                       of every posting, concatenated
+    """
+    if (term not in dictionary):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    pointer = dictionary[term][1]
+    if is_pickle_index(dictionary):
+        load = lambda: to_posting_arrays(posting_file.load_pickle(pointer))
+    else:
+        load = lambda: posting_file.read_posting_list(pointer)
+    return posting_cache.get((posting_file, 'positions', term), load, lambda arrays: sum(array.nbytes for array in arrays))
+
+
+def to_posting_arrays(word_list):
+    """
+    Convert a list of posting tuples into arrays, the reverse of posting_codec.to_posting_tuples().
+
+    Args:
+        word_list (list): [(doc Id, term frequency, position list), ...]
+    Returns:
+        (numpy.ndarray, numpy.ndarray, numpy.ndarray): the doc ids, term frequencies and positions
+    """
+    doc_ids = np.array([posting[0] for posting in word_list], dtype=np.int64)
+    tfs = np.array([posting[1] for posting in word_list], dtype=np.int64)
+    positions = np.array([position for posting in word_list for position in posting[2]], dtype=np.int64)
+    return doc_ids, tfs, positions
+
+
+def get_doc_list(term, dictionary, posting_file, doc_filter=None):
+    """
+    Returns the posting list for a given term in the posting_file, without the positions.
+
+    Only the doc region of the posting list is read, so this is much cheaper than get_word_list()
+    when the positions are not needed.
+
+    Args:
+        term (str): the term to find the posting list of
+        dictionary (dict): The dictionary containing pointers for the terms in the posting_file
+        posting_file (PostingsFile): use this format -> PostingsFile(filename)
+        doc_filter (numpy.ndarray): if given, only the postings of these doc ids are returned
+
+    Returns:
+        list: [(doc Id, term frequency), ...]
+    """
+    doc_ids, tfs = get_doc_arrays(term, dictionary, posting_file, doc_filter)
+    return list(zip(doc_ids.tolist(), tfs.tolist()))
+
+
+def get_doc_arrays(term, dictionary, posting_file, doc_filter=None):
+    """
+    Same as get_doc_list(), but returns the doc ids and term frequencies as arrays, for vectorised code.
+    The arrays are cached in posting_cache, and must not be modified.
+
+    Args:
+        term (str): the term to find the posting list of
+        dictionary (dict): The dictionary containing pointers for the terms in the posting_file
+        posting_file (PostingsFile): use this format -> PostingsFile(filename)
+        doc_filter (numpy.ndarray): if given, only the postings of these doc ids are returned
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray): the doc ids and term frequencies
+    """
+    if (term not in dictionary):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    df, pointer = dictionary[term]
+    key = (posting_file, 'docs', term)
+    skip_interval = get_skip_interval(df)
+    if doc_filter is not None and key not in posting_cache and skip_interval > 0 and 4 * len(doc_filter) * skip_interval < df:
+        # Only the blocks of the posting list that may contain the filtered documents are decoded,
+        # at most one block per document, which is cheaper than decoding the whole list.
+        # A short list has no skip table, it is decoded whole and cached
+        return read_doc_arrays(pointer, dictionary, posting_file, doc_filter)
+
+    doc_ids, tfs = posting_cache.get(key, lambda: read_doc_arrays(pointer, dictionary, posting_file),
+                                     lambda arrays: arrays[0].nbytes + arrays[1].nbytes)
+
+    if doc_filter is not None:
+        # Filter before building any tuple, so that filtered out postings cost next to nothing
+        keep = np.isin(doc_ids, doc_filter, assume_unique=True)
+        doc_ids, tfs = doc_ids[keep], tfs[keep]
+    return doc_ids, tfs
+
+
+def read_doc_arrays(pointer, dictionary, posting_file, targets=None):
+    """
+    Decode the doc ids and term frequencies of the posting list at pointer (see get_doc_arrays()).
+
+    Args:
+        pointer: the pointer of the posting list, from the dictionary
+        dictionary (dict): The dictionary of the index
+        posting_file (PostingsFile): the posting file
+        targets (numpy.ndarray): if given, only the postings of these sorted doc ids are returned,
+                                 and the skip table of the posting list is used to find them
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray): the doc ids and term frequencies
+    """
+    if is_pickle_index(dictionary):
+        postings = posting_file.load_pickle(pointer)
+        doc_ids = np.array([posting[0] for posting in postings], dtype=np.int64)
+        tfs = np.array([posting[1] for posting in postings], dtype=np.int64)
+        if targets is not None:
+            keep = np.isin(doc_ids, targets, assume_unique=True)
+            doc_ids, tfs = doc_ids[keep], tfs[keep]
+        return doc_ids, tfs
+    return posting_file.read_doc_postings(pointer, targets)
+
+
+def get_doc_ids(ordinals, dictionary):
+    """
+    Translate documents from their ordinal in the index back into their doc ID in the csv.
+
+    Args:
+        ordinals (list(int)): the ordinals of the documents
+        dictionary (dict): The dictionary of the index
+    Returns:
+        list(int): the doc ID of every document
+    """
+    doc_id_table = dictionary.get(DOC_IDS_KEYWORD)
+    if doc_id_table is None:
+        # Indexes written before ordinals use the doc ID's directly
+        return list(ordinals)
+    return np.asarray(doc_id_table)[np.asarray(ordinals, dtype=np.int64)].tolist()
+
+
+def is_pickle_index(dictionary):
+    """
+    Check whether the posting lists of an index were written with pickle, which is the case
+    for indexes without a format version.
+
+    Args:
+        dictionary (dict): The dictionary of the index
+
+    Returns:
+        bool: True if the posting lists are pickled
+    """
+    if POSTING_FORMAT_KEYWORD not in dictionary:
+        return True
+    if dictionary[POSTING_FORMAT_KEYWORD] != POSTING_FORMAT_VERSION:
+        raise ValueError("Unsupported posting format version {}, please re-index".format(dictionary[POSTING_FORMAT_KEYWORD]))
+    return False
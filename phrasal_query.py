@@ -1,207 +1,181 @@
-from index_helper import get_word_list
-from constants import DOC_ID, POS_LIST
+from index_helper import get_position_arrays, get_biword
+from constants import DOC_ID
 from nltk import word_tokenize
 
+import numpy as np
 
-def get_phrasal_query_doc_id(query_string, dictionary, posting_file):
+
+# A position of a document is matched as a single integer key: (doc id << POSITION_BITS) + position
+POSITION_BITS = 32
+
+
+def get_phrasal_query_doc_id(query_string, dictionary, posting_file, position_arrays=None):
 	"""
 	Takes a query string and returns the value of the phrasal query.
 	
-	Format of the query string will be "a" or "a b" or "a b c". Documents
+	The query string can have any number of words, e.g. "a" or "a b c d e". Documents
 	that contain all words in the string, and have them in consecutive posting
-	positions will be returned in the result.
+	positions will be returned in the result. If the index has the biwords of the
+	phrase, their positions are matched instead of those of the words (see get_phrase_terms()).
 
 	Args:
 		query_string (str): The query
 		dictionary (dict): The dictionary to postings in the posting_fijle
 		posting_file: The posting file
+		position_arrays (dict): The posting lists of the terms, as arrays, if they were already fetched (see query_plan.py)
 	Returns:
 		list[docId]: A list of integers representing the doc Ids.
 	"""
-	print("Query: \"{}\" - ".format(query_string), end="")
 	words = word_tokenize(query_string)
-	
-	if len(words) == 1:  # Just handling an edge case
-		print("One words: {}".format(words[0]))
-		word_list_1 = get_word_list(words[0], dictionary, posting_file)
-		
-		return one_word_phrasal_query(word_list_1)
-	elif len(words) == 2:
-		print("Two words: {}, {}".format(words[0], words[1]))
-		word_list_1 = get_word_list(words[0], dictionary, posting_file)
-		word_list_2 = get_word_list(words[1], dictionary, posting_file)
-		
-		return two_word_phrasal_query(word_list_1, word_list_2)
-	elif len(words) == 3:
-		print("Three words: {}, {}, {}".format(words[0], words[1], words[2]))
-		word_list_1 = get_word_list(words[0], dictionary, posting_file)
-		word_list_2 = get_word_list(words[1], dictionary, posting_file)
-		word_list_3 = get_word_list(words[2], dictionary, posting_file)
-
-		return three_word_phrasal_query(word_list_1, word_list_2, word_list_3)
-	else: # The phrasal query with more than 3 words is illegal
-		return []
+	if position_arrays is None:
+		position_arrays = {}
+	get_arrays = lambda word: position_arrays[word] if word in position_arrays else get_position_arrays(word, dictionary, posting_file)
+
+	terms = get_phrase_terms(words, dictionary)
+	return n_word_phrasal_query([get_arrays(term) for term in terms])
 
 
-def one_word_phrasal_query(word_list_1):
+def get_phrase_terms(words, dictionary):
 	"""
-	Given a list of posting lists, return the docId's which result from the phrasal query.
+	Get the terms whose positions are matched to find a phrase.
 
-	List of posting lists word_list_1 should be formatted [ (docId1, tf1, [position1, position2,...]), ... ]
+	A biword occurs at position p exactly when its two words occur at p and p + 1, so a phrase of n words
+	occurs at p exactly when its n - 1 biwords occur at p, p + 1, ..., as if they were the words of a phrase.
+	If every biword of the phrase is in the index (see index.py -b), they are used instead of the words:
+	a two word phrase is then a single posting list, and the biwords are much rarer than the words.
+	A biword is only indexed with all its documents, so a missing biword falls back to the words.
 
 	Args:
-		word_list_1: The postings list for the first word in the phrase 
+		words (list[str]): The words of the phrase
+		dictionary (dict): The dictionary of the index
 	Returns:
-		list[docId]: A list of integers representing the doc Ids containing the phrase
+		list[str]: The terms, in phrase order
 	"""
-	return [triplet[DOC_ID] for triplet in word_list_1]
+	biwords = [get_biword(words[i], words[i + 1]) for i in range(len(words) - 1)]
+	if biwords and all(biword in dictionary for biword in biwords):
+		return biwords
+	return words
 
 
-def two_word_phrasal_query(word_list_1, word_list_2):
+def get_phrase_order(word_arrays):
 	"""
-	Given two lists of posting lists, return the docId's which result from the phrasal query.
-
-	List of posting lists word_list_x should be formatted [ (docId1, tf1, [position1, position2,...]), ... ]
+	Get the order in which the words of a phrase are intersected: rarest (smallest df) first,
+	so that the candidate documents and positions are as few as possible from the start.
+	Ties keep the phrase order.
 
 	Args:
-		word_list_1: The list of postings lists for the first word in the phrase 
-		word_list_2: The list of postings lists for the second word in the phrase
+		word_arrays: The posting lists of the words in the phrase, in phrase order
 	Returns:
-		list[docId]: A list of integers representing the doc Ids containing a phrase
-	"""
-	idx1, idx2 = 0, 0
-	result = []
-	while idx1 < len(word_list_1) and idx2 < len(word_list_2):
-		# The DOC_ID is the same at our two list pointers
-		if word_list_1[idx1][DOC_ID] == word_list_2[idx2][DOC_ID]:
-			# If the document contains the phrase, add it to the result
-			if two_list_phrasal_query(word_list_1[idx1][POS_LIST],
-								   word_list_2[idx2][POS_LIST]):
-				result.append(word_list_1[idx1][DOC_ID])
-			idx1 += 1
-			idx2 += 1
-		# The DOC_ID's are different - increment the lesser one
-		elif word_list_1[idx1][DOC_ID] < word_list_2[idx2][DOC_ID]:
-			idx1 += 1
-		else:
-			idx2 += 1
-
-	return result
-
-
-def two_list_phrasal_query(list1, list2, complete=False):
-	"""
-	Given two lists of position indices, return true if there exists x where list1 contains x and list2 contains (x+1).
-	
-	If complete is True, return a full list of indices instead.
+		list[int]: The offsets of the words in the phrase, rarest first
+	"""
+	return sorted(range(len(word_arrays)), key=lambda offset: len(word_arrays[offset][DOC_ID]))
+
+
+def n_word_phrasal_query(word_arrays):
+	"""
+	Given the posting lists of the words of a phrase, return the docId's which result from the phrasal query.
+
+	Posting list word_arrays[x] should be formatted (docIds, tfs, positions), as arrays, with the positions
+	of every posting concatenated (see index_helper.get_position_arrays()).
+
+	The rarest word is taken first: every position p of it, at offset k in the phrase, is a candidate for
+	the phrase. Each of the other words, at offset j, then only keeps the candidates p where it appears
+	at p + (j - k). The positions are matched as (docId, position) keys, for all the candidate documents
+	at once, and only the positions of the other words in the candidate documents are looked at.
 
 	Args:
-		list1: The list of positions containing the first word in a phrase
-		list2: The list of positions containing the second word in a phrase
-		complete: If this is False, we return a boolean, otherwise a list[docId]
+		word_arrays: The posting lists of the words in the phrase, in phrase order
 	Returns:
-		bool: The phrase exists in the two lists
-	or
-		list[docId] The list of positions x, where word x in the document is the phrase "word1 word2"
+		list[docId]: A list of integers representing the doc Ids containing the phrase
 	"""
-	idx1, idx2 = 0, 0
-	result = []
+	if not word_arrays or not all(len(arrays[DOC_ID]) for arrays in word_arrays):
+		return []
+
+	if len(word_arrays) == 1:
+		return word_arrays[0][DOC_ID].tolist()
+
+	# The (docId, position) keys of the rarest word that are still candidates for the phrase
+	order = get_phrase_order(word_arrays)
+	first = order[0]
+	candidates = get_position_keys(*word_arrays[first])
 
-	while idx1 < len(list1) and idx2 < len(list2):
-		# The phrase is found
-		if list1[idx1] + 1 == list2[idx2]:
-			if not complete:
-				return True
-			result.append(list1[idx1])
-			idx1 += 1
-			idx2 += 1
+	for offset in order[1:]:
+		keys = get_position_keys(*select_postings(word_arrays[offset], get_key_docs(candidates)))
+		candidates = offset_positional_intersect(candidates, keys, offset - first)
+		if len(candidates) == 0:
+			return []
 
-		elif list1[idx1] >= list2[idx2]:
-			idx2 += 1
-		else:
-			idx1 += 1
+	return get_key_docs(candidates).tolist()
 
-	return result if complete else False
 
-def three_word_phrasal_query(word_list_1, word_list_2, word_list_3):
+def get_position_keys(doc_ids, tfs, positions):
 	"""
-	Given three lists of posting lists, return the docId's which result from the phrasal query.
+	Get the (docId, position) key of every position of a posting list.
+
+	Args:
+		doc_ids: The docIds of the postings
+		tfs: The term frequencies of the postings
+		positions: The positions of every posting, concatenated
+	Returns:
+		numpy.ndarray: The keys, sorted
+	"""
+	return (np.repeat(doc_ids.astype(np.int64), tfs) << POSITION_BITS) + positions
 
-	List of posting lists word_list_x should be formatted [ (docId1, tf1, [position1, position2,...]), ... ]
+
+def get_key_docs(keys):
+	"""
+	Get the distinct docIds of sorted (docId, position) keys.
 
 	Args:
-		word_list_1: The list of postings lists for the first word in the phrase 
-		word_list_2: The list of postings lists for the second word in the phrase 
-		word_list_3: The list of postings lists for the third word in the phrase 
+		keys: The sorted keys
 	Returns:
-		list[docId]:  A list of integers representing the doc Ids containing a phrase
-	"""
-	idx1, idx2, idx3 = 0, 0, 0
-	result = []
-	while idx1 < len(word_list_1) and idx2 < len(word_list_2) and idx3 < len(word_list_3):
-		# The DOC_ID is the same at our two list pointers
-		if word_list_1[idx1][DOC_ID] == word_list_2[idx2][DOC_ID] and\
-			word_list_1[idx1][DOC_ID] == word_list_3[idx3][DOC_ID]:
-			# If the document contains the phrase, add it to the result
-			if three_list_phrasal_query(word_list_1[idx1][POS_LIST],
-								   word_list_2[idx2][POS_LIST],
-								   word_list_3[idx3][POS_LIST]):
-				result.append(word_list_1[idx1][DOC_ID])
-			idx1 += 1
-			idx2 += 1
-			idx3 += 1
-		# The DOC_ID's are different - increment the least one
-		elif word_list_1[idx1][DOC_ID] <= word_list_2[idx2][DOC_ID] and\
-			word_list_1[idx1][DOC_ID] <= word_list_3[idx3][DOC_ID]:
-			idx1 += 1
-		elif word_list_2[idx2][DOC_ID] <= word_list_1[idx1][DOC_ID] and\
-			word_list_2[idx2][DOC_ID] <= word_list_3[idx3][DOC_ID]:
-			idx2 += 1
-		else:
-			idx3 += 1
-
-	return result
-
-
-def three_list_phrasal_query(list1, list2, list3, complete=False):
-	"""
-	Given three lists of position indices, return true if there exists x where list1 contains x,
-		list2 contains (x+1), and list3 contains (x+2).
-	
-	If complete is True, return a full list of indices instead.
+		numpy.ndarray: The docIds, sorted
+	"""
+	doc_ids = keys >> POSITION_BITS
+	return doc_ids[np.diff(doc_ids, prepend=-1) != 0]
+
+
+def select_postings(arrays, doc_ids):
+	"""
+	Get the postings of a posting list that are in the given documents, with their positions.
+
+	Args:
+		arrays: The posting list, as (docIds, tfs, positions)
+		doc_ids: The sorted docIds to keep
+	Returns:
+		(numpy.ndarray, numpy.ndarray, numpy.ndarray): The docIds, tfs and positions of the postings kept
+	"""
+	all_doc_ids, tfs, positions = arrays
+	indices = np.minimum(np.searchsorted(all_doc_ids, doc_ids), len(all_doc_ids) - 1)
+	indices = indices[all_doc_ids[indices] == doc_ids]
+	if 2 * len(indices) > len(all_doc_ids):
+		# Most of the postings are kept, gathering their positions would cost more than matching the extra ones
+		return arrays
+
+	# Gather the positions of the postings kept
+	kept_tfs = tfs[indices]
+	posting_starts = (np.cumsum(tfs) - tfs)[indices]
+	position_indices = np.repeat(posting_starts - (np.cumsum(kept_tfs) - kept_tfs), kept_tfs) + np.arange(kept_tfs.sum())
+	return all_doc_ids[indices], kept_tfs, positions[position_indices]
+
 
-	Arguments:
-		list1: The list of positions containing the first word in a phrase
-		list2: The list of positions containing the second word in a phrase
-		list3: The list of positions containing the third word in a phrase
-		complete: If this is False, we return a boolean, otherwise a list[docId]
+def offset_positional_intersect(keys1, keys2, offset):
+	"""
+	Given two sorted arrays of (docId, position) keys, return the keys x of keys1 such that keys2 contains (x + offset),
+	i.e. the same document with the position shifted by offset.
+	The offset can be negative, when the second word comes before the first one in the phrase.
+
+	Every key of keys1 is binary searched in keys2, all at once.
+
+	Args:
+		keys1: The sorted candidate keys of the first word
+		keys2: The sorted keys of the second word
+		offset (int): The offset of the second word from the first one in the phrase
 	Returns:
-		bool: The phrase exists in the two lists
-	or
-		list[docId]: The list of positions x, where word x in the document is the phrase "word1 word2 word3"
-	"""
-	idx1, idx2, idx3 = 0, 0, 0
-	result = []
-
-	while idx1 < len(list1) and idx2 < len(list2) and idx3 < len(list3):
-		# The phrase is found
-		if list1[idx1] + 1 == list2[idx2] and list1[idx1] + 2 == list3[idx3]:
-			if not complete:
-				return True
-
-			result.append(list1[idx1])
-			idx1 += 1
-			idx2 += 1
-			idx3 += 1
-
-		# idx2 should be ahead of idx1
-		elif list1[idx1] >= list2[idx2]:
-			idx2 += 1
-		# idx3 should be the furthest ahead
-		elif list1[idx1] >= list3[idx3] or list2[idx2] >= list3[idx3]:
-			idx3 += 1
-		# They are in increasing order, so increment idx1
-		else:
-			idx1 += 1
-
-	return result if complete else False
+		numpy.ndarray: The keys of keys1 that are kept
+	"""
+	if len(keys2) == 0:
+		return keys1[:0]
+	targets = keys1 + offset
+	indices = np.minimum(np.searchsorted(keys2, targets), len(keys2) - 1)
+	return keys1[keys2[indices] == targets]
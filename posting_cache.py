@@ -0,0 +1,69 @@
+from collections import OrderedDict
+
+
+class PostingCache:
+    """A cache of decoded posting lists, shared by every query of a search.
+
+    Entries are evicted in least recently used order once their estimated size goes over max_bytes.
+    The hit, miss and eviction counters are kept so that the budget can be tuned (see stats()).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()    # key -> (value, estimated bytes)
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, load, size):
+        """Get a cached value, loading it on a miss
+
+        Args:
+            key: the key of the value, e.g. (posting file, kind, term)
+            load (function): loads the value on a miss
+            size (function): estimates the number of bytes taken by the value
+        Returns:
+            the value
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+        self.misses += 1
+        value = load()
+        nbytes = size(value)
+        if nbytes > self.max_bytes:
+            # Caching it would evict everything else
+            return value
+
+        self.entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted_bytes) = self.entries.popitem(last=False)
+            self.nbytes -= evicted_bytes
+            self.evictions += 1
+        return value
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        """Get the counters of the cache
+
+        Returns:
+            dict: hits, misses, evictions, hit rate, number of entries and estimated bytes in use
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0,
+            'entries': len(self.entries),
+            'bytes': self.nbytes,
+        }
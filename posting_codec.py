@@ -0,0 +1,448 @@
+from constants import SKIP_MIN_POSTINGS
+
+import numpy as np
+import math
+import mmap
+import pickle
+
+SKIP_TABLE_DTYPE = np.dtype('<u4')    # the skip table is stored as fixed width integers, to be read without decoding
+
+
+def vb_encode(values):
+    """
+    Variable byte encode a list of non-negative integers.
+
+    Every integer is split into 7-bit groups, most significant first, and the high bit is set
+    on the last byte of every integer. The encoding is vectorised over all the integers.
+
+    Args:
+        values (list(int)): the integers to encode
+    Returns:
+        bytes: the encoded integers
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if len(values) == 0:
+        return b''
+
+    num_bytes = vb_lengths(values)
+    ends = np.cumsum(num_bytes) - 1
+    data = np.empty(ends[-1] + 1, dtype=np.uint8)
+
+    # Fill in the i-th group from the end of every value that has one
+    for i in range(num_bytes.max()):
+        has_group = num_bytes > i
+        data[ends[has_group] - i] = (values[has_group] >> (7 * i)) & 127
+    data[ends] |= 128
+    return data.tobytes()
+
+
+def vb_lengths(values):
+    """
+    Get the number of bytes taken by every integer when variable byte encoded.
+
+    Args:
+        values (numpy.ndarray): the integers
+    Returns:
+        numpy.ndarray: the number of 7-bit groups needed by every integer
+    """
+    num_bytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> 7
+    while rest.any():
+        num_bytes += rest > 0
+        rest >>= 7
+    return num_bytes
+
+
+def vb_decode(buffer):
+    """
+    Decode a buffer of variable byte encoded integers (see vb_encode()).
+
+    Args:
+        buffer (bytes-like): the encoded integers
+    Returns:
+        numpy.ndarray: the decoded integers
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    ends = np.flatnonzero(data >= 128)
+    values = (data[ends] & 127).astype(np.int64)
+
+    # Most values (gaps) fit in a single byte, so only the remaining bytes are added to their value
+    if len(ends) != len(data):
+        continuations = np.flatnonzero(data < 128)
+        owners = np.searchsorted(ends, continuations)
+        shifts = 7 * (ends[owners] - continuations)
+        np.add.at(values, owners, (data[continuations] & 127).astype(np.int64) << shifts)
+    return values
+
+
+def encode_number(number):
+    """
+    Variable byte encode a single non-negative integer, without numpy.
+
+    Args:
+        number (int): the integer to encode
+    Returns:
+        bytes: the encoded integer
+    """
+    groups = [(number & 127) | 128]
+    number >>= 7
+    while number:
+        groups.append(number & 127)
+        number >>= 7
+    return bytes(reversed(groups))
+
+
+def decode_number(buffer, offset):
+    """
+    Decode a single variable byte encoded integer from a buffer, without numpy.
+
+    Args:
+        buffer (bytes-like): the buffer
+        offset (int): the offset of the integer in the buffer
+    Returns:
+        (int, int): the decoded integer, and the offset right after it
+    """
+    number = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        number = (number << 7) | (byte & 127)
+        if byte >= 128:
+            return number, offset
+
+
+def encode_posting_list(doc_ids, tfs, positions):
+    """
+    Encode a posting list into a binary record.
+
+    The posting list is given as three arrays: the doc ids (sorted), the term frequencies,
+    and the positions of all the postings concatenated (a posting has tf positions).
+
+    The record is made of two regions, so that the doc ids and term frequencies can be read
+    without touching the positions, which take most of the bytes:
+        - header: the byte lengths of the doc region and of the position region
+        - doc region: the number of postings, the skip table, the doc id gaps, then the term
+          frequencies. Long posting lists are split into blocks of sqrt(number of postings)
+          (see get_skip_interval()), and the skip table has the last doc id of every block,
+          the byte offset of the end of its doc id gaps, and of the end of its term frequencies,
+          as 32-bit integers, so that only the blocks that may contain some doc ids can be
+          decoded (see decode_doc_region()). Short posting lists have no skip table.
+        - position region: the byte length of the positions of every posting, then the position
+          gaps, where the first position of every posting is stored as is
+    All of them but the skip table are variable byte encoded.
+
+    Args:
+        doc_ids (list(int)): the doc ids, in increasing order
+        tfs (list(int)): the term frequency of every posting
+        positions (list(int)): the positions of every posting, concatenated
+    Returns:
+        bytes: the encoded posting list
+    """
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    tfs = np.asarray(tfs, dtype=np.int64)
+    positions = np.asarray(positions, dtype=np.int64)
+
+    doc_region = encode_doc_region(doc_ids, tfs)
+
+    position_gaps = np.diff(positions, prepend=0)
+    posting_starts = np.cumsum(tfs) - tfs
+    position_gaps[posting_starts] = positions[posting_starts]
+    posting_lengths = np.add.reduceat(vb_lengths(position_gaps), posting_starts)
+    position_region = vb_encode(posting_lengths) + vb_encode(position_gaps)
+
+    return encode_number(len(doc_region)) + encode_number(len(position_region)) + doc_region + position_region
+
+
+def get_skip_interval(num_of_postings):
+    """
+    Get the number of postings of every block of the doc region of a posting list.
+
+    Posting lists of SKIP_MIN_POSTINGS postings or more are split into blocks of sqrt(n) postings,
+    which balances the size of the skip table against the number of postings decoded per block.
+    Shorter lists are a single block, and have no skip table.
+
+    Args:
+        num_of_postings (int): the number of postings of the list
+    Returns:
+        int: the number of postings per block, or 0 if the list has no skip table
+    """
+    if num_of_postings < SKIP_MIN_POSTINGS:
+        return 0
+    return math.isqrt(num_of_postings)
+
+
+def get_block_layout(num_of_postings):
+    """
+    Get the blocks of the doc region of a posting list with a skip table (see get_skip_interval()).
+
+    Args:
+        num_of_postings (int): the number of postings of the list
+    Returns:
+        (numpy.ndarray, numpy.ndarray): the index of the first posting of every block, and the number of postings of every block
+    """
+    interval = get_skip_interval(num_of_postings)
+    block_starts = np.arange(0, num_of_postings, interval, dtype=np.int64)
+    return block_starts, np.minimum(interval, num_of_postings - block_starts)
+
+
+def encode_doc_region(doc_ids, tfs):
+    """
+    Encode the doc region of a posting list (see encode_posting_list()).
+
+    Args:
+        doc_ids (numpy.ndarray): the doc ids, in increasing order
+        tfs (numpy.ndarray): the term frequency of every posting
+    Returns:
+        bytes: the encoded doc region
+    """
+    values = np.concatenate((np.diff(doc_ids, prepend=0), tfs))
+
+    skip_table = b''
+    if get_skip_interval(len(doc_ids)):
+        block_starts, block_sizes = get_block_layout(len(doc_ids))
+        value_lengths = vb_lengths(values)
+        gap_ends = np.cumsum(np.add.reduceat(value_lengths[:len(doc_ids)], block_starts))
+        tf_ends = gap_ends[-1] + np.cumsum(np.add.reduceat(value_lengths[len(doc_ids):], block_starts))
+        block_last_doc_ids = doc_ids[block_starts + block_sizes - 1]
+        skip_table = np.concatenate((block_last_doc_ids, gap_ends, tf_ends)).astype(SKIP_TABLE_DTYPE).tobytes()
+
+    return encode_number(len(doc_ids)) + skip_table + vb_encode(values)
+
+
+def decode_header(buffer, offset=0):
+    """
+    Decode the header of a posting list record (see encode_posting_list()).
+
+    Args:
+        buffer (bytes-like): the buffer containing the record
+        offset (int): the offset of the record in the buffer
+    Returns:
+        (int, int, int): the offset of the doc region, and the byte lengths of the doc and position regions
+    """
+    doc_length, offset = decode_number(buffer, offset)
+    position_length, offset = decode_number(buffer, offset)
+    return offset, doc_length, position_length
+
+
+def decode_doc_region(doc_region, targets=None):
+    """
+    Decode the doc region of a posting list record.
+
+    If targets is given, only the blocks that may contain some of the target doc ids are decoded,
+    using the skip table, so the postings returned are a superset of the postings of the targets.
+    The index of every posting returned, among all the postings of the list, is returned as well,
+    to decode their positions (see decode_position_region()).
+
+    Args:
+        doc_region (bytes-like): the doc region
+        targets (numpy.ndarray): the sorted doc ids needed, or None for all of them
+    Returns:
+        (numpy.ndarray, numpy.ndarray): the doc ids and term frequencies
+    or
+        (numpy.ndarray, numpy.ndarray, numpy.ndarray): the doc ids, term frequencies and index of the postings
+    """
+    num_of_postings, offset = decode_number(doc_region, 0)
+    num_of_skips = -(-num_of_postings // get_skip_interval(num_of_postings)) if get_skip_interval(num_of_postings) else 0
+    data = np.frombuffer(doc_region, dtype=np.uint8)
+    values_offset = offset + SKIP_TABLE_DTYPE.itemsize * 3 * num_of_skips
+
+    if targets is None or num_of_skips == 0:
+        values = vb_decode(data[values_offset:])
+        doc_ids, tfs = np.cumsum(values[:num_of_postings]), values[num_of_postings:]
+        if targets is None:
+            return doc_ids, tfs
+        return doc_ids, tfs, np.arange(num_of_postings)
+
+    # The skip table is read in place, without decoding it
+    skip_table = np.frombuffer(doc_region, dtype=SKIP_TABLE_DTYPE, count=3 * num_of_skips, offset=offset).astype(np.int64)
+    block_last_doc_ids, gap_ends, tf_ends = skip_table.reshape(3, num_of_skips)
+    block_starts, block_sizes = get_block_layout(num_of_postings)
+
+    # The first block whose last doc id is at least the target, the targets being sorted
+    selected = np.searchsorted(block_last_doc_ids, targets)
+    selected = selected[(np.diff(selected, prepend=-1) > 0) & (selected < num_of_skips)]
+
+    # Gather the bytes of the doc id gaps, then of the term frequencies, of the selected blocks, and decode them at once
+    gap_lengths = np.diff(gap_ends, prepend=0)
+    tf_lengths = np.diff(tf_ends, prepend=gap_ends[-1])
+    byte_lengths = np.concatenate((gap_lengths[selected], tf_lengths[selected]))
+    byte_offsets = np.concatenate((gap_ends[selected], tf_ends[selected])) - byte_lengths
+    byte_starts = np.repeat(values_offset + byte_offsets - (np.cumsum(byte_lengths) - byte_lengths), byte_lengths)
+    values = vb_decode(data[byte_starts + np.arange(len(byte_starts))])
+
+    # The gaps restart from the last doc id of the previous block
+    selected_sizes = block_sizes[selected]
+    selected_starts = np.cumsum(selected_sizes) - selected_sizes
+    gaps = values[:len(values) // 2]
+    gaps[selected_starts] += np.concatenate(([0], block_last_doc_ids))[selected]
+    sums = np.cumsum(gaps)
+    doc_ids = sums - np.repeat(sums[selected_starts] - gaps[selected_starts], selected_sizes)
+    posting_indices = np.repeat(block_starts[selected] - selected_starts, selected_sizes) + np.arange(len(gaps))
+    return doc_ids, values[len(values) // 2:], posting_indices
+
+
+def decode_position_region(position_region, tfs, selected=None):
+    """
+    Decode the positions of a posting list record.
+
+    If selected is given, only the positions of the selected postings are decoded, using the byte
+    length of every posting to find them in the region.
+
+    Args:
+        position_region (bytes-like): the position region
+        tfs (numpy.ndarray): the term frequencies of all the postings of the record
+        selected (numpy.ndarray): the indices of the postings to decode, in increasing order
+    Returns:
+        numpy.ndarray: the positions of the (selected) postings, concatenated
+    """
+    if selected is None:
+        position_gaps = vb_decode(position_region)[len(tfs):]
+    else:
+        data = np.frombuffer(position_region, dtype=np.uint8)
+        lengths_end = np.flatnonzero(data >= 128)[len(tfs) - 1] + 1 if len(tfs) > 0 else 0
+        posting_lengths = vb_decode(data[:lengths_end])
+        posting_starts = lengths_end + np.cumsum(posting_lengths) - posting_lengths
+
+        # Gather the bytes of the selected postings, then decode them at once
+        selected_lengths = posting_lengths[selected]
+        byte_starts = np.repeat(posting_starts[selected] - (np.cumsum(selected_lengths) - selected_lengths), selected_lengths)
+        position_gaps = vb_decode(data[byte_starts + np.arange(len(byte_starts))])
+        tfs = tfs[selected]
+
+    # Prefix sum of the gaps, restarting at every posting
+    position_sums = np.cumsum(position_gaps)
+    posting_starts = np.cumsum(tfs) - tfs
+    return position_sums - np.repeat(position_sums[posting_starts] - position_gaps[posting_starts], tfs)
+
+
+def decode_posting_list(record):
+    """
+    Decode a whole posting list record.
+
+    Args:
+        record (bytes-like): the record
+    Returns:
+        (numpy.ndarray, numpy.ndarray, numpy.ndarray): the doc ids, term frequencies and positions
+    """
+    offset, doc_length, position_length = decode_header(record)
+    doc_ids, tfs = decode_doc_region(record[offset:offset + doc_length])
+    offset += doc_length
+    return doc_ids, tfs, decode_position_region(record[offset:offset + position_length], tfs)
+
+
+def to_posting_tuples(doc_ids, tfs, positions):
+    """
+    Convert a decoded posting list into the list of tuples used by the query code.
+
+    Args:
+        doc_ids (numpy.ndarray): the doc ids
+        tfs (numpy.ndarray): the term frequencies
+        positions (numpy.ndarray): the positions of every posting, concatenated
+    Returns:
+        list: [(doc Id, term frequency, position list), ...]
+    """
+    ends = np.cumsum(tfs).tolist()
+    positions = positions.tolist()
+    position_lists = [positions[end - tf:end] for end, tf in zip(ends, tfs.tolist())]
+    return list(zip(doc_ids.tolist(), tfs.tolist(), position_lists))
+
+
+def sort_postings(doc_ids, tfs, positions):
+    """
+    Sort a posting list by doc id, moving the positions of every posting along with it.
+
+    Args:
+        doc_ids (numpy.ndarray): the doc ids
+        tfs (numpy.ndarray): the term frequencies
+        positions (numpy.ndarray): the positions of every posting, concatenated
+    Returns:
+        (numpy.ndarray, numpy.ndarray, numpy.ndarray): the sorted doc ids, term frequencies and positions
+    """
+    if np.all(doc_ids[:-1] <= doc_ids[1:]):
+        return doc_ids, tfs, positions
+
+    order = np.argsort(doc_ids, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    posting_of_position = np.repeat(np.arange(len(doc_ids)), tfs)
+    position_order = np.argsort(rank[posting_of_position], kind='stable')
+    return doc_ids[order], tfs[order], positions[position_order]
+
+
+class PostingsFile:
+    """A read-only postings file, memory-mapped.
+
+    Posting lists are decoded straight from the mapped pages through memoryview slices and numpy
+    views, without copying them into Python bytes first. As the mapping is shared, every process
+    searching the same postings file reuses the same page cache pages, and repeated queries are
+    served from memory without any read system call.
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        try:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file cannot be mapped
+            self.buffer = b''
+        self.view = memoryview(self.buffer)
+
+    def record(self, pointer):
+        """Get the raw posting list record at pointer, without copying it
+
+        Args:
+            pointer (int): the offset of the record
+        Returns:
+            memoryview: the record
+        """
+        offset, doc_length, position_length = decode_header(self.view, pointer)
+        return self.view[pointer:offset + doc_length + position_length]
+
+    def read_doc_postings(self, pointer, targets=None):
+        """Decode the doc ids and term frequencies of the posting list at pointer, without its positions
+
+        If targets is given, only the postings of these doc ids are returned, and only the blocks
+        of the list that may contain them are decoded (see decode_doc_region()).
+
+        Args:
+            pointer (int): the offset of the record
+            targets (numpy.ndarray): the sorted doc ids needed, or None for all of them
+        Returns:
+            (numpy.ndarray, numpy.ndarray): the doc ids and term frequencies
+        """
+        offset, doc_length, _ = decode_header(self.view, pointer)
+        if targets is None:
+            return decode_doc_region(self.view[offset:offset + doc_length])
+
+        doc_ids, tfs, _ = decode_doc_region(self.view[offset:offset + doc_length], targets)
+        keep = np.isin(doc_ids, targets, assume_unique=True)
+        return doc_ids[keep], tfs[keep]
+
+    def read_posting_list(self, pointer):
+        """Decode the whole posting list at pointer
+
+        Args:
+            pointer (int): the offset of the record
+        Returns:
+            (numpy.ndarray, numpy.ndarray, numpy.ndarray): the doc ids, term frequencies and positions
+        """
+        return decode_posting_list(self.record(pointer))
+
+    def load_pickle(self, pointer):
+        """Load a pickled posting list at pointer, for indexes written before the binary format
+
+        Args:
+            pointer (int): the offset of the pickled posting list
+        Returns:
+            list: [(doc Id, term frequency, position list), ...]
+        """
+        return pickle.loads(self.view[pointer:])
+
+    def close(self):
+        self.view.release()
+        try:
+            self.buffer.close()
+        except (AttributeError, BufferError):
+            # Decoded arrays may still point into the mapping, it is released along with them
+            pass
+        self.file.close()
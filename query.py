@@ -1,16 +1,10 @@
-from nltk.stem import PorterStemmer, WordNetLemmatizer
-from nltk import word_tokenize
-from collections import Counter
-
 from constants import *
-from free_text_query import free_text_search
-from phrasal_query import get_phrasal_query_doc_id
-from query_expansion import expand_clause, QueryType
+from query_plan import QueryPlan
 from query_prf import prf_impt_words
-from query_util import categorise_query, intersect_document_ids, union_document_ids, stem_clauses, get_words_from_clauses, tag_results
+from query_util import categorise_query, stem_clauses, extract_filters, get_filtered_doc_ids
 
 
-def process_query(query_string, dictionary, posting_file, use_prf=False, prf_clause=None):
+def process_query(query_string, dictionary, posting_file, use_prf=False, prf_clause=None, top_k=None, explain=False):
     """
     Perform a search based on the query_string.
 
@@ -27,9 +21,17 @@ def process_query(query_string, dictionary, posting_file, use_prf=False, prf_cla
 
     Within a subquery (OR clauses), it performs unions on all the results,
     and intersects all the results between subqueries (AND clauses).
+    The clauses are first turned into a single plan (see query_plan.py), which fetches the posting list
+    of every term once, however many clauses use it.
 
     It then performs a ranking based scoring system. Please refer to scoring.py for details.
     If PRF is enabled, it finally performs PRF.
+
+    Filters (court:"...", date:2015..2020, title:"...") are removed from the query first, and resolved
+    to the set of matching documents (see query_util.get_filtered_doc_ids()). Only the postings of these
+    documents are read from the posting lists (index_helper.get_doc_arrays() with a doc_filter), and the
+    documents matching a phrase are intersected with them (filter_bitmap in QueryPlan.execute()), so a
+    filtered query does less work than the unfiltered one.
     It then prints out the final result of the query, sorted by score. 
     
     For more details, refer to README.
@@ -38,12 +40,22 @@ def process_query(query_string, dictionary, posting_file, use_prf=False, prf_cla
         query_string (str): The raw query string
         dictionary (dict): The dictionary to the posting lists
         posting_file: The posting file handler
+        top_k (int): The number of results to return, or None for all of them
+        explain (bool): Whether to print the plan of the query and its estimated cost
     Returns:
-        String containing the result, which is the sorted list of doc ID's corresponding 
-        to the query.
+        list(int): The result, which is the sorted list of documents corresponding to the query,
+                   as ordinals in the index (see index_helper.get_doc_ids() to get their doc ID's)
     """
+    # Resolve the filters
+    query_text, query_filters = extract_filters(query_string)
+    doc_filter = get_filtered_doc_ids(query_filters, dictionary, posting_file)
+
+    # A query made of filters only returns every matching document, and nothing if none of them applies
+    if not query_text.strip() and prf_clause is None:
+        return doc_filter.tolist()[:top_k] if doc_filter is not None else []
+
     # Categorise query
-    query_clauses = categorise_query(query_string)
+    query_clauses = categorise_query(query_text)
 
     # Stem
     stemmed_query_clauses = stem_clauses(query_clauses)
@@ -61,62 +73,20 @@ def process_query(query_string, dictionary, posting_file, use_prf=False, prf_cla
             # Edge case for empty query
             stemmed_query_clauses.append(prf_clause)
 
-    all_and_results = []
-    expanded_words = []
-    for and_clause in stemmed_query_clauses:
-        and_clause_result = []
-
-        # Handle each clause in the and clause
-        for or_clause in and_clause:
-            clause_word, clause_type = or_clause
-            curr_result = []
-
-            # Apply query expansion
-            expanded_clause_word = expand_clause(clause_word)
-            free_text_list = word_tokenize(expanded_clause_word)
-            expanded_words.extend(free_text_list)
-
-            # Get result for the current clause
-            if clause_type == QueryType.PHRASAL:
-                # For phrasal, we first perform the phrasal search
-                phrasal_result = get_phrasal_query_doc_id(clause_word, dictionary, posting_file)
-                phrasal_result = tag_results(phrasal_result, QueryType.PHRASAL)
-
-                # Followed by the free text search on expanded words
-                expanded_result = free_text_search(free_text_list, dictionary, posting_file, None, do_ranking=False)
-                expanded_result = tag_results(expanded_result, QueryType.FREE_TEXT)
-
-                # Result is union of the two
-                curr_result = union_document_ids(phrasal_result, expanded_result)
-
-            elif clause_type == QueryType.FREE_TEXT:
-                curr_result = free_text_search(free_text_list, dictionary, posting_file, None, do_ranking=False)
-                curr_result = tag_results(curr_result, QueryType.FREE_TEXT)
-
-            # Combine with the existing results
-            and_clause_result = union_document_ids(and_clause_result, curr_result)
-
-        all_and_results.append(and_clause_result)
-
-    # Perform intersection between and clauses
-    combined_result = all_and_results[0]
-    for and_clause_result in all_and_results:
-        combined_result = intersect_document_ids(combined_result, and_clause_result)
-
-    query_list = get_words_from_clauses(stemmed_query_clauses)
-    query_list.extend(expanded_words)
-    query_list = list(set(query_list))
-
-    # Score and rank
-    final_result = free_text_search(query_list, dictionary, posting_file, combined_result, do_ranking=True)
+    # Plan the query, so that every posting list is fetched once, then evaluate and rank it
+    query_plan = QueryPlan(stemmed_query_clauses, dictionary, doc_filter)
+    if explain:
+        print("Plan of the query: {}".format(query_string if prf_clause is None else query_string + " (with PRF)"))
+        print(query_plan.explain(dictionary))
+    final_result = query_plan.execute(dictionary, posting_file, top_k)
 
     if use_prf:
         # Get new words from PRF
         impt_words = prf_impt_words(final_result, dictionary)
         impt_clause = categorise_query(" ".join(impt_words))[0]
         # Perform the search again with important words, but without PRF (only do it once)
-        return process_query(query_string, dictionary, posting_file, use_prf=False, prf_clause=impt_clause)
+        return process_query(query_string, dictionary, posting_file, use_prf=False, prf_clause=impt_clause, top_k=top_k,
+                             explain=explain)
 
     else:
-        # Omit scores for final output
-        return " ".join(str(doc_id) for doc_id in final_result)
+        return final_result
@@ -1,5 +1,5 @@
 from enum import Enum
-from nltk import pos_tag, word_tokenize
+from nltk import pos_tag_sents, word_tokenize
 from nltk.corpus import wordnet
 
 from query_util import QueryType
@@ -7,6 +7,17 @@ from constants import *
 from word_processing import stem
 
 def expand_clause(expression: str):
+    """
+    Apply query expansion to the given expression, see expand_clauses().
+
+    Args:
+        expression (str): The expression to expand
+    Returns:
+        str: The expanded expression
+    """
+    return expand_clauses([expression])[0]
+
+def expand_clauses(expressions):
     """
     Apply query expansion to the given expression.
 
@@ -19,33 +30,40 @@ def expand_clause(expression: str):
 
     The top k synonyms are then used to expand the original expression.
 
+    The tokens of all the expressions are POS tagged together, in a single call to the tagger.
+
     Args:
-        expression (str): The expression to expand
+        expressions (list(str)): The expressions to expand
     Returns:
-        str: The expanded expression
+        list(str): The expanded expressions
     """
-    # Tokenise and get all possible synonyms
-    token_list = word_tokenize(expression)
-    synsets_token = get_synsets(token_list)   
-
-    expanded_tokens = []
-    for i in range(len(synsets_token)):
-        # The first synonym is always the word itself, so add 1 more
-        synonyms = get_top_k_synonyms(synsets_token[i], EXPAND_NUM_OF_SYNONYMS + 1)
-
-        # Make sure original word is included, add as first element
-        synonym_names = [synonym.lemma_names()[0].lower() for synonym in synonyms]
-        if (token_list[i] not in synonym_names):
-            synonym_names.insert(0, token_list[i])
-
-        if (USE_STEMMER):
-            synonym_names = stem(synonym_names)
-
-        # Concat everything
-        expanded_token = ' '.join(synonym_names)
-        expanded_tokens.append(expanded_token)
-    
-    return ' '.join(expanded_tokens)
+    # Tokenise, tag and get all possible synonyms
+    token_lists = [word_tokenize(expression) for expression in expressions]
+    tag_lists = pos_tag_sents(token_lists) if USE_POS_TAGGER else [None] * len(token_lists)
+
+    expanded_expressions = []
+    for token_list, tagged in zip(token_lists, tag_lists):
+        synsets_token = get_synsets(token_list, tagged)
+
+        expanded_tokens = []
+        for i in range(len(synsets_token)):
+            # The first synonym is always the word itself, so add 1 more
+            synonyms = get_top_k_synonyms(synsets_token[i], EXPAND_NUM_OF_SYNONYMS + 1)
+
+            # Make sure original word is included, add as first element
+            synonym_names = [synonym.lemma_names()[0].lower() for synonym in synonyms]
+            if (token_list[i] not in synonym_names):
+                synonym_names.insert(0, token_list[i])
+
+            if (USE_STEMMER):
+                synonym_names = stem(synonym_names)
+
+            # Concat everything
+            expanded_token = ' '.join(synonym_names)
+            expanded_tokens.append(expanded_token)
+
+        expanded_expressions.append(' '.join(expanded_tokens))
+    return expanded_expressions
 
 ############ HELPERS ############
 
@@ -69,7 +87,7 @@ def pos_to_wordnet(tag):
         return wordnet.VERB
     return None
 
-def get_synsets(tokens):
+def get_synsets(tokens, tagged):
     """
     Given a list of tokens, get the synonyms for each token.
     
@@ -83,13 +101,19 @@ def get_synsets(tokens):
 
          Actual sample output is [[Synset('run.v.01'), Synset('scat.v.01'), Synset('operate.v.01'), ...],
                                   [Synset('dog.n.01'), Synset('frump.n.01'), Synset('cad.n.01'), ...]]
+    Without the POS tagger (USE_POS_TAGGER), the synsets of every part of speech are used.
+
     Args:
         tokens (str): The list of tokens
+        tagged (list): The (token, POS tag) pairs of the tokens, or None without the POS tagger
     Returns
         list(list): List of list of synsets
     """
-    tagged = pos_tag(tokens)
     synsets = []
+    if tagged is None:
+        for word in tokens:
+            synsets.append(remove_duplicate_synsets(wordnet.synsets(word)))
+        return synsets
 
     for token in tagged:
         # Assign tag, whether its noun/verb/etc
@@ -0,0 +1,195 @@
+from constants import *
+from nltk import word_tokenize
+from free_text_query import free_text_search
+from phrasal_query import get_phrasal_query_doc_id, get_phrase_terms
+from query_expansion import expand_clauses
+from query_util import QueryType, get_words_from_clauses
+from index_helper import get_doc_arrays, get_position_arrays
+from doc_bitmap import DocBitmap
+
+import numpy as np
+
+
+class QueryPlan:
+    """The execution plan of a categorised query.
+
+    Every clause of the query is expanded once (all of them in a single batch), and the terms of all the clauses are deduplicated, so that
+    every posting list is fetched exactly once per query (see fetch()), no matter how many clauses and
+    the final ranking use it. The boolean part of the query is then evaluated on compressed bitmaps
+    (see doc_bitmap.py), and the documents left are scored in a single pass (see execute()).
+    """
+
+    def __init__(self, query_clauses, dictionary, doc_filter=None):
+        """
+        Args:
+            query_clauses (list(list(clause, QueryType))): the stemmed clauses of the query, see query_util.categorise_query()
+            dictionary (dict): the dictionary of the index, to find the biwords of the phrases
+            doc_filter (numpy.ndarray): the sorted doc ids allowed by the filters of the query, or None
+        """
+        self.doc_filter = doc_filter
+
+        # Every AND clause is a list of (clause, QueryType, expanded words, phrase terms) OR clauses,
+        # the phrase terms being the words of a phrase, or its biwords (see phrasal_query.get_phrase_terms())
+        self.and_clauses = []
+        expanded_words = []
+        expansions = iter(expand_clauses([clause_word for and_clause in query_clauses for clause_word, _ in and_clause]))
+        for and_clause in query_clauses:
+            planned_clause = []
+            for clause_word, clause_type in and_clause:
+                free_text_list = word_tokenize(next(expansions))
+                expanded_words.extend(free_text_list)
+                phrase_terms = get_phrase_terms(word_tokenize(clause_word), dictionary) if clause_type == QueryType.PHRASAL else []
+                planned_clause.append((clause_word, clause_type, free_text_list, phrase_terms))
+            self.and_clauses.append(planned_clause)
+
+        # The words used for the final ranking, every word of the clauses and of their expansion
+        query_list = get_words_from_clauses(query_clauses)
+        query_list.extend(expanded_words)
+        self.rank_terms = list(set(query_list))
+
+        # Terms whose positions are needed (phrases), and terms whose doc ids and term frequencies are enough
+        self.position_terms = unique_terms(phrase_terms for and_clause in self.and_clauses for _, _, _, phrase_terms in and_clause)
+        self.doc_terms = unique_terms([free_text_list for and_clause in self.and_clauses for _, _, free_text_list, _ in and_clause]
+                                      + [self.rank_terms])
+
+        self.position_arrays = None
+        self.postings = None
+
+    def fetch(self, dictionary, posting_file):
+        """Fetch the posting list of every term of the plan, once
+
+        The doc ids and term frequencies of a phrase term are taken from its full posting list,
+        rather than read a second time.
+
+        Args:
+            dictionary (dict): the dictionary of the posting lists
+            posting_file: the posting file handler
+        """
+        self.position_arrays = {term: get_position_arrays(term, dictionary, posting_file) for term in self.position_terms}
+        self.postings = {}
+        for term in self.doc_terms:
+            if term in self.position_arrays:
+                self.postings[term] = get_posting_arrays(self.position_arrays[term], self.doc_filter)
+            else:
+                self.postings[term] = get_doc_arrays(term, dictionary, posting_file, self.doc_filter)
+
+    def execute(self, dictionary, posting_file, top_k=None):
+        """Run the plan, fetching the posting lists first if needed
+
+        Within an AND clause, the results of the OR clauses are united, and the results of the AND clauses
+        are then intersected, as bitmaps. A document is tagged as phrasal if it matched a phrase in any of them,
+        which is tracked by a second bitmap of the phrasal documents, alongside the bitmap of the documents.
+        The documents left are given priority when every word of the plan is ranked (see scoring.py).
+
+        Args:
+            dictionary (dict): the dictionary of the posting lists
+            posting_file: the posting file handler
+            top_k (int): the number of results to return, or None for all of them
+        Returns:
+            list(int): the doc ids, sorted by score
+        """
+        if self.postings is None:
+            self.fetch(dictionary, posting_file)
+
+        filter_bitmap = DocBitmap.from_array(self.doc_filter) if self.doc_filter is not None else None
+        combined_docs, combined_phrasal = None, None
+        for and_clause in self.and_clauses:
+            docs, phrasal = DocBitmap(), DocBitmap()
+            for clause_word, clause_type, free_text_list, _ in and_clause:
+                docs = docs | self.get_union(free_text_list)
+
+                if clause_type == QueryType.PHRASAL:
+                    phrasal_docs = DocBitmap.from_array(np.unique(np.array(get_phrasal_query_doc_id(clause_word, dictionary, posting_file,
+                                                                                                    self.position_arrays), dtype=np.int64)))
+                    if filter_bitmap is not None:
+                        phrasal_docs = phrasal_docs & filter_bitmap
+                    docs, phrasal = docs | phrasal_docs, phrasal | phrasal_docs
+
+            if combined_docs is None:
+                combined_docs, combined_phrasal = docs, phrasal
+            else:
+                combined_docs = combined_docs & docs
+                combined_phrasal = (combined_phrasal | phrasal) & combined_docs
+
+        tagged_prio_list = []
+        if combined_docs is not None:
+            doc_ids = combined_docs.to_array()
+            tags = [QueryType.PHRASAL if is_phrasal else QueryType.FREE_TEXT for is_phrasal in combined_phrasal.contains(doc_ids).tolist()]
+            tagged_prio_list = list(zip(doc_ids.tolist(), tags))
+
+        return free_text_search(self.rank_terms, dictionary, posting_file, tagged_prio_list, do_ranking=True,
+                                doc_filter=self.doc_filter, top_k=top_k, fetched_postings=self.postings)
+
+    def get_union(self, terms):
+        """Get the documents containing any of the terms
+
+        Args:
+            terms (list(str)): the terms, already fetched
+        Returns:
+            DocBitmap: the doc ids
+        """
+        union = DocBitmap()
+        for term in terms:
+            union = union | DocBitmap.from_array(self.postings[term][0])
+        return union
+
+    def explain(self, dictionary):
+        """Describe the plan and its estimated cost, in postings read
+
+        Args:
+            dictionary (dict): the dictionary of the posting lists
+        Returns:
+            str: the description, one line per step
+        """
+        get_df = lambda term: dictionary[term][0] if term in dictionary else 0
+        describe = lambda terms: ", ".join("{} ({})".format(term, get_df(term)) for term in terms) or "-"
+
+        lines = []
+        if self.doc_filter is not None:
+            lines.append("  filter: {} documents".format(len(self.doc_filter)))
+        for number, and_clause in enumerate(self.and_clauses):
+            lines.append("  AND clause {}:".format(number + 1))
+            for clause_word, clause_type, free_text_list, phrase_terms in and_clause:
+                if clause_type == QueryType.PHRASAL:
+                    # The terms of a phrase are intersected rarest first (see phrasal_query.py)
+                    rarest_first = sorted(phrase_terms, key=get_df)
+                    lines.append('    OR phrase "{}": positions of {}'.format(clause_word, describe(rarest_first)))
+                lines.append('    OR words "{}": doc ids of {}'.format(clause_word, describe(free_text_list)))
+        lines.append("  rank: {}".format(describe(self.rank_terms)))
+
+        # Without the plan, every clause and the ranking fetch their own posting lists
+        num_of_fetches = sum(len(free_text_list) + len(phrase_terms)
+                             for and_clause in self.and_clauses for _, _, free_text_list, phrase_terms in and_clause) + len(self.rank_terms)
+        fetched_terms = set(self.doc_terms) | set(self.position_terms)
+        lines.append("  cost: {} posting lists ({} with positions), ~{} postings, instead of {} fetches".format(
+            len(fetched_terms), len(self.position_terms), sum(get_df(term) for term in fetched_terms), num_of_fetches))
+        return "\n".join(lines)
+
+
+def unique_terms(term_lists):
+    """
+    Get the distinct terms of several lists, in the order they first appear.
+
+    Args:
+        term_lists (iterable(list(str))): the lists of terms
+    Returns:
+        list(str): the distinct terms
+    """
+    return list(dict.fromkeys(term for terms in term_lists for term in terms))
+
+
+def get_posting_arrays(position_arrays, doc_filter=None):
+    """
+    Get the doc ids and term frequencies of a decoded posting list (see index_helper.get_doc_arrays()).
+
+    Args:
+        position_arrays (tuple): the doc ids, term frequencies and positions, see index_helper.get_position_arrays()
+        doc_filter (numpy.ndarray): if given, only the postings of these doc ids are returned
+    Returns:
+        (numpy.ndarray, numpy.ndarray): the doc ids and term frequencies
+    """
+    doc_ids, tfs, _ = position_arrays
+    if doc_filter is not None:
+        keep = np.isin(doc_ids, doc_filter, assume_unique=True)
+        doc_ids, tfs = doc_ids[keep], tfs[keep]
+    return doc_ids, tfs
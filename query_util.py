@@ -1,11 +1,16 @@
 from enum import Enum
 from constants import *
 from nltk import word_tokenize
-from word_processing import lemmatize, stem, sanitise
+from word_processing import lemmatize, stem, sanitise, sanitise_texts
+from index_helper import get_doc_list
+from doc_values import DocValues
 
+import numpy as np
 import re
 import math
 
+FILTER_PATTERN = re.compile(r'\b({}|{}|{}):("[^"]*"|\S+)'.format(COURT_FILTER, DATE_FILTER, TITLE_FILTER), re.IGNORECASE)
+
 
 class QueryType(Enum):
     FREE_TEXT = 0
@@ -85,115 +90,87 @@ def categorise_query(query: str):
     return query_clauses
 
 
-def intersect_document_ids(doc_list1, doc_list2):
+def extract_filters(query):
     """
-    Returns the intersection between doc_list1 and doc_list2.
-
-    Both doc_list1 and doc_list2 has the following format for each elem:
-    (doc_id, clause_type)
+    Remove the filters from a query, and return them separately.
 
-    Special case: when a document ID is contained both in doc_list1 and doc_list2
-    BUT with different tags, we will prioritise QueryType.PHRASAL.
+    A filter is written field:value or field:"value with spaces", where field is one of
+    COURT_FILTER, DATE_FILTER or TITLE_FILTER.
 
-    This is so because results tagged with QueryType.PHRASAL is deemed
-    to have higher importance.
+    e.g. Input: 'breach court:"SG Court of Appeal" date:2015..2020'
+         Output: ('breach', [('court', 'SG Court of Appeal'), ('date', '2015..2020')])
 
-    e.g. doc_list1 = [(1, QueryType.PHRASAL), (2, QueryType.FREE_TEXT)]
-         doc_list2 = [(1, QueryType.FREE_TEXT)]
-
-         Outputs [(1, QueryType.PHRASAL)]
-        
     Args:
-        doc_list1 (list(doc_id, QueryType)): The first list of clauses
-        doc_list2 (list(doc_id, QueryType)): The second list of clauses
+        query (str): The raw query
     Returns:
-        list(doc_id, QueryType): The merged list of clauses
-    """
-    # TODO: See whether sorting step is necessary or not
-    doc_list1.sort(key=lambda x: x[0])
-    doc_list2.sort(key=lambda x: x[0])
-
-    result = []
-    idx0, idx1 = 0, 0
-    while idx0 < len(doc_list1) and idx1 < len(doc_list2):
-        # Matching element
-        if doc_list1[idx0][0] == doc_list2[idx1][0]:
-            is_phrasal = doc_list1[idx0][1] == QueryType.PHRASAL or doc_list2[idx1][1] == QueryType.PHRASAL
-            clause_type = QueryType.PHRASAL if is_phrasal else QueryType.FREE_TEXT
-            result.append((doc_list1[idx0][0], clause_type))
-            idx0 += 1
-            idx1 += 1
-
-        # doc_list1[pointer] is smaller, advance the pointer
-        elif doc_list1[idx0][0] < doc_list2[idx1][0]:
-            idx0 += 1
-
-        # doc_list2[pointer] is smaller, advance the pointer
-        else:
-            idx1 += 1
-    return result
-
-
-def union_document_ids(doc_list1, doc_list2):
+        (str, list((str, str))): The query without the filters, and the (field, value) of every filter
     """
-    Returns the union between doc_list1 and doc_list2.
+    filters = [(field.lower(), value.strip('"')) for field, value in FILTER_PATTERN.findall(query)]
+    return FILTER_PATTERN.sub(' ', query).strip(), filters
 
-    Both doc_list1 and doc_list2 has the following format for each elem:
-    (doc_id, clause_type)
 
-    Special case: when a document ID is contained both in doc_list1 and doc_list2
-    BUT with different tags, we will prioritise QueryType.PHRASAL.
-
-    This is so because results tagged with QueryType.PHRASAL is deemed
-    to have higher importance.
+def parse_date_bound(bound, is_upper):
+    """
+    Convert a date bound of a date filter into a YYYYMMDD integer.
 
-    e.g. doc_list1 = [(1, QueryType.PHRASAL), (2, QueryType.FREE_TEXT)]
-         doc_list2 = [(1, QueryType.FREE_TEXT)]
+    A bound may be YYYY, YYYY-MM or YYYY-MM-DD. The missing parts are filled in so that the bound
+    includes the whole year or month, and an empty bound is unbounded.
 
-         Outputs [(1, QueryType.PHRASAL), (2, QueryType.FREE_TEXT)]
-    
     Args:
-        doc_list1 (list(doc_id, QueryType)): The first list of clauses
-        doc_list2 (list(doc_id, QueryType)): The second list of clauses
+        bound (str): The bound
+        is_upper (bool): Whether this is the upper bound of the range
     Returns:
-        list(doc_id, QueryType): The merged list of clauses
+        int: The bound as YYYYMMDD
     """
-    # TODO: See whether sorting step is necessary or not
-    doc_list1.sort(key=lambda x: x[0])
-    doc_list2.sort(key=lambda x: x[0])
-
-    result = []
-    idx0, idx1 = 0, 0
+    parts = [int(part) for part in re.findall(r'\d+', bound)][:3]
+    if not parts:
+        return 99999999 if is_upper else 0
+    year, month, day = parts + ([12, 31] if is_upper else [1, 1])[len(parts) - 1:]
+    return year * 10000 + month * 100 + day
 
-    # Iterate while both lists are alive
-    while idx0 < len(doc_list1) and idx1 < len(doc_list2):
-        # Matching element
-        if doc_list1[idx0][0] == doc_list2[idx1][0]:
-            is_phrasal = doc_list1[idx0][1] == QueryType.PHRASAL or doc_list2[idx1][1] == QueryType.PHRASAL
-            clause_type = QueryType.PHRASAL if is_phrasal else QueryType.FREE_TEXT
-            result.append((doc_list1[idx0][0], clause_type))
-            idx0 += 1
-            idx1 += 1
 
-        # doc_list1[pointer] is smaller, advance the pointer
-        elif doc_list1[idx0][0] < doc_list2[idx1][0]:
-            result.append(doc_list1[idx0])
-            idx0 += 1
-
-        # doc_list2[pointer] is smaller, advance the pointer
-        else:
-            result.append(doc_list2[idx1])
-            idx1 += 1
-
-    # List one has still elements
-    if idx0 < len(doc_list1):
-        result.extend(doc_list1[idx0:])
+def get_filtered_doc_ids(filters, dictionary, posting_file):
+    """
+    Get the documents matching every filter of a query, from the doc values (court, date)
+    and the title zone (title) of the index.
 
-    # List two has still elements
-    if idx1 < len(doc_list2):
-        result.extend(doc_list2[idx1:])
+    Several court filters match any of the courts, while date and title filters must all match.
 
-    return result
+    Args:
+        filters (list((str, str))): The filters, from extract_filters()
+        dictionary (dict): The dictionary of the posting lists
+        posting_file: The posting file handler
+    Returns:
+        numpy.ndarray: The sorted doc ids matching the filters, or None if no filter applies, i.e. there are no filters,
+                       or only title filters without any word left once sanitised (e.g. title:"the")
+    """
+    if not filters:
+        return None
+
+    courts = [value for field, value in filters if field == COURT_FILTER] or None
+    date_range = None
+    for field, value in filters:
+        if field == DATE_FILTER:
+            lower, _, upper = value.partition(DATE_RANGE_KEYWORD) if DATE_RANGE_KEYWORD in value else (value, '', value)
+            lower, upper = parse_date_bound(lower, False), parse_date_bound(upper, True)
+            date_range = (lower, upper) if date_range is None else (max(date_range[0], lower), min(date_range[1], upper))
+
+    doc_ids = None
+    if courts is not None or date_range is not None:
+        doc_values = dictionary.get(DOC_VALUES_KEYWORD)
+        if doc_values is None:
+            doc_values = DocValues([], [], [])
+        doc_ids = doc_values.select(courts, date_range)
+
+    # Every word of the title filters must be in the title
+    for field, value in filters:
+        if field == TITLE_FILTER:
+            for token in sanitise(value):
+                title_doc_ids = np.array([doc_id for doc_id, _ in get_doc_list(TITLE_ZONE_PREFIX + token, dictionary, posting_file, doc_ids)],
+                                         dtype=np.int64)
+                doc_ids = title_doc_ids if doc_ids is None else np.intersect1d(doc_ids, title_doc_ids, assume_unique=True)
+
+    return doc_ids
 
 
 def stem_clauses(query_clauses):
@@ -210,20 +187,16 @@ def stem_clauses(query_clauses):
     Returns:
         list(list(query_string, QueryType)): query_clauses with its contents sanitized
     """
+    # Use the same method as in indexing, with every clause tagged in a single batch
+    token_lists = iter(sanitise_texts([clause for and_clause in query_clauses for clause, _ in and_clause]))
+
     stemmed_clauses = []
     for and_clause in query_clauses:
         stemmed_and_clause = []
 
         # Iterate through each clause under the and clause
-        for or_clause in and_clause:
-            clause, clause_type = or_clause
-            
-            # Use the same method as in indexing
-            tokens = sanitise(clause)
-
-            # Stem word by word
-            stemmed_tokens = tokens
-            stemmed_words = " ".join(stemmed_tokens)
+        for clause, clause_type in and_clause:
+            stemmed_words = " ".join(next(token_lists))
             stemmed_and_clause.append((stemmed_words, clause_type))
 
         stemmed_clauses.append(stemmed_and_clause)
@@ -322,9 +295,7 @@ def get_avg_score(results_with_score):
     Returns:
         (float): average score
     """
-    score_sum = 0
-    for res in results_with_score:
-        score_sum += res[1]
+    score_sum = sum(res[1] for res in results_with_score)
 
     if len(results_with_score) > 0:
         return score_sum / len(results_with_score)
@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+from constants import *
+from term_dictionary import DictionaryWriter, load_dictionary
+from posting_codec import PostingsFile, decode_header
+from doc_values import DocValues, merge_doc_values
+from spimi import merge_postings
+from segments import open_index
+from query import process_query
+
+import numpy as np
+import sys
+import getopt
+import os
+import time
+
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [-s court-date|terms] [-q file-of-queries]")
+
+
+def get_document_order(dictionary, strategy):
+    """
+    Get the order in which the documents of an index should be numbered.
+
+    With 'court-date', documents are grouped by court, then sorted by date_posted, so that the
+    judgments of a court over a period, which share most of their vocabulary, get close ordinals.
+    With 'terms', documents are sorted by their most frequent words (IMPORTANT), so that documents
+    about the same things are next to each other. Ties keep their current order.
+
+    Args:
+        dictionary (TermDictionary): the dictionary of the index
+        strategy (str): 'court-date' or 'terms'
+    Returns:
+        numpy.ndarray: the current ordinals of the documents, in their new order
+    """
+    num_of_docs = len(dictionary[DOC_IDS_KEYWORD])
+    if strategy == 'court-date':
+        doc_values = dictionary.get(DOC_VALUES_KEYWORD, DocValues([], [], []))
+        order = doc_values.doc_ids[np.lexsort((doc_values.dates, doc_values.court_codes))]
+
+        # Documents without doc values go last
+        return np.concatenate((order, np.setdiff1d(np.arange(num_of_docs), order)))
+
+    if strategy == 'terms':
+        impt_words = dictionary[IMPT_KEYWORD]
+        return np.array(sorted(range(num_of_docs), key=lambda ordinal: impt_words[ordinal]), dtype=np.int64)
+
+    raise ValueError("Unknown reordering strategy {}".format(strategy))
+
+
+def reorder_index(dict_file, postings_file, strategy):
+    """
+    Renumber the documents of an index (see get_document_order()), then rewrite its posting lists
+    and special entries with the new ordinals. Smaller gaps between the ordinals of similar
+    documents make the posting lists smaller, and the postings of a query closer together.
+
+    The new files are written next to the old ones, and replace them once complete.
+
+    Args:
+        dict_file (str): the dictionary filename of the index
+        postings_file (str): the postings filename of the index
+        strategy (str): 'court-date' or 'terms'
+    """
+    dictionary = load_dictionary(dict_file)
+    posting_file = PostingsFile(postings_file)
+
+    order = get_document_order(dictionary, strategy)
+    ordinal_map = np.empty(len(order), dtype=np.int64)
+    ordinal_map[order] = np.arange(len(order))
+
+    posting_output = open(postings_file + '.tmp', 'wb')
+    dictionary_output = DictionaryWriter(dict_file + '.tmp')
+    block_terms = [(term, df, pointer) for term, (df, pointer) in dictionary.terms()]
+    merge_postings([iter(block_terms)], [posting_file], posting_output, dictionary_output, [ordinal_map])
+
+    impt_words = dictionary[IMPT_KEYWORD]
+    doc_values = dictionary.get(DOC_VALUES_KEYWORD, DocValues([], [], []))
+    dictionary_output.add_special(DOC_IDS_KEYWORD, np.asarray(dictionary[DOC_IDS_KEYWORD])[order])
+    dictionary_output.add_special(DOCUMENT_LENGTH_KEYWORD, np.asarray(dictionary[DOCUMENT_LENGTH_KEYWORD])[order])
+    dictionary_output.add_special(IMPT_KEYWORD, [impt_words[ordinal] for ordinal in order.tolist()])
+    dictionary_output.add_special(DOC_VALUES_KEYWORD, merge_doc_values([doc_values], [ordinal_map]))
+    dictionary_output.add_special(POSTING_FORMAT_KEYWORD, POSTING_FORMAT_VERSION)
+    dictionary_output.close()
+    posting_output.close()
+
+    dictionary.close()
+    posting_file.close()
+    os.replace(dict_file + '.tmp', dict_file)
+    os.replace(postings_file + '.tmp', postings_file)
+
+
+def time_queries(dict_file, postings_file, queries):
+    """
+    Measure the time taken to run every query on an index, once the index is warm.
+
+    Args:
+        dict_file (str): the dictionary filename of the index
+        postings_file (str): the postings filename of the index
+        queries (list(str)): the queries
+    Returns:
+        float: the time taken by the second run of the queries, in seconds
+    """
+    elapsed = 0
+    for _ in range(2):
+        dictionary, posting_file = open_index(dict_file, postings_file)
+        start = time.perf_counter()
+        for query in queries:
+            process_query(query, dictionary, posting_file, use_prf=USE_PRF)
+        elapsed = time.perf_counter() - start
+        posting_file.close()
+    return elapsed
+
+
+def get_doc_region_size(dict_file, postings_file):
+    """
+    Get the number of bytes of the doc regions of all the posting lists, which is what free text
+    queries read, and what the document order changes the most.
+
+    Args:
+        dict_file (str): the dictionary filename of the index
+        postings_file (str): the postings filename of the index
+    Returns:
+        int: the number of bytes
+    """
+    dictionary = load_dictionary(dict_file)
+    posting_file = PostingsFile(postings_file)
+    size = 0
+    for _, (_, pointer) in dictionary.terms():
+        _, doc_length, _ = decode_header(posting_file.view, pointer)
+        size += doc_length
+    dictionary.close()
+    posting_file.close()
+    return size
+
+
+if __name__ == "__main__":
+    dictionary_file = postings_file = file_of_queries = None
+    strategy = 'court-date'
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:s:q:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-s': # reordering strategy
+            strategy = a
+        elif o == '-q': # queries to time before and after reordering
+            file_of_queries = a
+        else:
+            assert False, "unhandled option"
+
+    if dictionary_file == None or postings_file == None or strategy not in ('court-date', 'terms'):
+        usage()
+        sys.exit(2)
+
+    if os.path.exists(dictionary_file + SEGMENT_MANIFEST_SUFFIX):
+        print("The index has segments, merge them first with index.py -c")
+        sys.exit(1)
+
+    queries = []
+    if file_of_queries != None:
+        with open(file_of_queries, 'r', encoding="utf8") as infile:
+            queries = [query for query in infile.read().splitlines() if query]
+
+    report = [("postings file (bytes)", lambda: os.path.getsize(postings_file)),
+              ("doc regions (bytes)", lambda: get_doc_region_size(dictionary_file, postings_file))]
+    if queries:
+        report.append(("query time (ms)", lambda: time_queries(dictionary_file, postings_file, queries) * 1000))
+
+    before = [measure() for _, measure in report]
+    print("reordering the documents by {}...".format(strategy))
+    reorder_index(dictionary_file, postings_file, strategy)
+    after = [measure() for _, measure in report]
+
+    print("{:<24} {:>12} {:>12} {:>8}".format("", "before", "after", "change"))
+    for (name, _), old, new in zip(report, before, after):
+        print("{:<24} {:>12.0f} {:>12.0f} {:>7.1f}%".format(name, old, new, (new - old) / old * 100 if old else 0))
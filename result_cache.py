@@ -0,0 +1,149 @@
+from constants import *
+from query_util import extract_filters, categorise_query, stem_clauses
+from word_processing import sanitise
+
+import hashlib
+import os
+import pickle
+
+# The settings that change the results of a query, they are part of the key of every cached result
+RESULT_SETTINGS = (USE_STEMMER, USE_LEMMATIZER, USE_POS_TAGGER, USE_FAST_TOKENIZER, USE_PRF, REMOVE_STOPWORDS, PHRASAL_WEIGHT,
+                   PRIORITY_WEIGHT, FILTER_STRENGTH, EXPAND_NUM_OF_SYNONYMS, PRF_NUM_OF_RESULTS, PRF_NUM_OF_WORDS_PER_DOC)
+
+ENTRY_SUFFIX = ".pkl"
+GENERATION_FILE = "GENERATION"
+
+
+def get_index_generation(dict_file, postings_file):
+    """
+    Get an id of the current version of an index, which changes whenever the index is rebuilt,
+    updated, compacted or reordered, as all of these replace or rewrite some of its files.
+
+    Only the files are stat'ed, the index is not opened.
+
+    Args:
+        dict_file (str): the dictionary filename of the index
+        postings_file (str): the postings filename of the index
+    Returns:
+        str: the generation id
+    """
+    stats = []
+    for filename in (dict_file, postings_file, dict_file + SEGMENT_MANIFEST_SUFFIX):
+        if os.path.exists(filename):
+            stat = os.stat(filename)
+            stats.append((filename, stat.st_ino, stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha1(repr(stats).encode()).hexdigest()
+
+
+def get_query_key(query_string, top_k=None):
+    """
+    Get the cache key of a query: its normalised form, after the same categorisation and stemming as
+    process_query(), along with the settings that change its results. Queries that only differ in
+    spacing, case or inflections share the same key.
+
+    Args:
+        query_string (str): the raw query string
+        top_k (int): the number of results returned, or None for all of them
+    Returns:
+        str: the key
+    """
+    query_text, query_filters = extract_filters(query_string)
+    query_clauses = stem_clauses(categorise_query(query_text) or [])
+
+    filters = []
+    for field, value in query_filters:
+        if field == COURT_FILTER:
+            value = value.lower()
+        elif field == TITLE_FILTER:
+            value = " ".join(sanitise(value))
+        filters.append((field, value.strip()))
+
+    return repr((query_clauses, sorted(filters), top_k, RESULT_SETTINGS))
+
+
+class ResultCache:
+    """A disk cache of the results of queries, kept in a directory next to the index.
+
+    Every result is stored in its own file, named after the hash of its key, so a repeated query is
+    answered by reading a single small file, without opening the index. The directory records the
+    generation of the index it belongs to (see get_index_generation()), and is emptied when the index
+    changes. Once the files take more than max_bytes, the least recently used ones are removed.
+    """
+
+    def __init__(self, directory, generation, max_bytes):
+        """
+        Args:
+            directory (str): the directory of the cache, created if needed
+            generation (str): the generation of the index
+            max_bytes (int): the size of the cache on disk
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        generation_file = os.path.join(directory, GENERATION_FILE)
+        current_generation = None
+        if os.path.exists(generation_file):
+            with open(generation_file, 'r') as infile:
+                current_generation = infile.read().strip()
+
+        if current_generation != generation:
+            # The index has changed since the results were cached
+            self.clear()
+            with open(generation_file, 'w') as outfile:
+                outfile.write(generation)
+
+    def get_path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ENTRY_SUFFIX)
+
+    def get(self, key):
+        """Get the cached results of a query
+
+        Args:
+            key (str): the key of the query, from get_query_key()
+        Returns:
+            list(int): the doc ids, or None if the query is not cached
+        """
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as infile:
+                cached_key, results = pickle.load(infile)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            cached_key = results = None
+
+        if cached_key != key:
+            self.misses += 1
+            return None
+
+        # Mark the entry as recently used
+        os.utime(path)
+        self.hits += 1
+        return results
+
+    def put(self, key, results):
+        """Cache the results of a query
+
+        Args:
+            key (str): the key of the query, from get_query_key()
+            results (list(int)): the doc ids
+        """
+        path = self.get_path(key)
+        with open(path + '.tmp', 'wb') as outfile:
+            pickle.dump((key, results), outfile)
+        os.replace(path + '.tmp', path)
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_bytes"""
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(ENTRY_SUFFIX)]
+        cache_size = sum(entry.stat().st_size for entry in entries)
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime_ns):
+            if cache_size <= self.max_bytes:
+                break
+            cache_size -= entry.stat().st_size
+            os.remove(entry.path)
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(ENTRY_SUFFIX):
+                os.remove(entry.path)
@@ -2,10 +2,11 @@ from constants import *
 from index_helper import get_word_list
 from query_util import QueryType, get_avg_score
 
+import heapq
 import math
 
 
-def rank_document_ids(results_with_score, tagged_prio_list=None):
+def rank_document_ids(results_with_score, tagged_prio_list=None, top_k=None):
     """
     Perform ranking of the documents, with priority weightage.
 
@@ -24,10 +25,17 @@ def rank_document_ids(results_with_score, tagged_prio_list=None):
     Tagged_prio_list tend to have higher weight because they appeared in the
     AND intersections of subqueries.
 
+    If top_k is given, only the top_k best results are kept, with a bounded heap instead of sorting
+    every candidate, so ranking a broad query costs O(n log k) rather than O(n log n). The results
+    are the same as the first top_k results without it (ties keep the same order).
+
     Arguments:
         results_with_score (list(doc_id, score)): the list of results from tf-idf
         tagged_prio_list (list(docId, QueryType)): the list of documents with tags,
                                                    that survived the AND intersection of all subqueries.
+        top_k (int): the number of results to return, or None for all of them
+    Returns:
+        list(doc_id, score): the results, sorted by decreasing score
     """
     # Weed out the weakest results, extreme low score lowers the overall benchmark
     initial_benchmark = get_avg_score(results_with_score) * FILTER_STRENGTH
@@ -42,20 +50,17 @@ def rank_document_ids(results_with_score, tagged_prio_list=None):
     combined_list = combine_score_and_tag(filtered_score_list, tagged_prio_list, default_score, default_tag)
 
     # Apply weighting for results that comes from phrasal query
-    weighted_list = []
-    for elem in combined_list:
-        doc_id, score, clause_type = elem
-        if clause_type == QueryType.PHRASAL:
-            score *= PHRASAL_WEIGHT
-        weighted_list.append((doc_id, score))
+    weighted_list = [(doc_id, score * PHRASAL_WEIGHT if clause_type == QueryType.PHRASAL else score)
+                     for doc_id, score, clause_type in combined_list]
 
     # Weed out weaker results
-    weighted_avg_score = get_avg_score(weighted_list)
-    weighted_list = list(filter(lambda x: x[1] > (weighted_avg_score * FILTER_STRENGTH), weighted_list))
+    weighted_threshold = get_avg_score(weighted_list) * FILTER_STRENGTH
+    weighted_results = (elem for elem in weighted_list if elem[1] > weighted_threshold)
 
-    # Sort
-    weighted_list.sort(key=lambda x: x[1], reverse=True)
-    return weighted_list
+    # Sort, or only keep the top_k results
+    if top_k is None:
+        return sorted(weighted_results, key=lambda x: x[1], reverse=True)
+    return heapq.nlargest(top_k, weighted_results, key=lambda x: x[1])
 
 
 def combine_score_and_tag(scored_list, tagged_list, default_score, default_tag):
@@ -89,21 +94,14 @@ def combine_score_and_tag(scored_list, tagged_list, default_score, default_tag):
         default_score (float): The default score for those without a score
         default_tag (QueryType): The default tag for those without a tag
     """
-    tagged_score = []
-
     # Tagged_prio_dict has the format of dict[doc_id] = (score, clause_type)
-    tagged_score_dict = {}
-
     # Tagged_prio_list has the format of (doc_id, clause_type)
-    for elem in tagged_list:
-        tagged_score_dict[elem[0]] = (default_score, elem[1])
+    tagged_score_dict = {doc_id: (default_score, clause_type) for doc_id, clause_type in tagged_list}
 
     # Results_with_score has the format of (doc_id, score)
-    for elem in scored_list:
-        if elem[0] in tagged_score_dict:
-            tagged_score_dict[elem[0]] = (elem[1], tagged_score_dict[elem[0]][1])
-        else:
-            tagged_score_dict[elem[0]] = (elem[1], default_tag)
+    for doc_id, score in scored_list:
+        tagged = tagged_score_dict.get(doc_id)
+        tagged_score_dict[doc_id] = (score, default_tag if tagged is None else tagged[1])
 
     # Final output has the format of (doc_id, score, tag)
     return [(k, v[0], v[1]) for k, v in tagged_score_dict.items()]
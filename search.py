@@ -1,19 +1,24 @@
 #!/usr/bin/python3
 from query import process_query
-from constants import USE_PRF
+from constants import USE_PRF, TOP_K, RESULT_CACHE_SUFFIX, RESULT_CACHE_SIZE, NORMALISATION_MEMO_SUFFIX
+from segments import open_index
+from index_helper import get_doc_ids, posting_cache
+from cli_util import parse_size
+from result_cache import ResultCache, get_index_generation, get_query_key
+from word_processing import memo
 
 import re
 import nltk
 import sys
 import getopt
-import pickle
 
 
 def usage():
-    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results")
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results [-k number-of-results]"
+          + " [--cache-mem size] [--result-cache size] [--explain]")
 
 
-def run_search(dict_file, postings_file, queries_file, results_file):
+def run_search(dict_file, postings_file, queries_file, results_file, top_k=TOP_K, explain=False, result_cache_size=RESULT_CACHE_SIZE):
     """Using the given dictionary file and postings impt_wordsearching on
        the given queries file and output the results to a file
 
@@ -22,16 +27,24 @@ def run_search(dict_file, postings_file, queries_file, results_file):
         postings_file: The postings file filename
         queries_file: The query filename
         results_file: The filename to write our output
+        top_k: The number of results to output per query, or None for all of them
+        explain: Whether to print the plan of every query and its estimated cost
+        result_cache_size: The size of the disk cache of query results (see result_cache.py), 0 to disable it
     """
     print('running search on the queries...')
 
-    infile = open(dict_file, 'rb')
-    new_dict = pickle.load(infile)
-    infile.close()
+    # The normalisation memo saved with the index, see word_processing.NormalisationMemo
+    memo_file = dict_file + NORMALISATION_MEMO_SUFFIX
+    memo.load(memo_file)
+
+    # Repeated queries are answered from the result cache, the index is only opened for the first query that is not cached
+    result_cache = None
+    if result_cache_size > 0 and not explain:
+        result_cache = ResultCache(dict_file + RESULT_CACHE_SUFFIX, get_index_generation(dict_file, postings_file), result_cache_size)
+    new_dict = posting_file = None
 
     in_file = open(queries_file, 'r', encoding="utf8")
     out_file = open(results_file, 'w', encoding="utf8")
-    posting_file = open(postings_file, 'rb')
     query_list = in_file.read().splitlines()
 
     while query_list:
@@ -39,19 +52,45 @@ def run_search(dict_file, postings_file, queries_file, results_file):
         if (not query):
             out_file.write("")
         else:
-            out_file.write(process_query(query, new_dict, posting_file, use_prf=USE_PRF))
+            doc_ids = None
+            if result_cache is not None:
+                key = get_query_key(query, top_k)
+                doc_ids = result_cache.get(key)
+            if doc_ids is None:
+                if new_dict is None:
+                    new_dict, posting_file = open_index(dict_file, postings_file)
+                results = process_query(query, new_dict, posting_file, use_prf=USE_PRF, top_k=top_k, explain=explain)
+                # The index numbers documents with ordinals, only the final output uses doc ID's
+                doc_ids = get_doc_ids(results, new_dict)
+                if result_cache is not None:
+                    result_cache.put(key, doc_ids)
+            out_file.write(" ".join(str(doc_id) for doc_id in doc_ids))
         
         if query_list:
             out_file.write('\n')
 
     in_file.close()
     out_file.close()
+    if posting_file is not None:
+        posting_file.close()
+
+    if result_cache is not None:
+        result_cache.evict()
+        print('result cache: {} hits, {} misses'.format(result_cache.hits, result_cache.misses))
+    stats = posting_cache.stats()
+    print('posting cache: {} hits, {} misses ({:.0%} hit rate), {} evictions, {} entries, ~{:.1f} MB'.format(
+        stats['hits'], stats['misses'], stats['hit_rate'], stats['evictions'], stats['entries'], stats['bytes'] / 1024 ** 2))
+    print('normalisation memo: {:.1%} hit rate ({} hits, {} misses)'.format(memo.get_hit_rate(), memo.hits, memo.misses))
+    memo.save(memo_file)
 
 
 dictionary_file = postings_file = file_of_queries = output_file_of_results = None
+top_k = TOP_K
+explain = False
+result_cache_size = RESULT_CACHE_SIZE
 
 try:
-    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:')
+    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:k:', ['top-k=', 'cache-mem=', 'result-cache=', 'explain'])
 except getopt.GetoptError:
     usage()
     sys.exit(2)
@@ -65,6 +104,14 @@ for o, a in opts:
         file_of_queries = a
     elif o == '-o':
         file_of_output = a
+    elif o in ('-k', '--top-k'):
+        top_k = int(a)
+    elif o == '--cache-mem': # memory budget of the posting cache, e.g. 64M
+        posting_cache.max_bytes = parse_size(a)
+    elif o == '--result-cache': # size of the disk cache of query results, e.g. 16M, or 0 to disable it
+        result_cache_size = parse_size(a)
+    elif o == '--explain': # print the plan of every query
+        explain = True
     else:
         assert False, "unhandled option"
 
@@ -72,4 +119,4 @@ if dictionary_file == None or postings_file == None or file_of_queries == None o
     usage()
     sys.exit(2)
 
-run_search(dictionary_file, postings_file, file_of_queries, file_of_output)
+run_search(dictionary_file, postings_file, file_of_queries, file_of_output, top_k, explain, result_cache_size)
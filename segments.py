@@ -0,0 +1,440 @@
+from constants import *
+from posting_codec import PostingsFile
+from term_dictionary import DictionaryWriter, load_dictionary
+from spimi import merge_postings, remap_postings, share_words
+from doc_values import DocValues, merge_doc_values
+
+import numpy as np
+import os
+import pickle
+
+
+def load_manifest(dict_file, postings_file):
+    """
+    Load the list of segments of an index.
+
+    An index starts as a single segment, made of the dictionary and postings files given to index.py.
+    Every incremental update adds a segment, and deletes and updates are recorded as tombstones:
+    tombstones[doc_id] = segment_id means that the postings of doc_id in the segments with an id
+    smaller than segment_id are dead.
+
+    The manifest is a dictionary of:
+        segments: list of { id, dictionary, postings, num_of_docs }, oldest first
+        tombstones: { doc_id: segment_id }
+        next_id: the id of the next segment
+        next_file: the number used to name the files of the next segment
+
+    Args:
+        dict_file (str): the dictionary filename of the index
+        postings_file (str): the postings filename of the index
+    Returns:
+        dict: the manifest
+    """
+    manifest_file = dict_file + SEGMENT_MANIFEST_SUFFIX
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'rb') as infile:
+            return pickle.load(infile)
+
+    num_of_docs = len(load_dictionary(dict_file)[DOCUMENT_LENGTH_KEYWORD]) if os.path.exists(dict_file) else 0
+    return {
+        'segments': [{'id': 0, 'dictionary': dict_file, 'postings': postings_file, 'num_of_docs': num_of_docs}],
+        'tombstones': {},
+        'next_id': 1,
+        'next_file': 1,
+    }
+
+
+def save_manifest(dict_file, manifest):
+    """
+    Save the manifest of an index. The manifest is replaced atomically, so a search started
+    at any time sees either the old or the new list of segments.
+
+    Args:
+        dict_file (str): the dictionary filename of the index
+        manifest (dict): the manifest
+    """
+    manifest_file = dict_file + SEGMENT_MANIFEST_SUFFIX
+    with open(manifest_file + '.tmp', 'wb') as outfile:
+        pickle.dump(manifest, outfile)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+
+def remove_segments(dict_file, postings_file):
+    """
+    Remove the segments and manifest of an index, except its base dictionary and postings files.
+    This is done before a full rebuild.
+
+    Args:
+        dict_file (str): the dictionary filename of the index
+        postings_file (str): the postings filename of the index
+    """
+    manifest_file = dict_file + SEGMENT_MANIFEST_SUFFIX
+    if not os.path.exists(manifest_file):
+        return
+
+    for segment in load_manifest(dict_file, postings_file)['segments']:
+        for filename in (segment['dictionary'], segment['postings']):
+            if filename not in (dict_file, postings_file) and os.path.exists(filename):
+                os.remove(filename)
+    os.remove(manifest_file)
+
+
+def new_segment(manifest, dict_file, postings_file):
+    """
+    Allocate the id and filenames of a new segment.
+
+    Args:
+        manifest (dict): the manifest
+        dict_file (str): the dictionary filename of the index
+        postings_file (str): the postings filename of the index
+    Returns:
+        dict: the segment, { id, dictionary, postings, num_of_docs }
+    """
+    segment = {
+        'id': manifest['next_id'],
+        'dictionary': dict_file + '.' + str(manifest['next_file']),
+        'postings': postings_file + '.' + str(manifest['next_file']),
+        'num_of_docs': 0,
+    }
+    manifest['next_id'] += 1
+    manifest['next_file'] += 1
+    return segment
+
+
+def add_segment(manifest, segment):
+    """
+    Add a newly built segment to the index. Documents of the segment that already exist in
+    older segments are updates, so their older versions are tombstoned.
+
+    Args:
+        manifest (dict): the manifest
+        segment (dict): the segment, from new_segment()
+    """
+    new_doc_ids = load_dictionary(segment['dictionary'])[DOC_IDS_KEYWORD]
+    segment['num_of_docs'] = len(new_doc_ids)
+
+    for old_segment in manifest['segments']:
+        old_doc_ids = load_dictionary(old_segment['dictionary'])[DOC_IDS_KEYWORD]
+        for doc_id in np.intersect1d(new_doc_ids, old_doc_ids).tolist():
+            manifest['tombstones'][doc_id] = segment['id']
+
+    manifest['segments'].append(segment)
+
+
+def get_biwords(manifest):
+    """
+    Get the biwords indexed in any segment of an index (see index.py -b).
+
+    Args:
+        manifest (dict): the manifest
+    Returns:
+        set(str): the biword terms
+    """
+    biwords = set()
+    for segment in manifest['segments']:
+        if os.path.exists(segment['dictionary']):
+            dictionary = load_dictionary(segment['dictionary'])
+            biwords.update(term for term, _ in dictionary.terms() if term.startswith(BIWORD_PREFIX))
+            dictionary.close()
+    return biwords
+
+
+def delete_documents(manifest, doc_ids):
+    """
+    Delete documents from the index, by tombstoning them in every existing segment.
+
+    Args:
+        manifest (dict): the manifest
+        doc_ids (list(int)): the doc ids to delete
+    """
+    for doc_id in doc_ids:
+        manifest['tombstones'][doc_id] = manifest['next_id']
+
+
+def merge_live_documents(segments, dictionaries, tombstones):
+    """
+    Number the live documents of consecutive segments 0..N-1, in the order of the segments,
+    and merge their special entries (DOCIDS, LENGTH, IMPORTANT and DOCVALUES) accordingly.
+
+    Every segment numbers its documents from 0, so the ordinals of a segment are translated with
+    an ordinal map: ordinal_map[ordinal in the segment] is the merged ordinal, or -1 if the
+    document is dead. As the order of the documents is kept, posting lists stay sorted.
+
+    Args:
+        segments (list(dict)): the segments
+        dictionaries (list): the dictionary of every segment
+        tombstones (dict): the tombstones of the manifest
+    Returns:
+        (list(numpy.ndarray), dict): the ordinal map of every segment, and the merged special entries
+    """
+    ordinal_maps = []
+    doc_ids, lengths, impt_words, doc_values = [], [], [], []
+    num_of_docs = 0
+    for segment, dictionary in zip(segments, dictionaries):
+        segment_doc_ids = np.asarray(dictionary[DOC_IDS_KEYWORD])
+        dead_doc_ids = [doc_id for doc_id, segment_id in tombstones.items() if segment_id > segment['id']]
+        live = ~np.isin(segment_doc_ids, dead_doc_ids)
+
+        ordinal_map = np.full(len(segment_doc_ids), -1, dtype=np.int64)
+        ordinal_map[live] = np.arange(num_of_docs, num_of_docs + np.count_nonzero(live))
+        num_of_docs += np.count_nonzero(live)
+        ordinal_maps.append(ordinal_map)
+
+        doc_ids.append(segment_doc_ids[live])
+        lengths.append(np.asarray(dictionary[DOCUMENT_LENGTH_KEYWORD])[live])
+        segment_impt_words = dictionary[IMPT_KEYWORD]
+        impt_words.extend(segment_impt_words[ordinal] for ordinal in np.flatnonzero(live).tolist())
+        doc_values.append(dictionary.get(DOC_VALUES_KEYWORD, DocValues([], [], [])))
+
+    specials = {
+        DOC_IDS_KEYWORD: np.concatenate(doc_ids) if doc_ids else np.array([], dtype=np.int64),
+        DOCUMENT_LENGTH_KEYWORD: np.concatenate(lengths) if lengths else np.array([]),
+        IMPT_KEYWORD: share_words(impt_words),
+        DOC_VALUES_KEYWORD: merge_doc_values(doc_values, ordinal_maps),
+    }
+    return ordinal_maps, specials
+
+
+def merge_segments(manifest, first, last):
+    """
+    Merge the consecutive segments first..last (inclusive) into a single segment, dropping the
+    postings of dead documents. The merged segment keeps the id of the newest merged segment, so
+    the tombstones still apply to it.
+
+    Args:
+        manifest (dict): the manifest
+        first (int): the index of the first segment to merge in manifest['segments']
+        last (int): the index of the last segment to merge
+    """
+    segments = manifest['segments'][first:last + 1]
+    base = manifest['segments'][0]
+    merged = {
+        'id': segments[-1]['id'],
+        'dictionary': base['dictionary'] + '.' + str(manifest['next_file']),
+        'postings': base['postings'] + '.' + str(manifest['next_file']),
+    }
+    manifest['next_file'] += 1
+
+    dictionaries = [load_dictionary(segment['dictionary']) for segment in segments]
+    posting_files = [PostingsFile(segment['postings']) for segment in segments]
+    ordinal_maps, specials = merge_live_documents(segments, dictionaries, manifest['tombstones'])
+
+    block_terms = [((term, df, pointer) for term, (df, pointer) in dictionary.terms()) for dictionary in dictionaries]
+    posting_output = open(merged['postings'], 'wb')
+    dictionary_output = DictionaryWriter(merged['dictionary'])
+    merge_postings(block_terms, posting_files, posting_output, dictionary_output, ordinal_maps)
+
+    for key, value in specials.items():
+        dictionary_output.add_special(key, value)
+    dictionary_output.add_special(POSTING_FORMAT_KEYWORD, POSTING_FORMAT_VERSION)
+    dictionary_output.close()
+    posting_output.close()
+
+    for dictionary, posting_file in zip(dictionaries, posting_files):
+        dictionary.close()
+        posting_file.close()
+
+    merged['num_of_docs'] = len(specials[DOC_IDS_KEYWORD])
+    manifest['segments'][first:last + 1] = [merged]
+    return segments
+
+
+def apply_merge_policy(manifest):
+    """
+    Merge segments until the index has at most MAX_SEGMENTS segments, always merging the two
+    adjacent segments with the fewest documents, so that small segments are merged together
+    and large segments are rarely rewritten.
+
+    Args:
+        manifest (dict): the manifest
+    Returns:
+        list(dict): the segments that were merged, whose files can be removed once the manifest is saved
+    """
+    merged_segments = []
+    while len(manifest['segments']) > MAX_SEGMENTS:
+        sizes = [manifest['segments'][i]['num_of_docs'] + manifest['segments'][i + 1]['num_of_docs']
+                 for i in range(len(manifest['segments']) - 1)]
+        first = sizes.index(min(sizes))
+        print('Merging segments {} and {}'.format(manifest['segments'][first]['id'], manifest['segments'][first + 1]['id']))
+        merged_segments.extend(merge_segments(manifest, first, first + 1))
+    return merged_segments
+
+
+def compact_index(dict_file, postings_file):
+    """
+    Merge every segment of an index back into its base dictionary and postings files,
+    dropping all the dead documents and the manifest.
+
+    Args:
+        dict_file (str): the dictionary filename of the index
+        postings_file (str): the postings filename of the index
+    """
+    manifest = load_manifest(dict_file, postings_file)
+    old_segments = merge_segments(manifest, 0, len(manifest['segments']) - 1)
+    merged = manifest['segments'][0]
+
+    for segment in old_segments:
+        for filename in (segment['dictionary'], segment['postings']):
+            if filename not in (dict_file, postings_file):
+                os.remove(filename)
+    os.replace(merged['dictionary'], dict_file)
+    os.replace(merged['postings'], postings_file)
+
+    manifest_file = dict_file + SEGMENT_MANIFEST_SUFFIX
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+
+
+def remove_segment_files(segments, manifest):
+    """
+    Remove the files of segments that are no longer in the manifest.
+
+    Args:
+        segments (list(dict)): the segments to remove
+        manifest (dict): the manifest
+    """
+    live_files = set()
+    for segment in manifest['segments']:
+        live_files.update((segment['dictionary'], segment['postings']))
+    for segment in segments:
+        for filename in (segment['dictionary'], segment['postings']):
+            if filename not in live_files and os.path.exists(filename):
+                os.remove(filename)
+
+
+def open_index(dict_file, postings_file):
+    """
+    Open an index for searching, whether or not it has segments.
+
+    Args:
+        dict_file (str): the dictionary filename of the index
+        postings_file (str): the postings filename of the index
+    Returns:
+        (dictionary, posting_file): the dictionary and posting file to pass to process_query
+    """
+    if not os.path.exists(dict_file + SEGMENT_MANIFEST_SUFFIX):
+        return load_dictionary(dict_file), PostingsFile(postings_file)
+
+    manifest = load_manifest(dict_file, postings_file)
+    posting_file = SegmentedPostingsFile(manifest)
+    return SegmentedDictionary(manifest, posting_file), posting_file
+
+
+class SegmentedPostingsFile:
+    """The posting files of every segment of an index, read as one.
+
+    A pointer is a list of (segment number, pointer) pairs, as given by SegmentedDictionary.
+    The posting lists of the segments are concatenated, without the postings of dead documents,
+    and with the ordinals of the segments translated into the ordinals of the whole index
+    (see merge_live_documents()); the ordinal maps are filled in by SegmentedDictionary.
+    """
+
+    def __init__(self, manifest):
+        self.segments = manifest['segments']
+        self.posting_files = [PostingsFile(segment['postings']) for segment in self.segments]
+        self.ordinal_maps = [None for _ in self.segments]
+
+    def read_doc_postings(self, pointers, targets=None):
+        """Decode the doc ids and term frequencies of a posting list, without its positions
+
+        The skip tables of the segments are not used for targets, as they are in the ordinals of the
+        segments: the whole posting lists are decoded, then filtered.
+
+        Args:
+            pointers (list): the (segment number, pointer) pairs of the posting list
+            targets (numpy.ndarray): the sorted doc ids needed, or None for all of them
+        Returns:
+            (numpy.ndarray, numpy.ndarray): the doc ids and term frequencies
+        """
+        postings = []
+        for segment, pointer in pointers:
+            doc_ids, tfs = self.posting_files[segment].read_doc_postings(pointer)
+            postings.append(remap_postings(doc_ids, tfs, None, self.ordinal_maps[segment])[:2])
+        doc_ids, tfs = tuple(np.concatenate(arrays) for arrays in zip(*postings))
+        if targets is not None:
+            keep = np.isin(doc_ids, targets, assume_unique=True)
+            doc_ids, tfs = doc_ids[keep], tfs[keep]
+        return doc_ids, tfs
+
+    def read_posting_list(self, pointers):
+        """Decode the whole posting list
+
+        Args:
+            pointers (list): the (segment number, pointer) pairs of the posting list
+        Returns:
+            (numpy.ndarray, numpy.ndarray, numpy.ndarray): the doc ids, term frequencies and positions
+        """
+        postings = []
+        for segment, pointer in pointers:
+            doc_ids, tfs, positions = self.posting_files[segment].read_posting_list(pointer)
+            postings.append(remap_postings(doc_ids, tfs, positions, self.ordinal_maps[segment]))
+        return tuple(np.concatenate(arrays) for arrays in zip(*postings))
+
+    def close(self):
+        for posting_file in self.posting_files:
+            posting_file.close()
+
+
+class SegmentedDictionary:
+    """The dictionaries of every segment of an index, read as one.
+
+    A term maps to (df, pointers), where df is the number of live documents containing the term
+    across all the segments, and pointers is the list of (segment number, pointer) pairs of its
+    posting lists, to be read with SegmentedPostingsFile. The live documents of all the segments
+    are numbered as in a single index, and DOCIDS, LENGTH, IMPORTANT and DOCVALUES only contain
+    them, the most recent version of a document winning, so the global statistics are correct.
+    """
+
+    def __init__(self, manifest, posting_file):
+        self.dictionaries = [load_dictionary(segment['dictionary']) for segment in manifest['segments']]
+        self.posting_file = posting_file
+
+        posting_file.ordinal_maps, self.specials = merge_live_documents(manifest['segments'], self.dictionaries, manifest['tombstones'])
+        self.specials[POSTING_FORMAT_KEYWORD] = POSTING_FORMAT_VERSION
+        self.has_dead_documents = [bool(np.any(ordinal_map < 0)) for ordinal_map in posting_file.ordinal_maps]
+        self.cache = {}     # term -> (df, pointers), or None if the term has no live postings
+
+    def lookup(self, term):
+        """Find the live df and the pointers of a term
+
+        Args:
+            term (str): the term
+        Returns:
+            (int, list): the df and (segment number, pointer) pairs of the term, or None
+        """
+        if term in self.cache:
+            return self.cache[term]
+
+        df = 0
+        pointers = []
+        for number, dictionary in enumerate(self.dictionaries):
+            if term not in dictionary:
+                continue
+            segment_df, pointer = dictionary[term]
+            pointers.append((number, pointer))
+
+            # Only decode the doc ids when some documents of the segment are dead
+            if not self.has_dead_documents[number]:
+                df += segment_df
+            else:
+                doc_ids, _ = self.posting_file.read_doc_postings([(number, pointer)])
+                df += len(doc_ids)
+
+        entry = (df, pointers) if df > 0 else None
+        self.cache[term] = entry
+        return entry
+
+    def __contains__(self, key):
+        return key in self.specials or self.lookup(key) is not None
+
+    def __getitem__(self, key):
+        if key in self.specials:
+            return self.specials[key]
+
+        entry = self.lookup(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
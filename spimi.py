@@ -1,197 +1,314 @@
 from constants import *
 from collections import Counter
-from index_helper import index_text
+from index_helper import index_text, index_biwords
+from posting_codec import PostingsFile, encode_posting_list, decode_posting_list, sort_postings
+from term_dictionary import DictionaryWriter, load_dictionary
+from doc_values import DocValues, merge_doc_values, parse_date
+from array import array
 
-import pickle
+import numpy as np
 import os
 import math
+import heapq
 
 
-def invert(multiple_doc_list, dictionary_file_add, posting_file_add):
-    """Invert a term stream to dictionary and posting files
+# Rough CPython sizes (in bytes) of the bookkeeping of a BlockBuilder, on top of its array contents
+TERM_OVERHEAD_BYTES = 400       # dictionary slot, term string, tuple and three empty arrays
+DOCUMENT_OVERHEAD_BYTES = 500   # LENGTH and IMPT entries of a document
 
-    Args:
-        multiple_doc_list (<list<doc_id, token_list>>): list consisting of (doc_id, token_list) tuples
-        dictionary_file_add (str): address of the dictionary file
-        posting_file_add (str): address of the posting file
+
+class BlockBuilder:
+    """Accumulate the postings of a SPIMI block in compact, append-only arrays.
+
+    Every term has three arrays: the doc ids, the term frequencies, and the positions of all its
+    postings concatenated. As a posting has exactly tf positions, the positions of the i-th posting
+    start at the sum of the first i term frequencies, so no separate offsets are stored.
+
+    Adding a document only appends to the arrays, so building a block takes linear time, and the
+    (doc_id, tf, position list) tuples are only created one term at a time when the block is written.
+
+    Documents are identified by their ordinal (see build_index()), not by their doc id in the csv.
+    The title of a document is indexed as its own zone, under terms prefixed with TITLE_ZONE_PREFIX,
+    which do not count towards the document length. The court and date_posted are kept as doc values.
+    Pairs of consecutive tokens can also be indexed as biword terms (see index_helper.get_biword()),
+    whose term frequency is the number of times the pair appears, and which do not count towards the
+    document length either.
     """
-    dictionary = {}
-    dictionary[DOCUMENT_LENGTH_KEYWORD] = {}        # This is where we'll store the length of each docs
-    dictionary[IMPT_KEYWORD] = {}
 
-    for doc_id, token_list in multiple_doc_list:
-        content_dict = index_text(token_list)
+    def __init__(self, with_biwords=False, biwords=None):
+        """
+        Args:
+            with_biwords (bool): whether pairs of consecutive tokens are indexed as biwords
+            biwords (set): if given, only these biwords are indexed, otherwise every pair is
+        """
+        self.with_biwords = with_biwords
+        self.biwords = biwords
+        self.postings = {}      # term -> (doc ids, term frequencies, positions)
+        self.lengths = {}       # doc id -> document length
+        self.impt_words = {}    # doc id -> most frequent tokens
+        self.courts = {}        # doc id -> court
+        self.dates = {}         # doc id -> date_posted, as YYYYMMDD
+        self.num_of_docs = 0
+        self.nbytes = 0         # estimated memory held by the block
+
+    def add_posting(self, doc_id, term, tf, position_list):
+        """Append a posting to the arrays of a term
+
+        Args:
+            doc_id (int): the ordinal of the document
+            term (str): the term
+            tf (int): the term frequency
+            position_list (list): the positions of the term in the document
+        """
+        if term not in self.postings:
+            self.postings[term] = (array('i'), array('i'), array('i'))
+            self.nbytes += TERM_OVERHEAD_BYTES
+        doc_ids, tfs, positions = self.postings[term]
+        doc_ids.append(doc_id)
+        tfs.append(tf)
+        positions.extend(position_list)
+        self.nbytes += (2 + tf) * doc_ids.itemsize
+
+    def add_document(self, doc_id, token_list, title_list=(), court='', date_posted=''):
+        """Add the postings of a document to the block
+
+        Args:
+            doc_id (int): the ordinal of the document
+            token_list (list): the tokens of the document
+            title_list (list): the tokens of the title of the document
+            court (str): the court of the document
+            date_posted (str): the date_posted of the document
+        """
+        doc_id = int(doc_id)
         length = 0
 
         # Calculate and precompute df and length
-        for term, tup in content_dict.items():
-            tf, position_list = tup
-            if term not in dictionary:
-                # First entry is df, the rest is the posting list, which consist of the doc id, tf, and position list
-                dictionary[term] = (1, [(int(doc_id), tf, position_list)])
-            else:
-                df = dictionary[term][0] + 1
-                posting_list = dictionary[term][1] + [(int(doc_id), tf, position_list)]
-                dictionary[term] = (df, posting_list)
+        for term, (tf, position_list) in index_text(token_list).items():
+            self.add_posting(doc_id, term, tf, position_list)
+
             # Document length is calculated from tf
             length += (1 + math.log(tf, 10)) ** 2
 
+        # The title zone
+        for term, (tf, position_list) in index_text(title_list).items():
+            self.add_posting(doc_id, TITLE_ZONE_PREFIX + term, tf, position_list)
+
+        if self.with_biwords:
+            for biword, (tf, position_list) in index_biwords(token_list, self.biwords).items():
+                self.add_posting(doc_id, biword, tf, position_list)
+
+        self.courts[doc_id] = court
+        self.dates[doc_id] = parse_date(date_posted)
+
         # Calculate document length for document normalization in search
-        dictionary[DOCUMENT_LENGTH_KEYWORD][int(doc_id)] = math.sqrt(length)
+        self.lengths[doc_id] = math.sqrt(length)
 
         # Add most frequent words in the document to the dictionary (for PRF)
         token_counter = Counter(token_list)
-        frequent_tokens = list(map(lambda x: x[0], token_counter.most_common(PRF_NUM_OF_WORDS_PER_DOC)))
-        dictionary[IMPT_KEYWORD][int(doc_id)] = frequent_tokens
+        self.impt_words[doc_id] = [token for token, _ in token_counter.most_common(PRF_NUM_OF_WORDS_PER_DOC)]
+
+        self.num_of_docs += 1
+        self.nbytes += DOCUMENT_OVERHEAD_BYTES
+
+    def get_postings(self, term):
+        """Get the postings of a term, sorted by doc id
+
+        Args:
+            term (str): the term
+        Returns:
+            (numpy.ndarray, numpy.ndarray, numpy.ndarray): the doc ids, term frequencies and positions
+        """
+        doc_ids, tfs, positions = self.postings[term]
+
+        # Documents may have been added out of doc id order
+        return sort_postings(np.asarray(doc_ids), np.asarray(tfs), np.asarray(positions))
+
+    def write(self, dictionary_file_add, posting_file_add):
+        """Write the block to dictionary and posting files
+
+        The dictionary of the block is written in the same format as the final dictionary (see term_dictionary.py),
+        so that its terms can be read back one at a time, in sorted order, when the blocks are merged.
+
+        Args:
+            dictionary_file_add (str): address of the dictionary file
+            posting_file_add (str): address of the posting file
+        """
+        dictionary_file = DictionaryWriter(dictionary_file_add)
+        posting_file = open(posting_file_add, 'wb')
+
+        # Store posting_lists and dictionary to files
+        # The posting lists are written in term order, so that the blocks can be merged in a single sequential pass
+        for term in sorted(self.postings.keys()):
+            doc_ids, tfs, positions = self.get_postings(term)
+            pointer = posting_file.tell()           # find our current position in the posting file
+            posting_file.write(encode_posting_list(doc_ids, tfs, positions))
+            dictionary_file.add_term(term, len(doc_ids), pointer)
+
+        dictionary_file.add_special(DOCUMENT_LENGTH_KEYWORD, self.lengths)
+        dictionary_file.add_special(IMPT_KEYWORD, self.impt_words)
+        dictionary_file.add_special(DOC_VALUES_KEYWORD, DocValues(list(self.courts.keys()), list(self.courts.values()),
+                                                                  list(self.dates.values())))
+        posting_file.close()
+        dictionary_file.close()
+
+
+def merge_blocks(dictionary_file_adds, posting_file_adds, output_dictionary_add, output_posting_add, doc_id_table, keep_term=None):
+    """Merge all the pairs of block dictionary and posting files in a single pass
+
+    Every block is opened at once, and the terms are walked in sorted order through a heap,
+    so that every posting list is read and written exactly once. The blocks must have their
+    posting lists written in term order (see BlockBuilder.write()), so each block file is read sequentially.
+    The terms of every block dictionary are also read lazily, one at a time, and streamed to the output
+    dictionary file (see term_dictionary.py) as they are merged, so only LENGTH, IMPORTANT and DOCVALUES
+    are held in memory, whatever the size of the vocabulary.
+
+    LENGTH and IMPORTANT are written as an array and a list indexed by the ordinal of the documents,
+    along with doc_id_table, which translates ordinals back into doc ids.
 
-    # This part onwards will store the dictionary and posting list to the files
+    Args:
+        dictionary_file_adds (list<str>): addresses of the block dictionary files
+        posting_file_adds (list<str>): addresses of the block posting files, in the same order
+        output_dictionary_add (str): address of the output dictionary file
+        output_posting_add (str): address of the output posting file
+        doc_id_table (numpy.ndarray): the doc id of every ordinal
+        keep_term (function): tells whether a term is written from the term and its df, see merge_postings()
+    """
+    lengths = {}
+    impt_words = {}
+    doc_values = []
+
+    # Every block contributes an iterator of (term, df, pointer), sorted by term
+    block_dictionaries = [load_dictionary(dictionary_file_add) for dictionary_file_add in dictionary_file_adds]
+    block_terms = []
+    for block_dictionary in block_dictionaries:
+        # Combine the LENGTH and IMPT
+        lengths.update(block_dictionary[DOCUMENT_LENGTH_KEYWORD])
+        impt_words.update(block_dictionary[IMPT_KEYWORD])
+        doc_values.append(block_dictionary[DOC_VALUES_KEYWORD])
+
+        block_terms.append((term, df, pointer) for term, (df, pointer) in block_dictionary.terms())
+
+    posting_files = [PostingsFile(posting_file_add) for posting_file_add in posting_file_adds]
+    posting_output = open(output_posting_add, 'wb')
+    dictionary_output = DictionaryWriter(output_dictionary_add)
 
-    dictionary_file = open(dictionary_file_add, 'wb')
-    posting_file = open(posting_file_add, 'wb')
+    merge_postings(block_terms, posting_files, posting_output, dictionary_output, keep_term=keep_term)
 
-    # Delete the existing contents, if any
-    dictionary_file.truncate(0)
-    posting_file.truncate(0)
+    # Dump the special entries of the dictionary, indexed by ordinal
+    length_array = np.zeros(len(doc_id_table))
+    length_array[np.fromiter(lengths.keys(), dtype=np.int64, count=len(lengths))] = list(lengths.values())
+    dictionary_output.add_special(DOC_IDS_KEYWORD, doc_id_table)
+    dictionary_output.add_special(DOCUMENT_LENGTH_KEYWORD, length_array)
+    dictionary_output.add_special(IMPT_KEYWORD, share_words([impt_words.get(ordinal, []) for ordinal in range(len(doc_id_table))]))
+    dictionary_output.add_special(DOC_VALUES_KEYWORD, merge_doc_values(doc_values))
+    dictionary_output.add_special(POSTING_FORMAT_KEYWORD, POSTING_FORMAT_VERSION)
 
-    # Store posting_lists and dictionary to files
-    for term, value in dictionary.items():
-        if term == DOCUMENT_LENGTH_KEYWORD:     # LENGTH is not a term, it will be stored in the dictionary
-            continue
-        if term == IMPT_KEYWORD:                # IMPT_KEYWORD is not a term, it will be stored in the dictionary
-            continue
-        df, posting_list = value
-        pointer = posting_file.tell()           # find our current position in the posting file
-        pickle.dump(posting_list, posting_file) # dump the posting list into the posting file
-        dictionary[term] = (df, pointer)        # keep track of the pointer
+    # Close the files
+    for block_dictionary, posting_file in zip(block_dictionaries, posting_files):
+        block_dictionary.close()
+        posting_file.close()
+    dictionary_output.close()
+    posting_output.close()
 
-    pickle.dump(dictionary, dictionary_file)
-    posting_file.close()
-    dictionary_file.close()
+    # Remove the old files
+    for dictionary_file_add, posting_file_add in zip(dictionary_file_adds, posting_file_adds):
+        os.remove(dictionary_file_add)
+        os.remove(posting_file_add)
 
 
-def merge_files(dictionary_file_1_add, posting_file_1_add, dictionary_file_2_add, posting_file_2_add,
-    output_dictionary_add, output_posting_add):
-    """Merge two pairs of dictionary and posting files
+def merge_postings(block_terms, posting_files, posting_output, dictionary_output, ordinal_maps=None, keep_term=None):
+    """Merge the posting lists of several blocks, walking their terms in sorted order through a heap
 
     Args:
-        dictionary_1_add (str): add of the first dictionary file
-        posting_file_1_add (str): address of the first posting file
-        dictionary_file_2_add (str): address of the second dictionary file
-        posting_file_2_add (str): address of the second posting file
-        output_dictionary_add (str): address of the output dictionary file
-        output_posting_add (str): address of the output posting file
+        block_terms (list<iterator>): for every block, an iterator of (term, df, pointer), sorted by term
+        posting_files (list<PostingsFile>): the posting file of every block, in the same order
+        posting_output: the output posting file, opened in 'wb' mode
+        dictionary_output (DictionaryWriter): the output dictionary
+        ordinal_maps (list<numpy.ndarray>): for every block, the new ordinal of every ordinal of the block,
+                                            or -1 to drop its postings. If None, ordinals are kept as they are
+        keep_term (function): tells whether a term is written from the term and its total df in the blocks,
+                              e.g. to drop infrequent biwords. If None, every term is written
     """
-    # Open the dictionary files
-    infile = open(dictionary_file_1_add, 'rb')
-    dictionary_1 = pickle.load(infile)
-    infile.close()
-    infile = open(dictionary_file_2_add, 'rb')
-    dictionary_2 = pickle.load(infile)
-    infile.close()
-
-    # Open the posting list files
-    posting_file_1 = open(posting_file_1_add, 'rb')
-    posting_file_2 = open(posting_file_2_add, 'rb')
-
-    # Open the output files
-    dictionary_output = open(output_dictionary_add, 'wb')
-    posting_output = open(output_posting_add, 'wb')
-
-    # Delete the existing contents, if any
-    dictionary_output.truncate(0)
-    posting_output.truncate(0)
-
-    dictionary = {}
-
-    # Iterate through dictionary 1
-    for term in dictionary_1.keys():
-        if term == DOCUMENT_LENGTH_KEYWORD:     # LENGTH is not a term, it will be stored in the dictionary
+    # The heap contains the next term of every block, as (term, block number, df, pointer)
+    heap = []
+    for block, terms in enumerate(block_terms):
+        entry = next(terms, None)
+        if entry is not None:
+            heap.append((entry[0], block, entry[1], entry[2]))
+    heapq.heapify(heap)
+
+    while heap:
+        term = heap[0][0]
+        df = 0
+        records = []
+
+        # Pop every block that has the same term
+        while heap and heap[0][0] == term:
+            _, block, block_df, pointer = heapq.heappop(heap)
+            records.append((block, posting_files[block].record(pointer)))
+            df += block_df
+
+            entry = next(block_terms[block], None)
+            if entry is not None:
+                heapq.heappush(heap, (entry[0], block, entry[1], entry[2]))
+
+        if keep_term is not None and not keep_term(term, df):
             continue
-        if term == IMPT_KEYWORD:     # LENGTH is not a term, it will be stored in the dictionary
-            continue
-        df_1 = df_2 = 0
-        df_1, pointer_1 = dictionary_1[term]
-        posting_file_1.seek(pointer_1)
-        posting_list_1 = pickle.load(posting_file_1)
-        if term in dictionary_2:                            # check if the term exist in the other dictionary
-            df_2, pointer_2 = dictionary_2[term]
-            posting_file_2.seek(pointer_2)
-            posting_list_2 = pickle.load(posting_file_2)
-            # Using the old function should still work, as tuple comparison checks from first index
-            posting_list = merge_lists(posting_list_1, posting_list_2)
+
+        if len(records) == 1 and ordinal_maps is None:
+            # The record can be copied without decoding it
+            record = records[0][1]
         else:
-            posting_list = posting_list_1
+            postings = []
+            for block, record in records:
+                doc_ids, tfs, positions = decode_posting_list(record)
+                if ordinal_maps is not None:
+                    doc_ids, tfs, positions = remap_postings(doc_ids, tfs, positions, ordinal_maps[block])
+                postings.append((doc_ids, tfs, positions))
+
+            # Blocks are sorted by doc id internally, but may overlap each other
+            doc_ids, tfs, positions = sort_postings(*(np.concatenate(arrays) for arrays in zip(*postings)))
+            if len(doc_ids) == 0:
+                continue
+            record = encode_posting_list(doc_ids, tfs, positions)
+            df = len(doc_ids)
 
         # Dump into the output file
         pointer = posting_output.tell()
-        pickle.dump(posting_list, posting_output)
-        dictionary[term] = (df_1 + df_2, pointer)
+        posting_output.write(record)
+        dictionary_output.add_term(term, df, pointer)
 
-    # For terms in dictionary_2 but not in dictionary_1
-    for term in dictionary_2.keys():
-        if term == DOCUMENT_LENGTH_KEYWORD:     # LENGTH is not a term, it will be stored in the dictionary
-            continue
-        if term == IMPT_KEYWORD:                # IMPT_KEYWORD is not a term, it will be stored in the dictionary
-            continue
-        if term not in dictionary:
-            df_2, pointer_2 = dictionary_2[term]
-            posting_file_2.seek(pointer_2)
-            posting_list_2 = pickle.load(posting_file_2)
-
-            # Dump into the output file
-            pointer = posting_output.tell()
-            pickle.dump(posting_list_2, posting_output)
-            dictionary[term] = (df_2, pointer)
-
-    # Combine the LENGTH
-    length_dict1 = dictionary_1[DOCUMENT_LENGTH_KEYWORD]
-    length_dict2 = dictionary_2[DOCUMENT_LENGTH_KEYWORD]
-    length_dict = {**length_dict1, **length_dict2}          # merge two dictionaries
-    dictionary[DOCUMENT_LENGTH_KEYWORD] = length_dict
-
-    # Combine the IMPT
-    impt_dict1 = dictionary_1[IMPT_KEYWORD]
-    impt_dict2 = dictionary_2[IMPT_KEYWORD]
-    impt_dict = {**impt_dict1, **impt_dict2}             # merge two dictionaries
-    dictionary[IMPT_KEYWORD] = impt_dict
-
-    # Dump the dictionary
-    pickle.dump(dictionary, dictionary_output)
 
-    # Close the files
-    posting_file_1.close()
-    posting_file_2.close()
-    dictionary_output.close()
-    posting_output.close()
+def remap_postings(doc_ids, tfs, positions, ordinal_map):
+    """Translate the ordinals of a posting list, dropping the postings mapped to -1
+
+    Args:
+        doc_ids (numpy.ndarray): the ordinals
+        tfs (numpy.ndarray): the term frequencies
+        positions (numpy.ndarray): the positions of every posting, concatenated, or None
+        ordinal_map (numpy.ndarray): the new ordinal of every ordinal, or -1
+    Returns:
+        (numpy.ndarray, numpy.ndarray, numpy.ndarray): the remaining postings, with their new ordinals
+    """
+    new_doc_ids = ordinal_map[doc_ids]
+    live = new_doc_ids >= 0
+    if positions is not None:
+        positions = positions[np.repeat(live, tfs)]
+    return new_doc_ids[live], tfs[live], positions
 
-    # Remove the old files
-    os.remove(dictionary_file_1_add)
-    os.remove(dictionary_file_2_add)
-    os.remove(posting_file_1_add)
-    os.remove(posting_file_2_add)
 
+def share_words(word_lists):
+    """Make every occurrence of a word in lists of words the same string object
 
-def merge_lists(list_1, list_2):
-    """Merge two sorted lists into one sorted list with an OR operation.
+    pickle writes a string object once, then refers to it, so the size of a pickled list of words
+    depends on which of its equal words are the same object. That depends on where they were built
+    (e.g. in a worker process of index.py -j), so the words are shared before they are dumped, and
+    the dictionary is the same however it was built.
 
     Args:
-        list_1 (list<int>) The first sorted list
-        list_2 (list<int>) The second sorted list
+        word_lists (list(list(str))): the lists of words, e.g. the important words of every document
+    Returns:
+        list(list(str)): the same lists, with a single object per distinct word
     """
-    i = 0
-    j = 0
-    list = []
-    while i < len(list_1) and j < len(list_2):
-        if list_1[i] < list_2[j]:
-            list.append(list_1[i])
-            i += 1
-        elif list_1[i] > list_2[j]:
-            list.append(list_2[j])
-            j+= 1
-        elif list_1[i] == list_2[j]:
-            list.append(list_1[i])
-            i += 1
-            j += 1
-    list.extend(list_1[i:])
-    list.extend(list_2[j:])
-    return list
+    words = {}
+    return [[words.setdefault(word, word) for word in word_list] for word_list in word_lists]
@@ -0,0 +1,233 @@
+from constants import TERM_BLOCK_SIZE, TERM_CACHE_SIZE
+from posting_codec import encode_number, decode_number
+from bisect import bisect_right
+from collections import OrderedDict
+
+import numpy as np
+import mmap
+import pickle
+import struct
+
+DICTIONARY_MAGIC = b'TDIC'
+DICTIONARY_VERSION = 1
+TRAILER_FORMAT = '<4Q'      # block index offset, number of blocks, specials offset, number of terms
+
+
+class DictionaryWriter:
+    """Write a dictionary file, one term at a time.
+
+    The terms must be added in sorted order. They are grouped into blocks of TERM_BLOCK_SIZE terms,
+    and front coded within a block: every term only stores the length of the prefix it shares with
+    the previous term, and the rest of it. Every entry also stores the df and the pointer of the term.
+
+    The first term and the offset of every block are kept in a small block index at the end of
+    the file, so a term is found by a binary search on the block index, then a scan of one block.
+
+    Special entries (such as LENGTH and IMPORTANT) are pickled separately, so they are only
+    loaded when they are used.
+
+    File layout:
+        magic, version
+        term blocks and pickled special entries, in the order they were added
+        block index: the offsets of the blocks (uint64), then their first terms, joined by newlines
+        specials table: pickled { key: (offset, length) }
+        trailer: block index offset, number of blocks, specials offset, number of terms
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'wb')
+        self.file.write(DICTIONARY_MAGIC + bytes([DICTIONARY_VERSION]))
+        self.block = []             # the (term, df, pointer) entries of the current block
+        self.block_offsets = []
+        self.block_first_terms = []
+        self.specials = {}
+        self.num_of_terms = 0
+
+    def add_term(self, term, df, pointer):
+        """Add a term, which must come after every term added before
+
+        Args:
+            term (str): the term
+            df (int): the document frequency of the term
+            pointer (int): the pointer to the posting list of the term
+        """
+        self.block.append((term.encode('utf-8'), df, pointer))
+        self.num_of_terms += 1
+        if len(self.block) == TERM_BLOCK_SIZE:
+            self.write_block()
+
+    def add_special(self, key, value):
+        """Add a special entry, which is not a term
+
+        Args:
+            key (str): the key of the entry, e.g. DOCUMENT_LENGTH_KEYWORD
+            value: any picklable value
+        """
+        offset = self.file.tell()
+        pickle.dump(value, self.file)
+        self.specials[key] = (offset, self.file.tell() - offset)
+
+    def write_block(self):
+        """Front code the current block and write it to the file"""
+        if not self.block:
+            return
+
+        self.block_offsets.append(self.file.tell())
+        self.block_first_terms.append(self.block[0][0])
+
+        encoded = [encode_number(len(self.block))]
+        previous = b''
+        for term, df, pointer in self.block:
+            prefix_length = 0
+            while prefix_length < min(len(term), len(previous)) and term[prefix_length] == previous[prefix_length]:
+                prefix_length += 1
+            suffix = term[prefix_length:]
+            encoded.extend((encode_number(prefix_length), encode_number(len(suffix)), suffix,
+                            encode_number(df), encode_number(pointer)))
+            previous = term
+
+        self.file.write(b''.join(encoded))
+        self.block = []
+
+    def close(self):
+        self.write_block()
+
+        block_index_offset = self.file.tell()
+        self.file.write(np.array(self.block_offsets, dtype='<u8').tobytes())
+        self.file.write(b'\n'.join(self.block_first_terms))
+
+        specials_offset = self.file.tell()
+        pickle.dump(self.specials, self.file)
+
+        self.file.write(struct.pack(TRAILER_FORMAT, block_index_offset, len(self.block_offsets),
+                                    specials_offset, self.num_of_terms))
+        self.file.close()
+
+
+class TermDictionary:
+    """A read-only dictionary file, loaded lazily (see DictionaryWriter for the format).
+
+    Opening the dictionary only loads the block index, so startup time does not depend on
+    the size of the vocabulary or of the corpus. Terms are resolved by a binary search on the
+    block index followed by a scan of one block, and special entries (such as LENGTH) are only
+    unpickled the first time they are accessed. Supports `in`, `[]` and get(), like a dict.
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        block_index_offset, num_of_blocks, specials_offset, self.num_of_terms = struct.unpack(
+            TRAILER_FORMAT, self.buffer[-struct.calcsize(TRAILER_FORMAT):])
+
+        first_terms_offset = block_index_offset + 8 * num_of_blocks
+        self.block_offsets = np.frombuffer(self.buffer[block_index_offset:first_terms_offset], dtype='<u8').tolist()
+        # The first terms are only decoded on the first lookup, so iterating over the terms (see terms())
+        # only keeps the offsets of the blocks in memory
+        self.first_terms_range = (first_terms_offset, specials_offset)
+        self.block_first_terms = None
+        self.specials = pickle.loads(self.buffer[specials_offset:])
+
+        self.loaded_specials = {}
+        self.cache = OrderedDict()  # term -> (df, pointer), or None if the term is not in the dictionary, least recently used first
+
+    def lookup(self, term):
+        """Find the (df, pointer) of a term
+
+        Args:
+            term (str): the term
+        Returns:
+            (int, int): the df and pointer of the term, or None if it is not in the dictionary
+        """
+        if term in self.cache:
+            self.cache.move_to_end(term)
+            return self.cache[term]
+
+        if self.block_first_terms is None:
+            first_terms_offset, specials_offset = self.first_terms_range
+            self.block_first_terms = self.buffer[first_terms_offset:specials_offset].decode('utf-8').split('\n') if len(self.block_offsets) else []
+
+        entry = None
+        block = bisect_right(self.block_first_terms, term) - 1
+        if block >= 0:
+            encoded_term = term.encode('utf-8')
+            for block_term, df, pointer in self.decode_block(block):
+                if block_term == encoded_term:
+                    entry = (df, pointer)
+                    break
+
+        self.cache[term] = entry
+        if len(self.cache) > TERM_CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return entry
+
+    def decode_block(self, block):
+        """Decode every entry of a term block
+
+        Args:
+            block (int): the number of the block
+        Yields:
+            (bytes, int, int): the term (utf-8 encoded), df and pointer of every entry in the block
+        """
+        count, offset = decode_number(self.buffer, self.block_offsets[block])
+        term = b''
+        for _ in range(count):
+            prefix_length, offset = decode_number(self.buffer, offset)
+            suffix_length, offset = decode_number(self.buffer, offset)
+            term = term[:prefix_length] + self.buffer[offset:offset + suffix_length]
+            offset += suffix_length
+            df, offset = decode_number(self.buffer, offset)
+            pointer, offset = decode_number(self.buffer, offset)
+            yield term, df, pointer
+
+    def terms(self):
+        """Iterate over every term of the dictionary, in sorted order
+
+        Yields:
+            (str, (int, int)): the term, and its df and pointer
+        """
+        for block in range(len(self.block_offsets)):
+            for term, df, pointer in self.decode_block(block):
+                yield term.decode('utf-8'), (df, pointer)
+
+    def __contains__(self, key):
+        return key in self.specials or self.lookup(key) is not None
+
+    def __getitem__(self, key):
+        if key in self.specials:
+            if key not in self.loaded_specials:
+                offset, length = self.specials[key]
+                self.loaded_specials[key] = pickle.loads(self.buffer[offset:offset + length])
+            return self.loaded_specials[key]
+
+        entry = self.lookup(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __len__(self):
+        return self.num_of_terms
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
+
+
+def load_dictionary(filename):
+    """
+    Open a dictionary file, either as a TermDictionary, or by unpickling it for indexes
+    written before the dictionary file format.
+
+    Args:
+        filename (str): the dictionary filename
+    Returns:
+        TermDictionary or dict: the dictionary
+    """
+    with open(filename, 'rb') as infile:
+        if infile.read(len(DICTIONARY_MAGIC)) != DICTIONARY_MAGIC:
+            infile.seek(0)
+            return pickle.load(infile)
+    return TermDictionary(filename)
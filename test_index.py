@@ -0,0 +1,40 @@
+import csv
+import os
+import random
+import subprocess
+import sys
+
+INDEX_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index.py')
+
+
+def write_corpus(filename, num_of_docs, seed=0):
+    """Write a small random corpus, in the csv format of the dataset"""
+    rng = random.Random(seed)
+    vocabulary = ['court', 'appeal', 'accused', 'reasonable', 'doubt', 'contract', 'damages', 'witness', 'phone', 'call',
+                  'evidence', 'sentence', 'judges', 'ruled', 'claims', 'running', 'cases', 'the', 'of', 'and']
+    with open(filename, 'w', newline='', encoding='UTF-8') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(['document_id', 'title', 'content', 'date_posted', 'court'])
+        for doc_id in rng.sample(range(1, 10 * num_of_docs), num_of_docs):
+            title = " ".join(rng.choice(vocabulary) for _ in range(5)).title()
+            content = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(20, 200)))
+            writer.writerow([doc_id, title, content, '20{:02d}-0{}-12 00:00:00'.format(rng.randint(0, 20), rng.randint(1, 9)),
+                             rng.choice(['SG Court of Appeal', 'UK House of Lords', 'HK High Court'])])
+
+
+def build(directory, corpus, num_workers):
+    """Build an index of the corpus in directory, with num_workers processes, and return the bytes of its files"""
+    os.mkdir(directory)
+    subprocess.run([sys.executable, INDEX_SCRIPT, '-i', corpus, '-d', 'dictionary.txt', '-p', 'postings.txt',
+                    '-j', str(num_workers), '--block-mem', '64K'], cwd=directory, check=True, stdout=subprocess.DEVNULL)
+    files = {}
+    for filename in ('dictionary.txt', 'postings.txt'):
+        with open(os.path.join(directory, filename), 'rb') as infile:
+            files[filename] = infile.read()
+    return files
+
+
+def test_parallel_build_is_identical(tmp_path):
+    corpus = str(tmp_path / 'corpus.csv')
+    write_corpus(corpus, 300)
+    assert build(tmp_path / 'serial', corpus, 1) == build(tmp_path / 'parallel', corpus, 3)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from constants import SKIP_MIN_POSTINGS
+from posting_codec import (encode_posting_list, decode_posting_list, decode_header, decode_doc_region,
+                           decode_position_region, get_skip_interval)
+
+
+def make_posting_list(num_of_postings, seed=0):
+    """Make a random posting list, as (doc ids, term frequencies, positions)"""
+    rng = np.random.default_rng(seed)
+    doc_ids = np.cumsum(rng.integers(1, 300, num_of_postings))
+    tfs = rng.integers(1, 6, num_of_postings)
+    positions = np.concatenate([np.sort(rng.choice(5000, tf, replace=False)) for tf in tfs])
+    return doc_ids, tfs, positions
+
+
+def split_record(record):
+    offset, doc_length, position_length = decode_header(record)
+    return record[offset:offset + doc_length], record[offset + doc_length:offset + doc_length + position_length]
+
+
+@pytest.mark.parametrize("num_of_postings", [1, 7, SKIP_MIN_POSTINGS - 1, SKIP_MIN_POSTINGS, 3 * SKIP_MIN_POSTINGS + 5])
+def test_round_trip(num_of_postings):
+    doc_ids, tfs, positions = make_posting_list(num_of_postings)
+    decoded = decode_posting_list(encode_posting_list(doc_ids, tfs, positions))
+    for expected, actual in zip((doc_ids, tfs, positions), decoded):
+        assert np.array_equal(expected, actual)
+
+
+@pytest.mark.parametrize("num_of_postings", [7, SKIP_MIN_POSTINGS, 3 * SKIP_MIN_POSTINGS + 5])
+def test_targets(num_of_postings):
+    doc_ids, tfs, positions = make_posting_list(num_of_postings, seed=1)
+    doc_region, position_region = split_record(encode_posting_list(doc_ids, tfs, positions))
+    # Doc ids of the list, at both ends of a block and at the ends of the list, and doc ids missing from it
+    interval = get_skip_interval(num_of_postings) or num_of_postings
+    present = doc_ids[np.unique(np.minimum(np.r_[0, interval - 1, interval, num_of_postings // 2], num_of_postings - 1))]
+    targets = np.unique(np.r_[present, doc_ids[0] - 1, doc_ids[-1] + 1])
+
+    selected_doc_ids, selected_tfs, selected = decode_doc_region(doc_region, targets)
+    assert np.array_equal(selected_doc_ids, doc_ids[selected])
+    assert np.array_equal(selected_tfs, tfs[selected])
+    assert np.isin(present, selected_doc_ids).all()
+    if get_skip_interval(num_of_postings):
+        # Only the blocks of the targets are decoded
+        assert len(selected) <= len(targets) * interval
+
+    posting_starts = np.cumsum(tfs) - tfs
+    expected_positions = np.concatenate([positions[posting_starts[i]:posting_starts[i] + tfs[i]] for i in selected])
+    assert np.array_equal(decode_position_region(position_region, tfs, selected), expected_positions)
@@ -0,0 +1,33 @@
+import pytest
+
+from word_processing import tokenize, nltk_tokenize
+
+
+# Texts that word_tokenize handles in a surprising way, with the tokens it gives once sanitised
+TOKENIZER_CASES = [
+    ("I wanna", ['I', 'wan', 'na']),
+    ("I wanna.", ['I', 'wan', 'na']),
+    ("I wanna, go", ['I', 'wan', 'na', 'go']),
+    ("wanna)", ['wan', 'na']),
+    ("I cannot.", ['I', 'can', 'not']),
+    ("1:5-wanna", ['1:5-', 'wan', 'na']),
+    ("3,000x-gotta", ['3,000x-', 'got', 'ta']),
+    ("gimme's'", ['gim', 'me', 's']),
+    ("para'1/2", ['para', '1', '2']),
+    ("held'1:5", ['held', '1', '5']),
+    ("x'1,5 y", ['x', '1', '5', 'y']),
+    ("a '1/2 b", ['a', '1/2', 'b']),
+    ("2.5-'x", ['2.5-', 'x']),
+    ("1/2.)", ['1/2']),
+    ("$3.88 (roughly 3,36 euros)", ['$', '3.88', 'roughly', '3,36', 'euros']),
+    ("the court's", ['the', 'court', 's']),
+    ("don't", ['do', 'n', 't']),
+    ("don't's", ['do', 'n', 't', 's']),
+    ("don't'll", ['don', 't', 'll']),
+]
+
+
+@pytest.mark.parametrize("text, tokens", TOKENIZER_CASES)
+def test_tokenize_matches_word_tokenize(text, tokens):
+    assert nltk_tokenize(text) == tokens
+    assert tokenize(text) == tokens
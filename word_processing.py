@@ -4,6 +4,8 @@ from constants import *
 from nltk.corpus import stopwords
 
 import nltk
+import os
+import pickle
 import regex
 
 nltk.download('stopwords')
@@ -15,16 +17,201 @@ tag_map['J'] = wn.ADJ
 tag_map['V'] = wn.VERB
 tag_map['R'] = wn.ADV
 
+# Stop words, looked up once per token
+stop_words = frozenset(stopwords.words('english'))
 
-def lemmatize(token_list):
+# Characters after which word_tokenize always starts a new token
+TOKEN_BREAKS = r'\s$;@#%&?!*()\[\]{}<>"`\'«“‘„»”’\u2012-\u2015'
+
+# A period that word_tokenize splits off: part of an ellipsis, or the end of a sentence
+PERIOD_END = r"""\.(?:\.|[\]\)}>"'»”’ ]*\s*$|\s+[A-Z])"""
+
+# Where word_tokenize ends a token: a space, a character it pads with spaces, a period it splits off,
+# or a quote that is split off before the clitics are (when it is followed by a character padded earlier)
+TOKEN_END = (r"""(?:\s|$|--|''|[;@#$%&?!*()\[\]{{}}<>"`«“‘„»”’\u2012-\u2015]|[,:](?![0-9])|{0}"""
+             r"""|(?<=[^'])'(?=\s|[;@#$%&?!«“‘„`\u2012-\u2015]|[,:](?![0-9])|{0}))""").format(PERIOD_END)
+
+# A clitic ('s, 'll, n't, ...) that word_tokenize splits off the end of a token.
+# 'll, 're, 've and n't are split off by a second pass, so they are also split off before a clitic of the first one ('s, 'm, 'd)
+CLITIC = r"""(?<=[^'\s])'(?:[sSmMdD]?{0}|(?:ll|LL|re|RE|ve|VE)(?={0}|'[sSmMdD]?{0}))""".format(TOKEN_END)
+NOT_CLITIC = r"""(?<=[^'\s])(?:n't|N'T)(?={0}|'[sSmMdD]?{0})""".format(TOKEN_END)
+
+# The words word_tokenize splits in two (cannot -> can not, gonna -> gon na, ...), either part of them.
+# wanna is only split before a space, which is wherever word_tokenize ends a token once it padded the text.
+# Only the words are matched regardless of case, not what follows them
+SPLIT_WORD_END = r"(?-i:\b|{0})".format(NOT_CLITIC)
+WANNA_END = r"(?-i:{0}|{1}|{2})".format(TOKEN_END, CLITIC, NOT_CLITIC)
+SPLIT_WORD = (r"(?i:(?<!\w)(?:can(?=not{0})|gim(?=me{0})|gon(?=na{0})|got(?=ta{0})|lem(?=me{0})|wan(?=na{1}))"
+              r"|not(?<=(?<!\w)cannot)(?={0})|me(?<=(?<!\w)(?:gim|lem)me)(?={0})|na(?<=(?<!\w)gonna)(?={0})"
+              r"|ta(?<=(?<!\w)gotta)(?={0})|na(?<=(?<!\w)wanna)(?={1}))").format(SPLIT_WORD_END, WANNA_END)
+
+# A single pass equivalent of word_tokenize followed by sanitise_word (see tokenize()). The alternatives are:
+#   a numeric token (see is_numeric()), kept whole up to where word_tokenize would end it, without a sentence final period.
+#     A quote only splits it when it does not follow a word character: para'1/2 is a single word of word_tokenize
+#   a part of a word split in two
+#   $ and --, which word_tokenize always splits off
+#   a run of the characters kept by sanitise_word, stopping before a split word or n't (don't -> do n't)
+#   the n of n't
+TOKEN_PATTERN = regex.compile(
+    r"(?:(?<![^{0}])(?<!\w')|(?<=--|\.\.))[0-9]+(?:[^0-9{0}]|')[0-9]+"
+    r"(?:(?!(?=[nN'cCgGlLwWmMtT])(?:{1}|{2}|{3}))"
+    r"(?:[^,:.\-{0}]|[,:](?=[0-9])|(?!{4})\.|-(?!-)|'(?!')(?:(?<=\w')|(?!\w)|(?i:(?=(?:re|ve|ll|m|t|s|d|n)\b)))))*"
+    r"|{3}"
+    r"|\$|--"
+    r"|(?:(?!(?=[nNcCgGlLwWmMtT])(?:{1}|{3}))(?!\$)[a-zA-Z0-9_\p{{Sc}}]|-(?!-))+"
+    r"|[nN]".format(TOKEN_BREAKS, NOT_CLITIC, CLITIC, SPLIT_WORD, PERIOD_END))
+
+
+class NormalisationMemo:
+    """A bounded memo of normalised terms, shared by stem(), lemmatize() and lemmatize_and_stem().
+
+    The vocabulary of the judgments is very repetitive, so the same tokens are lemmatized and stemmed
+    over and over. Every result is stored under (normalisation, lowercased token, wordnet POS), the POS
+    being None for stemming alone. Once max_entries is reached, the oldest entries are dropped first.
+
+    index.py and search.py load the memo saved next to their index (<dictionary-file>.memo) before they start,
+    and save it at the end, so every run starts with the terms of the previous ones.
+    """
+
+    def __init__(self, max_entries, terms=None):
+        self.max_entries = max_entries
+        self.terms = terms if terms is not None else {}
+        self.hits = self.misses = 0
+
+        # Terms normalised since the last pop_new_terms(), recorded by the worker processes of index.py
+        self.new_terms = None
+
+    def normalise(self, kind, token, pos, normalise):
+        """Get the normalised form of a token, computing it on a miss
+
+        Args:
+            kind (str): the normalisation, e.g. 'stem'
+            token (str): the lowercased token
+            pos (str): the wordnet POS of the token, or None if the normalisation does not use it
+            normalise (function): normalises the token
+        Returns:
+            str: the normalised term
+        """
+        key = (kind, token, pos)
+        term = self.terms.get(key)
+        if term is not None:
+            self.hits += 1
+            return term
+
+        self.misses += 1
+        term = normalise()
+        self.add(key, term)
+        if self.new_terms is not None:
+            self.new_terms[key] = term
+        return term
+
+    def add(self, key, term):
+        if key in self.terms:
+            return
+        if len(self.terms) >= self.max_entries:
+            del self.terms[next(iter(self.terms))]
+        self.terms[key] = term
+
+    def pop_new_terms(self):
+        new_terms, self.new_terms = self.new_terms, {}
+        return new_terms
+
+    def get_hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def save(self, filename):
+        """Save the memo, replacing the file atomically
+
+        Args:
+            filename (str): the file to save it to
+        """
+        with open(filename + '.tmp', 'wb') as outfile:
+            pickle.dump(self.terms, outfile)
+        os.replace(filename + '.tmp', filename)
+
+    def load(self, filename):
+        """Replace the terms of the memo with the saved ones, if the file exists
+
+        Args:
+            filename (str): the file it was saved to
+        """
+        terms = None
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'rb') as infile:
+                    terms = pickle.load(infile)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                terms = None
+        if terms is not None:
+            self.terms = dict(list(terms.items())[-self.max_entries:]) if len(terms) > self.max_entries else terms
+
+
+memo = NormalisationMemo(NORMALISATION_MEMO_SIZE)
+
+# The lemma of every token lemmatized without a POS (USE_POS_TAGGER = False), see get_lemma()
+untagged_lemmas = {}
+
+
+def get_wordnet_tags(token_lists):
+    """Get the wordnet POS of every token of several lists of tokens.
+
+    The lists are tagged together, with a single call to the POS tagger (pos_tag_sents).
+    Without the tagger (USE_POS_TAGGER), every POS is None, see get_lemma().
+
+    Args:
+        token_lists (list(list(str))): Lists of tokens
+    Returns:
+        list(list(str)): the wordnet POS of every token
+    """
+    if not USE_POS_TAGGER:
+        return [[None] * len(token_list) for token_list in token_lists]
+    return [[tag_map[tag[0]] for _, tag in tagged] for tagged in nltk.pos_tag_sents(token_lists)]
+
+
+def get_lemma(token, pos):
+    """Lemmatize a token.
+
+    Without a POS, the token is lemmatized as a noun, a verb, an adjective then an adverb,
+    and the first lemma that differs from the token is kept. The lemma only depends on the
+    token, so it is computed once per token and kept in untagged_lemmas, which is not bounded
+    like the memo: it holds at most the vocabulary.
+
+    Args:
+        token (str): the lowercased token
+        pos (str): the wordnet POS of the token, or None
+    Returns:
+        str: the lemma
+    """
+    if pos is not None:
+        return lemmatizer.lemmatize(token, pos)
+    lemma = untagged_lemmas.get(token)
+    if lemma is None:
+        lemma = token
+        for pos in (wn.NOUN, wn.VERB, wn.ADJ, wn.ADV):
+            lemma = lemmatizer.lemmatize(token, pos)
+            if lemma != token:
+                break
+        untagged_lemmas[token] = lemma
+    return lemma
+
+
+def lemmatize(token_list, pos_list=None):
     """Lemmatize every token in a given list of tokens
 
     Args:
         token_list (list(str)): List of tokens
+        pos_list (list(str)): the wordnet POS of every token, if they were already tagged (see get_wordnet_tags())
     Returns:
         list(str): lemmatized list of tokens
     """
-    return [lemmatizer.lemmatize(token.lower(), tag_map[tag[0]]) for token, tag in nltk.pos_tag(token_list)]
+    if pos_list is None:
+        pos_list = get_wordnet_tags([token_list])[0]
+    result = []
+    for token, pos in zip(token_list, pos_list):
+        token = token.lower()
+        result.append(memo.normalise('lemmatize', token, pos, lambda: get_lemma(token, pos)))
+    return result
 
 
 def stem(token_list):
@@ -35,18 +222,29 @@ def stem(token_list):
     Returns:
         list(str): stemmed list of tokens
     """
-    return [stemmer.stem(token.lower()) for token in token_list]
+    result = []
+    for token in token_list:
+        token = token.lower()
+        result.append(memo.normalise('stem', token, None, lambda: stemmer.stem(token)))
+    return result
 
 
-def lemmatize_and_stem(token_list):
+def lemmatize_and_stem(token_list, pos_list=None):
     """Lemmatize then stem every token in a given list of tokens.
     
     Args:
         token_list (list(str)): List of tokens
+        pos_list (list(str)): the wordnet POS of every token, if they were already tagged (see get_wordnet_tags())
     Returns:
         list(str): lemmatized and stemmed list of tokens
     """
-    return [stemmer.stem(lemmatizer.lemmatize(token.lower(), tag_map[tag[0]])) for token, tag in nltk.pos_tag(token_list)]
+    if pos_list is None:
+        pos_list = get_wordnet_tags([token_list])[0]
+    result = []
+    for token, pos in zip(token_list, pos_list):
+        token = token.lower()
+        result.append(memo.normalise('lemmatize_and_stem', token, pos, lambda: stemmer.stem(get_lemma(token, pos))))
+    return result
 
 
 def sanitise(long_string):
@@ -61,33 +259,83 @@ def sanitise(long_string):
     Returns:
         list: list of filtered tokens
     """
-    # Tokenize
-    word_list = nltk.tokenize.word_tokenize(long_string)
-    
-    # Remove non-alphanumeric characters
-    sanitised_list = [sanitise_word(string) for string in word_list]
-    token_list = " ".join(sanitised_list).split()
+    return sanitise_texts([long_string])[0]
+
 
-    # Remove stop words
-    if (REMOVE_STOPWORDS):
-        removed_list = [token for token in token_list if token not in stopwords.words('english')]
-        token_list = removed_list
+def sanitise_texts(texts):
+    """Tokenize and sanitize several texts, see sanitise().
+
+    The tokens of all the texts are POS tagged together, which is much faster than
+    tagging every text on its own.
+
+    Args:
+        texts (list(str)): the texts
+    Returns:
+        list(list): list of filtered tokens of every text
+    """
+    token_lists = []
+    for long_string in texts:
+        # Tokenize and remove non-alphanumeric characters
+        if (USE_FAST_TOKENIZER):
+            token_list = tokenize(long_string)
+        else:
+            token_list = nltk_tokenize(long_string)
+
+        # Remove stop words
+        if (REMOVE_STOPWORDS):
+            removed_list = [token for token in token_list if token not in stop_words]
+            token_list = removed_list
+        token_lists.append(token_list)
 
     # Apply stemming and/or lemmatization
     if (USE_LEMMATIZER and USE_STEMMER):
-        token_list = lemmatize_and_stem(token_list)
+        pos_lists = get_wordnet_tags(token_lists)
+        token_lists = [lemmatize_and_stem(token_list, pos_list) for token_list, pos_list in zip(token_lists, pos_lists)]
     else:
         # This line is if you want to do lemmatization (prefer to do this before stemming, as stemming might not return a real word)
         if (USE_LEMMATIZER):
-            token_list = lemmatize(token_list)
-            
+            pos_lists = get_wordnet_tags(token_lists)
+            token_lists = [lemmatize(token_list, pos_list) for token_list, pos_list in zip(token_lists, pos_lists)]
+
         # This line is if you want to do stemming after or instead
         if (USE_STEMMER):
-            token_list = stem(token_list)
-    
-    return token_list
+            token_lists = [stem(token_list) for token_list in token_lists]
+
+    return token_lists
     
 
+def tokenize(long_string):
+    """Tokenize a text and remove any non-alphanumeric characters in a single pass.
+
+    This gives the same tokens as word_tokenize() followed by sanitise_word() (see nltk_tokenize()),
+    without tokenizing the text into sentences and words first, nor running a regex per word.
+    A period followed by a space and a capital letter is taken as the end of a sentence, so the two
+    can differ where the sentence tokenizer decides otherwise, e.g. after an abbreviation, but only
+    for the tokens that a sentence final period changes: a number, a split word (gonna -> gon na)
+    or a clitic before the period. See benchmark.py -c to compare them on a corpus, and
+    test_word_processing.py for the cases that word_tokenize handles in a surprising way.
+
+    Args:
+        long_string (str): the text
+    Returns:
+        list(str): list of tokens
+    """
+    return TOKEN_PATTERN.findall(long_string)
+
+
+def nltk_tokenize(long_string):
+    """Tokenize a text with word_tokenize(), then remove any non-alphanumeric characters of every word.
+
+    Args:
+        long_string (str): the text
+    Returns:
+        list(str): list of tokens
+    """
+    word_list = nltk.tokenize.word_tokenize(long_string)
+    sanitised_list = [sanitise_word(string) for string in word_list]
+    return " ".join(sanitised_list).split()
+
+
 def sanitise_word(string):
     """Remove any non-alphanumeric characters,
     